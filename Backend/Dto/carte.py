@@ -14,6 +14,7 @@ class MedicamentInCart(BaseModel):
     id: int
     name: str
     price: float
+    quantity: int = 1
 
     
 
@@ -33,11 +34,20 @@ class CartIn(BaseModel):
 
 
 
+class CartLineOut(BaseModel):
+    medicament_id: int
+    name: str
+    quantity: int
+    unit_price: float
+    line_total: float
+
+
 class CartOut(BaseModel):
     id: int
     patient_id: int
     total_price: float
     medicaments: List[MedicamentInCart]
     is_paid: bool = False
+    items: List[CartLineOut] = []
     
     
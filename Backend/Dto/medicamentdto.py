@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional
 
 class MedicamentBase(BaseModel):
     name: str
@@ -26,4 +26,23 @@ class MedicamentResponse(MedicamentBase):
     id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class MedicamentSearchResponse(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    items: List[MedicamentResponse]
+
+
+class StockMovementCreate(BaseModel):
+    kind: Literal["receipt", "return", "adjustment"]
+    # receipts and returns add stock; adjustments are signed
+    quantity: int
+    reference: Optional[str] = None
+
+
+class LowStockItem(BaseModel):
+    id: int
+    name: str
+    stock: int
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -12,9 +13,36 @@ class PrescriptionUpdate(BaseModel):
     content: Optional[str] = None
     medicament_ids: Optional[List[int]] = None
 
+class PrescribedMedicament(BaseModel):
+    id: int
+    name: str
+
+class InteractionOut(BaseModel):
+    medicament_ids: List[int]
+    medicaments: List[str]
+    severity: str  # contraindicated | major | moderate | minor
+    message: str
+
 class PrescriptionOut(BaseModel):
     id: int
     content: str
     appointment_id: int
     medicament_ids: List[int]
+    medicaments: List[PrescribedMedicament] = []
+    # Only filled when saving
+    interactions: List[InteractionOut] = []
 
+class InteractionCheck(BaseModel):
+    medicament_ids: List[int]
+
+class InteractionCheckOut(BaseModel):
+    interactions: List[InteractionOut]
+
+
+class SearchHit(BaseModel):
+    appointment_id: int
+    source: str  # note | prescription
+    rank: float
+    snippet: str  # matches wrapped in <b></b>
+    date: datetime
+    patient_id: int
@@ -1,6 +1,7 @@
+import asyncio
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from routes.auth_router import router as auth_router
 from routes.appointment_router import router as appointment_router
 from routes.users_router import router as users_router
@@ -12,6 +13,19 @@ from routes.cart_router import router as cart_router
 from routes.billing_router import router as billing_router
 from routes.message_router import router as message_router
 from routes.payment import router as payment_router
+from services.uploads import UploadLimitMiddleware
+from services.static_files import UploadStaticFiles
+from services.blob_store import load_aliases
+from services.catalog_cache import listen_for_changes, stop_listening
+from services.background import start_periodic, stop_all
+from services.reservations import release_expired
+from services.inventory import compact_and_reload
+from services.idempotency import purge_expired
+from services.payment_events import process_pending
+from services.carts import expire_abandoned
+from services.drug_interactions import load_rules
+from services.prescription_pdf import shutdown_pool
+from database import AsyncSessionLocal, engine
 
 
 app = FastAPI()
@@ -30,7 +44,8 @@ app.include_router(cart_router, prefix="/cart", tags=["Cart"])
 app.include_router(message_router, tags=["chat"])
 app.include_router(payment_router,prefix="/payment", tags=["payment"])
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_files = UploadStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 origins = [
     "http://localhost:3000",  # Your frontend URL
 ]
@@ -42,7 +57,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginated lists hand the next page's cursor in a header
+    expose_headers=["X-Next-Cursor"],
 )
+# Reject oversized uploads before their body is spooled to disk
+app.add_middleware(UploadLimitMiddleware)
+
+@app.on_event("startup")
+async def load_upload_aliases():
+    # Old uuid upload URLs keep working by redirecting to their content-addressed blob
+    try:
+        async with AsyncSessionLocal() as db:
+            static_files.aliases = await load_aliases(db)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Upload aliases not loaded: {e}")
+
+@app.on_event("startup")
+async def load_interaction_rules():
+    # Compiled once; prescriptions are checked against it on save and by /prescriptions/check
+    load_rules()
+
+@app.on_event("startup")
+async def start_catalog_listener():
+    # Catalog writes on other workers invalidate this worker's cached pages
+    app.state.catalog_listener = asyncio.create_task(listen_for_changes(engine))
+
+@app.on_event("shutdown")
+async def stop_catalog_listener():
+    # Cancels the LISTEN loop, which closes its connection on the way out
+    await stop_listening(getattr(app.state, "catalog_listener", None))
+
+@app.on_event("startup")
+async def start_background_jobs():
+    start_periodic("release expired stock reservations", 60, release_expired)
+    start_periodic("compact stock ledger", 300, compact_and_reload)
+    start_periodic("purge expired idempotency keys", 3600, purge_expired)
+    start_periodic("apply payment webhook events", 2, process_pending)
+    start_periodic("expire abandoned carts", 3600, expire_abandoned)
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    await stop_all()
+    # Otherwise the render workers outlive the app
+    shutdown_pool()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,6 @@
+-- Cart activity clock and indexes for the active-cart lookup and the abandoned cart sweeper.
+-- psql "$DATABASE_URL" -f migrations/001_carts_updated_at.sql
+ALTER TABLE carts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE;
+-- Existing carts are left NULL: the sweeper stamps them on its first run, so their idle clock starts then
+CREATE INDEX IF NOT EXISTS ix_carts_patient_id_is_paid ON carts (patient_id, is_paid);
+CREATE INDEX IF NOT EXISTS ix_carts_is_paid_updated_at ON carts (is_paid, updated_at);
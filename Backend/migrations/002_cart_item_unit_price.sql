@@ -0,0 +1,4 @@
+-- Price each cart line was sold at, stamped at checkout so sales history doesn't move with price changes.
+-- psql "$DATABASE_URL" -f migrations/002_cart_item_unit_price.sql
+ALTER TABLE cart_item ADD COLUMN IF NOT EXISTS unit_price DOUBLE PRECISION;
+-- Carts paid before the column existed keep NULL and are valued at the current price
@@ -0,0 +1,16 @@
+-- Content-addressed uploads with reference counts, and the redirects from pre-migration upload paths.
+-- psql "$DATABASE_URL" -f migrations/003_upload_blobs.sql
+CREATE TABLE IF NOT EXISTS upload_blobs (
+    hash VARCHAR(64) PRIMARY KEY,
+    path VARCHAR(255) NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    released_at TIMESTAMP WITHOUT TIME ZONE
+);
+CREATE TABLE IF NOT EXISTS upload_aliases (
+    legacy_path VARCHAR(255) PRIMARY KEY,
+    blob_hash VARCHAR(64) NOT NULL REFERENCES upload_blobs (hash) ON DELETE CASCADE
+);
+-- Existing uploads are registered (and renamed to their hash) by: python -m services.blob_store migrate
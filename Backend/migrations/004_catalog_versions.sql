@@ -0,0 +1,8 @@
+-- Version counter of the cached medicament catalog, bumped by every catalog write.
+-- psql "$DATABASE_URL" -f migrations/004_catalog_versions.sql
+CREATE TABLE IF NOT EXISTS catalog_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+-- No row needed: a missing counter reads as version 0 and the first write inserts it
@@ -0,0 +1,14 @@
+-- Stock held by unpaid cart lines until they expire.
+-- psql "$DATABASE_URL" -f migrations/005_stock_reservations.sql
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id SERIAL PRIMARY KEY,
+    cart_id INTEGER NOT NULL REFERENCES carts (id) ON DELETE CASCADE,
+    medicament_id INTEGER NOT NULL REFERENCES medicaments (id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    CONSTRAINT uq_stock_reservations_cart_medicament UNIQUE (cart_id, medicament_id)
+);
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_id ON stock_reservations (id);
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_expires ON stock_reservations (expires_at);
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_medicament_expires ON stock_reservations (medicament_id, expires_at);
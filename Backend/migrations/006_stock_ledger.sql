@@ -0,0 +1,37 @@
+-- Append-only stock ledger and its compaction snapshots, opened from the current medicaments.stock.
+-- psql "$DATABASE_URL" -f migrations/006_stock_ledger.sql
+-- Run it while the previous version is stopped: stock written to medicaments.stock afterwards is not carried over.
+BEGIN;
+CREATE TABLE IF NOT EXISTS stock_movements (
+    id BIGSERIAL PRIMARY KEY,
+    medicament_id INTEGER NOT NULL REFERENCES medicaments (id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL,
+    quantity INTEGER NOT NULL,
+    reference VARCHAR(100),
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+CREATE INDEX IF NOT EXISTS ix_stock_movements_medicament_id_id ON stock_movements (medicament_id, id);
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    medicament_id INTEGER PRIMARY KEY REFERENCES medicaments (id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    last_movement_id BIGINT NOT NULL DEFAULT 0,
+    taken_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Opening balance: the stock each medicament has now enters the ledger as a receipt,
+-- like the initial stock of a new medicament. Medicaments already in the ledger are skipped.
+INSERT INTO stock_movements (medicament_id, kind, quantity, reference)
+SELECT m.id, 'receipt', m.stock, 'opening'
+FROM medicaments m
+WHERE m.stock <> 0
+  AND NOT EXISTS (SELECT 1 FROM stock_movements s WHERE s.medicament_id = m.id)
+  AND NOT EXISTS (SELECT 1 FROM stock_snapshots s WHERE s.medicament_id = m.id);
+
+-- ...already folded, as compaction would leave it
+INSERT INTO stock_snapshots (medicament_id, quantity, last_movement_id)
+SELECT m.id, COALESCE(SUM(s.quantity), 0), COALESCE(MAX(s.id), 0)
+FROM medicaments m
+LEFT JOIN stock_movements s ON s.medicament_id = m.id
+GROUP BY m.id
+ON CONFLICT (medicament_id) DO NOTHING;
+COMMIT;
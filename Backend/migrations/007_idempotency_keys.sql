@@ -0,0 +1,13 @@
+-- Stored responses of requests sent with an Idempotency-Key header.
+-- psql "$DATABASE_URL" -f migrations/007_idempotency_keys.sql
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(50) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response_body TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
@@ -0,0 +1,13 @@
+-- Inbox of verified payment webhook events, applied once each by the background worker.
+-- psql "$DATABASE_URL" -f migrations/008_payment_events.sql
+CREATE TABLE IF NOT EXISTS payment_events (
+    id VARCHAR(255) PRIMARY KEY,
+    type VARCHAR(100) NOT NULL,
+    payload TEXT NOT NULL,
+    received_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    processed_at TIMESTAMP WITHOUT TIME ZONE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_payment_events_received_at ON payment_events (received_at);
+CREATE INDEX IF NOT EXISTS ix_payment_events_processed_at ON payment_events (processed_at);
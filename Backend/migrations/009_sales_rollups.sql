@@ -0,0 +1,11 @@
+-- Daily sales per medicament and payment method, kept by checkout.
+-- psql "$DATABASE_URL" -f migrations/009_sales_rollups.sql
+CREATE TABLE IF NOT EXISTS sales_rollups (
+    day DATE NOT NULL,
+    medicament_id INTEGER NOT NULL,
+    payment_method VARCHAR(50) NOT NULL,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, medicament_id, payment_method)
+);
+-- Past sales are filled in from paid carts by: python -m services.sales backfill
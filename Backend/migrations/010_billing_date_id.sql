@@ -0,0 +1,4 @@
+-- Index behind the billing keyset pagination and the streamed export (newest first by date, id).
+-- psql "$DATABASE_URL" -f migrations/010_billing_date_id.sql
+-- CONCURRENTLY keeps billing writable while it builds; it can't run inside a transaction block.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_billing_date_id ON billing (date, id);
@@ -0,0 +1,6 @@
+-- GIN indexes behind the doctor's history search. The expressions must stay identical to
+-- models.text_search.search_vector, or Postgres won't use them (test_text_search checks it).
+-- psql "$DATABASE_URL" -f migrations/011_full_text_indexes.sql
+-- CONCURRENTLY keeps the tables writable while they build; it can't run inside a transaction block.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_appointments_note_fts ON appointments USING gin (to_tsvector('simple', note));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_prescriptions_content_fts ON prescriptions USING gin (to_tsvector('simple', content));
@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, Float, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, Float, ForeignKey
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -10,7 +12,16 @@ class Cart(Base):
     patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"))
     total_price = Column(Float, default=0.0)
     is_paid = Column(Boolean, default=False)  # Add this column
+    # Bumped on every write to the cart, the abandoned cart sweeper expires idle ones.
+    # Existing databases get it and the indexes below from migrations/001_carts_updated_at.sql
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     patient = relationship("Patient", backref="carts")
+
+    __table_args__ = (
+        # Active cart lookup: patient_id = ? AND is_paid = false
+        Index("ix_carts_patient_id_is_paid", "patient_id", "is_paid"),
+        Index("ix_carts_is_paid_updated_at", "is_paid", "updated_at"),
+    )
 from models.carte_items import cart_medicament  # 👈 This must be before the relationship is used
 medicaments = relationship("Medicament", secondary=cart_medicament, backref="carts")
 
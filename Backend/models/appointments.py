@@ -1,6 +1,7 @@
 from sqlalchemy import Column, DateTime, Integer, String, ForeignKey, Date, Text
 from sqlalchemy.orm import relationship
 from database import Base  # Assuming Base is from your database setup
+from models.text_search import full_text_index
 
 class Appointment(Base):
     __tablename__ = 'appointments'
@@ -12,6 +13,11 @@ class Appointment(Base):
     status = Column(String, nullable=False)
     note = Column(Text, nullable=True)
 
+    __table_args__ = (
+        # Doctors search their appointment notes
+        full_text_index("ix_appointments_note_fts", note),
+    )
+
     # Relationships
     patient = relationship("Patient", back_populates="appointments")
     medecin = relationship("Medecin", back_populates="appointments")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Float, Integer, String, ForeignKey
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -14,6 +14,11 @@ class Billing(Base):
     payment_method = Column(String)
     date = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset pagination and exports walk billings newest first (migrations/010_billing_date_id.sql)
+        Index("ix_billing_date_id", "date", "id"),
+    )
+
     # ✅ use string reference
 from models.Carts import Cart  # ✅ Ensures Cart is now defined
 Billing.cart = relationship("Cart")
@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Integer, ForeignKey
+from sqlalchemy import Table, Column, Float, Integer, ForeignKey
 
 from database import Base
 
@@ -7,5 +7,7 @@ cart_medicament = Table(
     Base.metadata,
     Column("cart_id", Integer, ForeignKey("carts.id", ondelete="CASCADE"), primary_key=True,autoincrement=True ),
     Column("medicament_id", Integer, ForeignKey("medicaments.id", ondelete="CASCADE"), primary_key=True),
-    Column("quantity", Integer, nullable=False, default=1)
+    Column("quantity", Integer, nullable=False, default=1),
+    # Price the line was sold at, stamped at checkout (migrations/002_cart_item_unit_price.sql)
+    Column("unit_price", Float, nullable=True),
 )
\ No newline at end of file
@@ -0,0 +1,15 @@
+from sqlalchemy import BigInteger, Column, DateTime, String
+from datetime import datetime
+
+from database import Base
+
+
+class CatalogVersion(Base):
+    """
+    One counter per cached catalog, bumped in the same transaction as every write to it.
+    """
+    __tablename__ = "catalog_versions"  # existing databases: migrations/004_catalog_versions.sql
+
+    name = Column(String(50), primary_key=True)  # "medicaments"
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from datetime import datetime
+
+from database import Base
+
+
+class IdempotencyKey(Base):
+    """
+    First response given for an Idempotency-Key, replayed to retries until `expires_at`.
+    `status_code` stays NULL while the first request is still running.
+    """
+    __tablename__ = "idempotency_keys"  # existing databases: migrations/007_idempotency_keys.sql
+
+    scope = Column(String(50), primary_key=True)  # "billing", "payment"
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
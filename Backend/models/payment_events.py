@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from datetime import datetime
+
+from database import Base
+
+
+class PaymentEvent(Base):
+    """
+    Inbox of payment provider webhook events, one row per provider event id.
+    `processed_at` stays NULL until the worker has applied the event.
+    """
+    __tablename__ = "payment_events"  # existing databases: migrations/008_payment_events.sql
+
+    id = Column(String(255), primary_key=True)  # provider event id ("evt_...")
+    type = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    processed_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
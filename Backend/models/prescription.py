@@ -1,13 +1,18 @@
 from sqlalchemy import Column, Integer, String, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from database import Base
+from models.text_search import full_text_index
 class Prescription(Base):
     __tablename__ = 'prescriptions'
 
     id = Column(Integer, primary_key=True, index=True)
     appointment_id = Column(Integer, ForeignKey('appointments.id', ondelete='CASCADE'), unique=True)
     content = Column(Text, nullable=False)
-    
+
+    __table_args__ = (
+        # Doctors search their prescriptions by content
+        full_text_index("ix_prescriptions_content_fts", content),
+    )
 
     # Relationships
     appointment = relationship("Appointment", back_populates="prescriptions")
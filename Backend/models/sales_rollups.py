@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Date, Float, Integer, String
+
+from database import Base
+
+
+class SalesRollup(Base):
+    """
+    Units sold and revenue per day, medicament and payment method. Kept up
+    to date by checkout, rebuilt from paid carts by the backfill.
+    """
+    __tablename__ = "sales_rollups"  # existing databases: migrations/009_sales_rollups.sql
+
+    day = Column(Date, primary_key=True)
+    # No foreign key: sales history outlives medicaments removed from the catalog
+    medicament_id = Column(Integer, primary_key=True)
+    payment_method = Column(String(50), primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
@@ -0,0 +1,38 @@
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, String
+from datetime import datetime
+
+from database import Base
+
+MOVEMENT_KINDS = ("receipt", "sale", "adjustment", "return")
+
+
+class StockMovement(Base):
+    """
+    Append-only stock ledger: rows are only ever inserted. `quantity` is
+    signed (sales are negative).
+    """
+    __tablename__ = "stock_movements"  # existing databases: migrations/006_stock_ledger.sql
+
+    id = Column(BigInteger, primary_key=True)
+    medicament_id = Column(Integer, ForeignKey("medicaments.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(20), nullable=False)  # one of MOVEMENT_KINDS
+    quantity = Column(Integer, nullable=False)
+    reference = Column(String(100), nullable=True)  # "cart:12", "admin", "import"...
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_movements_medicament_id_id", "medicament_id", "id"),
+    )
+
+
+class StockSnapshot(Base):
+    """
+    Stock of a medicament once every movement up to `last_movement_id` is applied.
+    Current stock = quantity + movements with a greater id.
+    """
+    __tablename__ = "stock_snapshots"  # existing databases: migrations/006_stock_ledger.sql
+
+    medicament_id = Column(Integer, ForeignKey("medicaments.id", ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    last_movement_id = Column(BigInteger, nullable=False, default=0)
+    taken_at = Column(DateTime, default=datetime.utcnow, nullable=False)
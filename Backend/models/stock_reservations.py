@@ -0,0 +1,25 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, UniqueConstraint
+from datetime import datetime
+
+from database import Base
+
+
+class StockReservation(Base):
+    """
+    Stock held for an unpaid cart line until `expires_at`. Available stock is
+    `medicaments.stock` minus the unexpired holds of other carts.
+    """
+    __tablename__ = "stock_reservations"  # existing databases: migrations/005_stock_reservations.sql
+
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
+    medicament_id = Column(Integer, ForeignKey("medicaments.id", ondelete="CASCADE"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("cart_id", "medicament_id", name="uq_stock_reservations_cart_medicament"),
+        Index("ix_stock_reservations_medicament_expires", "medicament_id", "expires_at"),
+        Index("ix_stock_reservations_expires", "expires_at"),
+    )
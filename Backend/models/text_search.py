@@ -0,0 +1,41 @@
+from sqlalchemy import DDL, Column, Index, Table, event, func, literal_column
+
+# Text search configuration, inlined as a constant so queries match the index expression
+SEARCH_CONFIG = literal_column("'simple'")
+
+
+def search_vector(column):
+    return func.to_tsvector(SEARCH_CONFIG, column)
+
+
+def full_text_index(name: str, column: Column) -> Index:
+    """
+    Full-text index on `column`, for the model's __table_args__, kept
+    current on every write.
+
+    Postgres: GIN index on to_tsvector('simple', column), maintained by the
+    database itself; existing databases get it from
+    migrations/011_full_text_indexes.sql. SQLite (tests): external-content
+    FTS5 table <table>_fts kept in sync by triggers.
+    """
+    index = Index(name, search_vector(column), postgresql_using="gin").ddl_if(dialect="postgresql")
+    event.listen(index, "after_parent_attach", lambda index, table: _fts5_mirror(table, column.name))
+    return index
+
+
+def _fts5_mirror(table: Table, name: str):
+    fts = f"{table.name}_fts"
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({name}, content='{table.name}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table.name} BEGIN "
+        f"INSERT INTO {fts}(rowid, {name}) VALUES (new.id, new.{name}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {name}) VALUES ('delete', old.id, old.{name}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {name} ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {name}) VALUES ('delete', old.id, old.{name}); "
+        f"INSERT INTO {fts}(rowid, {name}) VALUES (new.id, new.{name}); END",
+    ]
+    for statement in statements:
+        event.listen(table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(table, "before_drop", DDL(f"DROP TABLE IF EXISTS {fts}").execute_if(dialect="sqlite"))
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, DateTime, Integer, String, ForeignKey
+from datetime import datetime
+
+from database import Base
+
+
+class UploadBlob(Base):
+    __tablename__ = "upload_blobs"  # existing databases: migrations/003_upload_blobs.sql
+
+    hash = Column(String(64), primary_key=True)  # sha256 of the file content
+    path = Column(String(255), nullable=False, unique=True)  # public path, /static/uploads/<hash>.jpg
+    size = Column(Integer, nullable=False)
+    content_type = Column(String(50), nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Last time ref_count dropped to 0, garbage collection waits a grace period after it
+    released_at = Column(DateTime, nullable=True)
+
+
+class UploadAlias(Base):
+    """
+    Maps a pre-migration upload path (uuid file name) to the blob now holding its content.
+    """
+    __tablename__ = "upload_aliases"  # existing databases: migrations/003_upload_blobs.sql
+
+    legacy_path = Column(String(255), primary_key=True)
+    blob_hash = Column(String(64), ForeignKey("upload_blobs.hash", ondelete="CASCADE"), nullable=False)
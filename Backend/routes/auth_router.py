@@ -20,8 +20,7 @@ from models.admins import Admin
 from pydantic import BaseModel
 from typing import Optional, List
 from Dto.userdto import UserRequest
-import shutil
-from uuid import uuid4
+from services.blob_store import store_upload, acquire, release
 from google.oauth2 import id_token
 from google.auth.transport import requests
 
@@ -65,21 +64,8 @@ async def register_patient(
     # Handle file upload if photo is provided
     photo_path = None
     if photo:
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join("static", "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(photo.filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(photo.file, buffer)
-        
-        # Store the relative path to be saved in the database
-        photo_path = f"/static/uploads/{unique_filename}"
+        photo_path = await store_upload(db, photo, "photo")
+        await acquire(db, photo_path)
     
     # Hash the password
     hashed_password = hash_password(password)
@@ -145,21 +131,8 @@ async def register_doctor(
     # Handle file upload if photo is provided
     photo_path = None
     if photo:
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join("static", "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(photo.filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(photo.file, buffer)
-        
-        # Store the relative path to be saved in the database
-        photo_path = f"/static/uploads/{unique_filename}"
+        photo_path = await store_upload(db, photo, "photo")
+        await acquire(db, photo_path)
     
     # Hash the password
     hashed_password = hash_password(password)
@@ -295,6 +268,7 @@ async def delete_doctor(request: DoctorDeleteRequest, db: AsyncSession = Depends
         
         # Store email for sending notification later
         doctor_email = user.email
+        await release(db, user.photo)
         
         # Execute raw SQL to delete records
         # First delete from medecins table
@@ -1,21 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models.billing import Billing
 from models.Carts import Cart
 from database import get_db
 from Dto.billingdto import BillingCreate, BillingUpdate, BillingOut
-from typing import List
-from datetime import timezone
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
 
-from models.medicaments import Medicament
-from models.carte_items import cart_medicament
+from services.billings import billing_filters, billing_page, export_billings
+from services.catalog_cache import catalog_cache
+from services.checkout import settle_cart, unsettle_cart
+from services.idempotency import idempotent
+from services.sales import move_sale
 
 router = APIRouter()
 
 # Create Billing
 @router.post("/add", response_model=BillingOut)
-async def create_billing(billing: BillingCreate, db: AsyncSession = Depends(get_db)):
+async def create_billing(
+    billing: BillingCreate,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    if idempotency_key is None:
+        return await _create_billing(billing, db)
+    # Retried requests get the first response instead of a second billing row
+    return await idempotent(
+        "billing",
+        idempotency_key,
+        billing.model_dump(mode="json"),
+        lambda: _create_billing(billing, db),
+        lambda created: BillingOut.model_validate(created, from_attributes=True).model_dump(mode="json"),
+    )
+
+async def _create_billing(billing: BillingCreate, db: AsyncSession):
     try:
         naive_date = billing.date
         if billing.date.tzinfo is not None:
@@ -48,42 +68,8 @@ async def create_billing(billing: BillingCreate, db: AsyncSession = Depends(get_
                 else:
                     raise HTTPException(status_code=400, detail="Cart is already paid but no billing record found")
                 
-            # Mark the cart as paid
-            cart.is_paid = True
-            print(f"Marking cart {billing.cart_id} as paid")
-            
-            # Update medicament stock based on cart items
-            try:
-                # Get all items in the cart with their quantities
-                cart_items_result = await db.execute(
-                    select(cart_medicament.c.medicament_id, cart_medicament.c.quantity)
-                    .where(cart_medicament.c.cart_id == billing.cart_id)
-                )
-                cart_items = cart_items_result.all()
-                
-                # Update stock for each medicament
-                for item in cart_items:
-                    medicament_id = item.medicament_id
-                    quantity = item.quantity
-                    
-                    # Get the medicament
-                    medicament_result = await db.execute(
-                        select(Medicament).where(Medicament.id == medicament_id)
-                    )
-                    medicament = medicament_result.scalar_one_or_none()
-                    
-                    if medicament and medicament.stock is not None:
-                        # Decrease the stock
-                        medicament.stock = max(0, medicament.stock - quantity)
-                        db.add(medicament)
-                        print(f"Updated stock for medicament {medicament_id}: new stock = {medicament.stock}")
-                
-                # Commit the stock updates
-                await db.flush()
-            except Exception as stock_error:
-                print(f"Error updating medicament stock: {stock_error}")
-                # Continue with billing creation even if stock update fails
-                # We don't want to prevent the billing from being created if stock update fails
+            # Take the cart's lines out of stock and mark it paid, 409 if stock ran out
+            await settle_cart(db, cart, billing.payment_method, naive_date.date())
 
         db_billing = Billing(
             order_id=billing.order_id,
@@ -95,6 +81,7 @@ async def create_billing(billing: BillingCreate, db: AsyncSession = Depends(get_
         )
         db.add(db_billing)
         await db.commit()
+        catalog_cache.forget_stock()
         await db.refresh(db_billing)
         return db_billing
     except HTTPException as e:
@@ -119,13 +106,39 @@ async def get_billings_by_cart(cart_id: int, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Get All Billings
+# Get All Billings, newest first, one page at a time
 @router.get("/all", response_model=List[BillingOut])
-async def get_all_billings(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Billing))
-    billings = result.scalars().all()
+async def get_all_billings(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    payment_method: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    criteria = billing_filters(date_from, date_to, payment_method)
+    billings, next_cursor = await billing_page(db, criteria, limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
     return billings
 
+# Export billings with their cart and patient, streamed (declared before /{billing_id})
+@router.get("/export")
+async def export_all_billings(
+    format: Literal["csv", "ndjson"] = "csv",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    payment_method: Optional[str] = None
+):
+    criteria = billing_filters(date_from, date_to, payment_method)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_billings(criteria, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="billings.{format}"'},
+    )
+
 # Get Billing by ID
 @router.get("/{billing_id}", response_model=BillingOut)
 async def get_billing_by_id(billing_id: int, db: AsyncSession = Depends(get_db)):
@@ -145,30 +158,37 @@ async def update_billing(billing_id: int, billing_update: BillingUpdate, db: Asy
     if billing_update.date.tzinfo is not None:
         naive_date = billing_update.date.astimezone(timezone.utc).replace(tzinfo=None)
 
+    try:
+        # Stock and sales rollups follow the billing through the checkout service,
+        # before the billing row changes (the reversal reads its day and method)
+        if billing.cart_id != billing_update.cart_id:
+            if billing.cart_id:
+                old_cart = await db.get(Cart, billing.cart_id)
+                if old_cart and old_cart.is_paid:
+                    await unsettle_cart(db, old_cart)
 
-    # If cart_id is changing, handle the cart status changes
-    if billing.cart_id != billing_update.cart_id:
-        # If there was a previous cart, check if we need to revert its paid status
-        if billing.cart_id:
-            old_cart_result = await db.execute(select(Cart).where(Cart.id == billing.cart_id))
-            old_cart = old_cart_result.scalar_one_or_none()
-            if old_cart:
-                old_cart.is_paid = False
-        
-        # If there's a new cart, mark it as paid
-        if billing_update.cart_id:
-            new_cart_result = await db.execute(select(Cart).where(Cart.id == billing_update.cart_id))
-            new_cart = new_cart_result.scalar_one_or_none()
-            if new_cart:
+            if billing_update.cart_id:
+                new_cart = await db.get(Cart, billing_update.cart_id)
+                if not new_cart:
+                    raise HTTPException(status_code=404, detail=f"Cart with ID {billing_update.cart_id} not found")
                 if new_cart.is_paid:
                     raise HTTPException(status_code=400, detail="New cart is already paid")
-                new_cart.is_paid = True
-    billing.order_id = billing_update.order_id
-    billing.amount = billing_update.amount
-    billing.payment_method = billing_update.payment_method
-    billing.date = naive_date
-    billing.cart_id = billing_update.cart_id
-    await db.commit()
+                await settle_cart(db, new_cart, billing_update.payment_method, naive_date.date())
+        elif billing.cart_id and (billing.payment_method, billing.date.date()) != (billing_update.payment_method, naive_date.date()):
+            cart = await db.get(Cart, billing.cart_id)
+            if cart and cart.is_paid:
+                await move_sale(db, cart.id, billing_update.payment_method, naive_date.date())
+
+        billing.order_id = billing_update.order_id
+        billing.amount = billing_update.amount
+        billing.payment_method = billing_update.payment_method
+        billing.date = naive_date
+        billing.cart_id = billing_update.cart_id
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    catalog_cache.forget_stock()
     await db.refresh(billing)
     return billing
 # Delete Billing
@@ -177,11 +197,11 @@ async def delete_billing(billing_id: int, db: AsyncSession = Depends(get_db)):
     billing = await db.get(Billing, billing_id)
     if not billing:
         raise HTTPException(status_code=404, detail="Billing record not found")
-    # If there's an associated cart, revert its paid status
+    # If there's an associated paid cart, give its stock back and take the sale out of the rollups
     if billing.cart_id:
-        cart_result = await db.execute(select(Cart).where(Cart.id == billing.cart_id))
-        cart = cart_result.scalar_one_or_none()
-        if cart:
-            cart.is_paid = False
+        cart = await db.get(Cart, billing.cart_id)
+        if cart and cart.is_paid:
+            await unsettle_cart(db, cart)
     await db.delete(billing)
     await db.commit()
+    catalog_cache.forget_stock()
@@ -1,108 +1,55 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import insert, update, delete
-from typing import List
+from sqlalchemy import delete
+from typing import List, Optional
 
 from database import get_db
 from models.Carts import Cart
-from models.medicaments import Medicament
 from models.carte_items import cart_medicament
-from Dto.carte import AddToCartRequest, CartOut, MedicamentInCart
+from Dto.carte import AddToCartRequest, CartOut
+from services.catalog_cache import catalog_cache
+from services.checkout import settle_cart, unsettle_cart
+from services.reservations import release_cart, reserve_cart
+from services.carts import cart_view, fill_from_prescription, get_or_create_open_cart, merge_items, refresh_total, write_lines
+from models.stock_reservations import StockReservation
 
 router = APIRouter()
 
 # POST - Add items to cart
 @router.post("/add/{patient_id}", response_model=CartOut)
 async def add_to_cart(patient_id: int, request: AddToCartRequest, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Cart).where(Cart.patient_id == patient_id, Cart.is_paid == False)
-    )
-    cart = result.scalars().first()
-
-    if not cart:
-        cart = Cart(patient_id=patient_id, total_price=0.0, is_paid=False)
-        db.add(cart)
-        await db.flush()
-
-    total_price = 0.0
-    for item in request.items:
-        medicament_result = await db.execute(select(Medicament).where(Medicament.id == item.medicament_id))
-        medicament = medicament_result.scalar_one_or_none()
-
-        if not medicament:
-            raise HTTPException(status_code=404, detail=f"Medicament ID {item.medicament_id} not found")
+    cart = await get_or_create_open_cart(db, patient_id)
+    await write_lines(db, cart, merge_items((item.medicament_id, item.quantity) for item in request.items))
+    await reserve_cart(db, cart.id)
+    await db.commit()
 
-        total_price += medicament.price * item.quantity
+    return await cart_view(db, Cart.id == cart.id)
 
-        stmt = insert(cart_medicament).values(
-            cart_id=cart.id,
-            medicament_id=medicament.id,
-            quantity=item.quantity
-        )
-        await db.execute(stmt)
-
-    cart.total_price += total_price
+# POST - Fill the patient's cart from a prescription
+@router.post("/from-prescription/{appointment_id}", response_model=CartOut)
+async def add_prescription_to_cart(appointment_id: int, patient_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    cart = await fill_from_prescription(db, appointment_id, patient_id)
+    await reserve_cart(db, cart.id)
     await db.commit()
 
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
+    return await cart_view(db, Cart.id == cart.id)
 
 # GET - Fetch active cart
 @router.get("/active/{patient_id}", response_model=CartOut)
 async def get_active_cart(patient_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Cart).where(Cart.patient_id == patient_id, Cart.is_paid == False)
-    )
-    cart = result.scalars().first()
-
+    cart = await cart_view(db, Cart.patient_id == patient_id, Cart.is_paid == False)
     if not cart:
         raise HTTPException(status_code=404, detail="No active cart found for this patient")
-
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
+    return cart
 
 # GET - Fetch Cart by Cart ID
 @router.get("/{cart_id}", response_model=CartOut)
 async def get_cart(cart_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Cart).where(Cart.id == cart_id))
-    cart = result.scalars().first()
-
+    cart = await cart_view(db, Cart.id == cart_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
+    return cart
 
 # PUT - Update Cart
 @router.put("/update/{cart_id}", response_model=CartOut)
@@ -116,39 +63,11 @@ async def update_cart(cart_id: int, request: AddToCartRequest, db: AsyncSession
     if cart.is_paid:
         raise HTTPException(status_code=400, detail="Cannot update a paid cart")
 
-    cart.total_price = 0.0
-    await db.execute(delete(cart_medicament).where(cart_medicament.c.cart_id == cart_id))
-
-    for item in request.items:
-        medicament_result = await db.execute(select(Medicament).where(Medicament.id == item.medicament_id))
-        medicament = medicament_result.scalar_one_or_none()
-
-        if not medicament:
-            raise HTTPException(status_code=404, detail=f"Medicament ID {item.medicament_id} not found")
-
-        cart.total_price += medicament.price * item.quantity
-
-        stmt = insert(cart_medicament).values(
-            cart_id=cart.id,
-            medicament_id=medicament.id,
-            quantity=item.quantity
-        )
-        await db.execute(stmt)
-
+    await write_lines(db, cart, merge_items((item.medicament_id, item.quantity) for item in request.items), replace=True)
+    await reserve_cart(db, cart.id)
     await db.commit()
 
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
+    return await cart_view(db, Cart.id == cart.id)
 
 # PUT - Mark cart as paid
 @router.put("/mark-paid/{cart_id}", response_model=CartOut)
@@ -162,40 +81,11 @@ async def mark_cart_as_paid(cart_id: int, db: AsyncSession = Depends(get_db)):
     if cart.is_paid:
         raise HTTPException(status_code=400, detail="Cart is already marked as paid")
 
-    try:
-        cart_items_result = await db.execute(
-            select(cart_medicament.c.medicament_id, cart_medicament.c.quantity)
-            .where(cart_medicament.c.cart_id == cart_id)
-        )
-        cart_items = cart_items_result.all()
-
-        for item in cart_items:
-            medicament_result = await db.execute(
-                select(Medicament).where(Medicament.id == item.medicament_id)
-            )
-            medicament = medicament_result.scalar_one_or_none()
-
-            if medicament and medicament.stock is not None:
-                medicament.stock = max(0, medicament.stock - item.quantity)
-                db.add(medicament)
-    except Exception as stock_error:
-        print(f"Error updating medicament stock: {stock_error}")
-
-    cart.is_paid = True
+    await settle_cart(db, cart)
     await db.commit()
+    catalog_cache.forget_stock()
 
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
+    return await cart_view(db, Cart.id == cart.id)
 
 # DELETE - Remove Cart
 @router.delete("/deleteCart/{cart_id}", response_model=dict)
@@ -206,6 +96,7 @@ async def delete_cart(cart_id: int, db: AsyncSession = Depends(get_db)):
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
 
+    await release_cart(db, cart_id)
     await db.execute(delete(cart_medicament).where(cart_medicament.c.cart_id == cart_id))
     await db.execute(delete(Cart).where(Cart.id == cart_id))
     await db.commit()
@@ -231,24 +122,20 @@ async def delete_cart_item(cart_id: int, medicament_id: int, db: AsyncSession =
     if cart and cart.is_paid:
         raise HTTPException(status_code=400, detail="Cannot modify a paid cart")
 
-    quantity = cart_item._mapping['quantity']
-
-    medicament_result = await db.execute(select(Medicament).where(Medicament.id == medicament_id))
-    medicament = medicament_result.scalar_one_or_none()
-
-    if not medicament:
-        raise HTTPException(status_code=404, detail="Medicament not found")
-
-    item_total = medicament.price * quantity
-    if cart:
-        cart.total_price = max(cart.total_price - item_total, 0.0)
-
     await db.execute(
         delete(cart_medicament).where(
             cart_medicament.c.cart_id == cart_id,
             cart_medicament.c.medicament_id == medicament_id
         )
     )
+    await db.execute(
+        delete(StockReservation).where(
+            StockReservation.cart_id == cart_id,
+            StockReservation.medicament_id == medicament_id
+        )
+    )
+    if cart:
+        await refresh_total(db, cart)
     await db.commit()
 
     return {"message": f"Item with Medicament ID {medicament_id} removed from cart {cart_id}"}
@@ -293,8 +180,12 @@ async def reset_cart_payment(cart_id: int, db: AsyncSession = Depends(get_db)):
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
 
-    cart.is_paid = False
-    await db.commit()
+    if cart.is_paid:
+        # Give the stock back and take the sale out of the rollups
+        await unsettle_cart(db, cart)
+        await db.commit()
+        catalog_cache.forget_stock()
+        await db.refresh(cart)
 
     return {
         "message": f"Cart {cart_id} payment status reset to unpaid",
@@ -326,78 +217,15 @@ async def add_many_to_cart(request: dict, db: AsyncSession = Depends(get_db)):
     if not items:
         raise HTTPException(status_code=400, detail="No items provided")
     
-    # Find or create an active cart for this patient
-    result = await db.execute(
-        select(Cart).where(Cart.patient_id == patient_id, Cart.is_paid == False)
-    )
-    cart = result.scalars().first()
-
-    if not cart:
-        cart = Cart(patient_id=patient_id, total_price=0.0, is_paid=False)
-        db.add(cart)
-        await db.flush()
-
-    total_price = 0.0
-    
-    # Process each medication
-    for item in items:
-        medicament_id = item.get("medicament_id")
-        quantity = item.get("quantity", 1)
-        
-        if not medicament_id:
-            continue
-            
-        # Check if medication exists
-        medicament_result = await db.execute(select(Medicament).where(Medicament.id == medicament_id))
-        medicament = medicament_result.scalar_one_or_none()
-
-        if not medicament:
-            continue  # Skip items that don't exist
-
-        # Check if item already exists in cart
-        existing_item = await db.execute(
-            select(cart_medicament).where(
-                cart_medicament.c.cart_id == cart.id,
-                cart_medicament.c.medicament_id == medicament_id
-            )
-        )
-        existing = existing_item.first()
-        
-        if existing:
-            # Update quantity if item already exists
-            new_quantity = existing._mapping['quantity'] + quantity
-            await db.execute(
-                update(cart_medicament).where(
-                    cart_medicament.c.cart_id == cart.id,
-                    cart_medicament.c.medicament_id == medicament_id
-                ).values(quantity=new_quantity)
-            )
-        else:
-            # Add new item to cart
-            stmt = insert(cart_medicament).values(
-                cart_id=cart.id,
-                medicament_id=medicament_id,
-                quantity=quantity
-            )
-            await db.execute(stmt)
-
-        # Update total price
-        total_price += medicament.price * quantity
-
-    # Update cart total price
-    cart.total_price += total_price
+    cart = await get_or_create_open_cart(db, patient_id)
+    # Unknown medicaments are skipped rather than failing the whole request
+    await write_lines(
+        db, cart,
+        merge_items((item.get("medicament_id"), item.get("quantity", 1)) for item in items),
+        skip_missing=True,
+    )
+    await reserve_cart(db, cart.id)
     await db.commit()
 
     # Get updated medications in cart
-    result = await db.execute(
-        select(Medicament).join(cart_medicament).where(cart_medicament.c.cart_id == cart.id)
-    )
-    medicaments = result.scalars().all()
-
-    return CartOut(
-        id=cart.id,
-        patient_id=cart.patient_id,
-        total_price=cart.total_price,
-        medicaments=[MedicamentInCart(id=m.id, name=m.name, price=m.price) for m in medicaments],
-        is_paid=cart.is_paid
-    )
\ No newline at end of file
+    return await cart_view(db, Cart.id == cart.id)
\ No newline at end of file
@@ -1,41 +1,150 @@
 
 # routers/medicament_router.py
-import os
-import shutil
-from uuid import uuid4
-from fastapi import APIRouter, File, HTTPException, Depends, UploadFile
+from fastapi import APIRouter, File, HTTPException, Depends, Query, Request, Response, UploadFile
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models.medicaments import Medicament
 from database import get_db
-from Dto.medicamentdto import MedicamentCreate, MedicamentUpdate, MedicamentResponse
-from typing import List
+from Dto.medicamentdto import (
+    LowStockItem, MedicamentCreate, MedicamentUpdate, MedicamentResponse, MedicamentSearchResponse, StockMovementCreate
+)
+from typing import List, Literal, Optional
+from services.blob_store import store_upload, acquire, release, replace_reference
+from services import medicament_search
+from services.catalog_cache import bump_version, catalog_cache
+from services.medicament_import import CHUNK_SIZE, detect_format, import_medicaments
+from services.inventory import LOW_STOCK_THRESHOLD, adjust_to, current_stock, low_stock, record_movements
 
 router = APIRouter()
 
+medicament_list = TypeAdapter(List[MedicamentResponse])
+
+
+async def cached_catalog_response(request: Request, db: AsyncSession, key: str, render) -> Response:
+    """
+    Serve a catalog read from the per-version cache, answering If-None-Match
+    with a 304 without touching the database when the version is known.
+    """
+    stamp = await catalog_cache.current_stamp(db)
+    etag = catalog_cache.etag(stamp, key)
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    etag, body = await catalog_cache.page(stamp, key, render)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+async def with_current_stock(db: AsyncSession, medicaments) -> List[MedicamentResponse]:
+    """
+    Responses carrying the ledger's current stock rather than the compacted column.
+    """
+    levels = await current_stock(db, [m.id for m in medicaments])
+    return [
+        MedicamentResponse.model_validate(m, from_attributes=True).model_copy(update={"stock": levels.get(m.id, m.stock)})
+        for m in medicaments
+    ]
+
 @router.post("/", response_model=MedicamentResponse)
 async def create_medicament(medicament: MedicamentCreate, db: AsyncSession = Depends(get_db)):
     try:
         new_medicament = Medicament(**medicament.model_dump())
         db.add(new_medicament)
+        await db.flush()
+        # The initial stock enters the ledger as a receipt
+        await record_movements(db, "receipt", {new_medicament.id: medicament.stock}, "create")
+        await acquire(db, new_medicament.image)
+        await bump_version(db)
         await db.commit()
+        catalog_cache.forget()
         await db.refresh(new_medicament)
         return new_medicament
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating medicament: {e}")
 
+@router.post("/import")
+async def import_medicaments_file(
+    request: Request,
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Bulk create or update medicaments (matched on name) from a CSV file with a
+    header row or from NDJSON, sent as the raw body or as a multipart "file" field.
+    Returns counts and a per-row error report.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail='Missing "file" field')
+        file_format = detect_format(upload.content_type, format or _format_from_name(upload.filename))
+
+        async def chunks():
+            while chunk := await upload.read(CHUNK_SIZE):
+                yield chunk
+    else:
+        file_format = detect_format(content_type, format)
+        chunks = request.stream
+    if file_format is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson")
+
+    report = await import_medicaments(db, chunks(), file_format)
+    return report.as_dict()
+
+def _format_from_name(filename: Optional[str]) -> Optional[str]:
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return {"csv": "csv", "ndjson": "ndjson", "jsonl": "ndjson"}.get(extension)
+
 @router.get("/", response_model=List[MedicamentResponse])
-async def get_all_medicaments(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Medicament))
-    return result.scalars().all()
+async def get_all_medicaments(request: Request, db: AsyncSession = Depends(get_db)):
+    async def render():
+        result = await db.execute(select(Medicament).order_by(Medicament.id))
+        return medicament_list.dump_json(await with_current_stock(db, result.scalars().all()))
+
+    return await cached_catalog_response(request, db, "all", render)
+
+@router.get("/search", response_model=MedicamentSearchResponse)
+async def search_medicaments(
+    q: str = "",
+    legal: Optional[bool] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Ranked, typo-tolerant search on name and description, served from the in-memory index
+    """
+    index = await medicament_search.get_index(db)
+    total, items = index.search(q, legal, in_stock, min_price, max_price, limit, offset)
+    return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+@router.get("/low-stock", response_model=List[LowStockItem])
+async def get_low_stock(threshold: int = Query(LOW_STOCK_THRESHOLD, ge=0), db: AsyncSession = Depends(get_db)):
+    """
+    Medicaments at or below `threshold`, from levels kept up to date incrementally off the ledger
+    """
+    await low_stock.refresh(db)
+    report = low_stock.report(threshold)
+    if not report:
+        return []
+    result = await db.execute(select(Medicament.id, Medicament.name).where(Medicament.id.in_([i for i, _ in report])))
+    names = dict(result.all())
+    return [LowStockItem(id=i, name=names[i], stock=stock) for i, stock in report if i in names]
 
 @router.get("/{medicament_id}", response_model=MedicamentResponse)
-async def get_medicament(medicament_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Medicament).where(Medicament.id == medicament_id))
-    medicament = result.scalar_one_or_none()
-    if not medicament:
-        raise HTTPException(status_code=404, detail="Medicament not found")
-    return medicament
+async def get_medicament(medicament_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    async def render():
+        result = await db.execute(select(Medicament).where(Medicament.id == medicament_id))
+        medicament = result.scalar_one_or_none()
+        if not medicament:
+            raise HTTPException(status_code=404, detail="Medicament not found")
+        return (await with_current_stock(db, [medicament]))[0].model_dump_json().encode()
+
+    return await cached_catalog_response(request, db, f"id:{medicament_id}", render)
 
 @router.put("/{medicament_id}", response_model=MedicamentResponse)
 async def update_medicament_price(
@@ -51,19 +160,38 @@ async def update_medicament_price(
     medicament.price = medicament_data.price
     medicament.dosage = medicament_data.dosage
     medicament.duration = medicament_data.duration
-    medicament.stock = medicament_data.stock
+    await adjust_to(db, {medicament.id: medicament_data.stock}, "admin")
     medicament.legal = medicament_data.legal
     
     if medicament_data.image is not None:
+        await replace_reference(db, medicament.image, medicament_data.image)
         medicament.image = medicament_data.image
 
     db.add(medicament)
+    await bump_version(db)
     await db.commit()
+    catalog_cache.forget()
     await db.refresh(medicament)
-    return medicament
+    return (await with_current_stock(db, [medicament]))[0]
 
 
 
+@router.post("/{medicament_id}/stock", response_model=MedicamentResponse)
+async def add_stock_movement(medicament_id: int, movement: StockMovementCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Record a receipt, a customer return or a signed adjustment in the stock ledger
+    """
+    medicament = await db.get(Medicament, medicament_id)
+    if not medicament:
+        raise HTTPException(status_code=404, detail="Medicament not found")
+    if movement.kind != "adjustment" and movement.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Receipts and returns need a positive quantity")
+
+    await record_movements(db, movement.kind, {medicament_id: movement.quantity}, movement.reference)
+    await db.commit()
+    catalog_cache.forget_stock()
+    return (await with_current_stock(db, [medicament]))[0]
+
 @router.delete("/{medicament_id}")
 async def delete_medicament(medicament_id: int, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Medicament).where(Medicament.id == medicament_id))
@@ -71,33 +199,25 @@ async def delete_medicament(medicament_id: int, db: AsyncSession = Depends(get_d
     if not medicament:
         raise HTTPException(status_code=404, detail="Medicament not found")
 
+    await release(db, medicament.image)
     await db.delete(medicament)
+    await bump_version(db)
     await db.commit()
+    catalog_cache.forget()
     return {"message": "Medicament deleted successfully"}
 
 
 @router.post("/upload-medicament-image")
-async def upload_medicament_image(file: UploadFile = File(...)):
+async def upload_medicament_image(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     """
     Upload an image for a medicament and return the file path
     """
     try:
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join("static", "uploads", "medicaments")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Return the relative path to be saved in the database
-        relative_path = f"/static/uploads/medicaments/{unique_filename}"
-        
+        # Stream the file to disk and return the relative path to be saved in the database
+        relative_path = await store_upload(db, file, "medicament")
+        await db.commit()
         return {"image_path": relative_path}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading image: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error uploading image: {str(e)}")
@@ -1,21 +1,47 @@
-import os
-from fastapi import APIRouter, FastAPI
+from typing import Optional
+from fastapi import APIRouter, Depends, FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import stripe
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from services.idempotency import idempotent
+from services.payment_events import CURRENCY, record_event
+from services.payment_gateway import get_gateway
 
 router=APIRouter()
-# Stripe secret key (get it from your dashboard)
-stripe.api_key = os.getenv("stripe.api_key")
 
 class PaymentRequest(BaseModel):
     amount: int  # amount in cents
+    cart_id: Optional[int] = None  # settled by the webhook once the payment succeeds
 
 @router.post("/createPayment")
-async def create_payment_intent(payment: PaymentRequest):
-    intent = stripe.PaymentIntent.create(
+async def create_payment_intent(
+    payment: PaymentRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    if idempotency_key is None:
+        return await _create_payment_intent(payment)
+    # A retried request must not create a second PaymentIntent
+    return await idempotent(
+        "payment", idempotency_key, payment.model_dump(), lambda: _create_payment_intent(payment, idempotency_key)
+    )
+
+async def _create_payment_intent(payment: PaymentRequest, idempotency_key: Optional[str] = None):
+    intent = await get_gateway().create_payment_intent(
         amount=payment.amount,
-        currency="usd",
-        payment_method_types=["card"],
+        currency=CURRENCY,
+        idempotency_key=f"create-payment-{idempotency_key}" if idempotency_key else None,
+        metadata={"cart_id": str(payment.cart_id)} if payment.cart_id else None,
     )
-    return {"clientSecret": intent.client_secret}
\ No newline at end of file
+    return {"clientSecret": intent.client_secret}
+
+@router.post("/webhook")
+async def payment_webhook(
+    request: Request,
+    stripe_signature: Optional[str] = Header(None, alias="Stripe-Signature"),
+    db: AsyncSession = Depends(get_db)
+):
+    # Verify and store only; the payment events worker settles carts in batches
+    event = get_gateway().parse_webhook(await request.body(), stripe_signature)
+    stored = await record_event(db, event)
+    return {"received": True, "duplicate": not stored}
@@ -1,193 +1,118 @@
-from typing import List
-from sqlalchemy import insert, delete
-from fastapi import APIRouter, HTTPException, Depends
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from Dto.prescriptiondto import PrescriptionCreate, PrescriptionOut, PrescriptionUpdate
+from Dto.prescriptiondto import InteractionCheck, InteractionCheckOut, PrescriptionCreate, PrescriptionOut, PrescriptionUpdate, SearchHit
 from models.prescription import Prescription
-from models.medicaments import Medicament
-from models.prescription_medicament import prescription_medicament
 from database import get_db
+from services.drug_interactions import check_interactions
+from services.prescription_pdf import document_hash, prescription_pdf
+from services.prescriptions import (
+    get_by_appointment, load_pdf_document, medicament_names, prescription_filters, prescription_page,
+    save_prescription, to_out
+)
+from services.text_search import search_history
 
 router = APIRouter()
 
+# Live validation for the prescription form (declared before /{appointment_id})
+@router.post("/check", response_model=InteractionCheckOut)
+async def check_prescription(check: InteractionCheck, db: AsyncSession = Depends(get_db)):
+    names = await medicament_names(db, list(dict.fromkeys(check.medicament_ids)))
+    return {"interactions": check_interactions(names)}
+
 @router.post("/{appointment_id}", response_model=PrescriptionOut)
 async def create_or_update_prescription(
     appointment_id: int, 
     prescription_data: PrescriptionCreate,
     db: AsyncSession = Depends(get_db)
 ):
-    # First, validate medicament IDs before any database operations
-    # This will catch invalid IDs early and return a 400 error
     if not prescription_data.medicament_ids:
         raise HTTPException(status_code=400, detail="No medicaments provided")
-    
+
     try:
-        # Check if the prescription already exists for the appointment
-        result = await db.execute(select(Prescription).filter(Prescription.appointment_id == appointment_id))
-        existing_prescription = result.scalars().first()
-        
-        # Query for medicaments one by one to identify which ones don't exist
-        found_medicaments = []
-        missing_ids = []
-        
-        for med_id in prescription_data.medicament_ids:
-            try:
-                med_result = await db.execute(select(Medicament).filter(Medicament.id == med_id))
-                medicament = med_result.scalars().first()
-                if medicament:
-                    found_medicaments.append(medicament)
-                else:
-                    missing_ids.append(med_id)
-            except Exception:
-                missing_ids.append(med_id)
-        
-        # If any medicaments are missing, return a 400 error
-        if missing_ids:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Medicaments not found: {', '.join(map(str, missing_ids))}"
-            )
-        
-        if existing_prescription:
-            # If a prescription exists, update it
-            existing_prescription.content = prescription_data.content
-            
-            # Clear existing medicaments and add new ones using the association table
-            await db.execute(
-                delete(prescription_medicament).where(
-                    prescription_medicament.c.prescription_id == existing_prescription.id
-                )
-            )
-            
-            # Add new associations
-            for medicament in found_medicaments:
-                await db.execute(
-                    insert(prescription_medicament).values(
-                        prescription_id=existing_prescription.id,
-                        medicament_id=medicament.id
-                    )
-                )
-                
-            await db.commit()
-            
-            # Get updated medicament IDs
-            med_result = await db.execute(
-                select(Medicament.id)
-                .join(prescription_medicament)
-                .where(prescription_medicament.c.prescription_id == existing_prescription.id)
-            )
-            medicament_ids = [id for id, in med_result.all()]
-            
-            return PrescriptionOut(
-                id=existing_prescription.id,
-                content=existing_prescription.content,
-                appointment_id=existing_prescription.appointment_id,
-                medicament_ids=medicament_ids
-            )
-        else:
-            # If no existing prescription, create a new one
-            new_prescription = Prescription(
-                appointment_id=appointment_id,
-                content=prescription_data.content,
-            )
-            db.add(new_prescription)
-            await db.commit()
-            await db.refresh(new_prescription)
-            
-            # Add medicaments using the association table
-            for medicament in found_medicaments:
-                await db.execute(
-                    insert(prescription_medicament).values(
-                        prescription_id=new_prescription.id,
-                        medicament_id=medicament.id
-                    )
-                )
-            
-            await db.commit()
-            
-            return PrescriptionOut(
-                id=new_prescription.id,
-                content=new_prescription.content,
-                appointment_id=new_prescription.appointment_id,
-                medicament_ids=[m.id for m in found_medicaments]
-            )
+        return await save_prescription(db, appointment_id, prescription_data.content, prescription_data.medicament_ids)
     except HTTPException:
         # Re-raise HTTP exceptions to preserve their status codes
+        await db.rollback()
         raise
     except Exception as e:
         # For debugging, print the actual error
         print(f"ERROR: {str(e)}")
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-# Get all prescriptions
+# Get prescriptions, newest first, one page at a time
 @router.get("/", response_model=List[PrescriptionOut])
-async def get_all_prescriptions(db: AsyncSession = Depends(get_db)):
+async def get_all_prescriptions(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    medecin_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
     try:
-        # Get all prescriptions
-        result = await db.execute(select(Prescription))
-        prescriptions = result.scalars().all()
-        
-        # Prepare the response
-        prescription_list = []
-        for prescription in prescriptions:
-            # Get medicament IDs for this prescription
-            med_result = await db.execute(
-                select(Medicament.id)
-                .join(prescription_medicament)
-                .where(prescription_medicament.c.prescription_id == prescription.id)
-            )
-            medicament_ids = [id for id, in med_result.all()]
-            
-            # Add to response list
-            prescription_list.append(
-                PrescriptionOut(
-                    id=prescription.id,
-                    content=prescription.content,
-                    appointment_id=prescription.appointment_id,
-                    medicament_ids=medicament_ids
-                )
-            )
-        
-        return prescription_list
+        criteria = prescription_filters(medecin_id, patient_id, date_from, date_to)
+        prescriptions, next_cursor = await prescription_page(db, criteria, limit, cursor)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return prescriptions
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+# Full-text search over a doctor's prescriptions and appointment notes, best matches first
+@router.get("/search", response_model=List[SearchHit])
+async def search_prescriptions(
+    response: Response,
+    medecin_id: int,
+    q: str = Query(..., min_length=2, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    db: AsyncSession = Depends(get_db)
+):
+    hits, next_cursor = await search_history(db, medecin_id, q, limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return hits
+
 # Get prescription by ID
 @router.get("/{appointment_id}", response_model=PrescriptionOut)
 async def get_prescription_by_appointment_id(appointment_id: int, db: AsyncSession = Depends(get_db)):
     try:
-        # Get prescription by appointment_id
-        result = await db.execute(
-            select(Prescription).filter(Prescription.appointment_id == appointment_id)
-        )
-        prescription = result.scalar_one_or_none()
-        
+        prescription = await get_by_appointment(db, appointment_id)
         if not prescription:
             raise HTTPException(status_code=404, detail="Prescription not found for this appointment")
-        
-        # Get medicament IDs for this prescription
-        med_result = await db.execute(
-            select(Medicament.id)
-            .join(prescription_medicament)
-            .where(prescription_medicament.c.prescription_id == prescription.id)
-        )
-        medicament_ids = [id for id, in med_result.all()]
-        
-        # Return the prescription
-        return PrescriptionOut(
-            id=prescription.id,
-            content=prescription.content,
-            appointment_id=prescription.appointment_id,
-            medicament_ids=medicament_ids
-        )
+        return to_out(prescription)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
+# Prescription as a PDF, rendered server side and cached by content
+@router.get("/{appointment_id}/pdf")
+async def get_prescription_pdf(appointment_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    document = await load_pdf_document(db, appointment_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Prescription not found for this appointment")
+    content_hash = document_hash(document)
+    headers = {
+        "ETag": f'"{content_hash}"',
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'inline; filename="prescription-{appointment_id}.pdf"',
+    }
+    # Unchanged prescription: answer without rendering
+    if f'"{content_hash}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    pdf = await prescription_pdf(document, content_hash)
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+
 # Delete prescription
 @router.delete("/{id}")
 async def delete_prescription(id: int, db: AsyncSession = Depends(get_db)):
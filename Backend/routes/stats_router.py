@@ -1,17 +1,19 @@
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Literal, Optional, Tuple
 from datetime import date
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from models.patients import Patient as PatientModel
 from models.medecins import Medecin as MedecinModel
 from models.users import User as UserModel
 from Dto.userdto import MedcinResponse, PatientResponse
 from models.appointments import Appointment as AppointmentModel
 from database import get_db
+from services.uploads import upload_metrics_snapshot
+from services.sales import sales_report
 router = APIRouter()
 @router.get("/patients", response_model=list[PatientResponse])
 async def get_all_patients(db: AsyncSession = Depends(get_db)):
@@ -353,4 +355,43 @@ async def get_appointments_per_doctor_yearly(
             "monthly_counts": monthly_counts
         }
         for doctor_name, monthly_counts in doctor_monthly_counts.items()
-    ]
\ No newline at end of file
+    ]
+
+
+@router.get("/uploads")
+async def get_upload_metrics():
+    """
+    GET /stats/uploads
+    Returns, per upload kind, the number of stored and rejected files,
+    total bytes written and the average write throughput in bytes/sec.
+    """
+    return upload_metrics_snapshot()
+
+
+class SalesRow(BaseModel):
+    period: date
+    medicament_id: Optional[int] = None
+    payment_method: Optional[str] = None
+    units: int
+    revenue: float
+
+
+@router.get("/sales", response_model=List[SalesRow], response_model_exclude_none=True)
+async def get_sales(
+    granularity: Literal["day", "week", "month"] = "day",
+    by: Literal["total", "medicament", "payment_method"] = "total",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = Query(None, description="exclusive"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    GET /stats/sales?granularity=week&by=medicament&date_from=2024-01-01
+    Returns units sold and revenue per period (weeks start on Monday),
+    optionally split by medicament or payment method:
+    [
+        { "period": "2024-01-01", "medicament_id": 3, "units": 12, "revenue": 54.0 },
+        ...
+    ]
+    Reads the daily sales rollups only.
+    """
+    return await sales_report(db, granularity, by, date_from, date_to)
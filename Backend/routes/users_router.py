@@ -1,10 +1,7 @@
 import asyncio
 import logging
-import os
 from pydoc import text
-import shutil
 from typing import Optional
-from uuid import uuid4
 import bcrypt
 from fastapi import APIRouter, File, Form, HTTPException, Depends, UploadFile, logger
 from sqlalchemy import distinct
@@ -16,6 +13,7 @@ from models.users import User as UserModel
 from models.medecins import Medecin as MedcineModel
 from database import get_db
 from Dto.userdto import PatientResponse, UserResponse , MedcinResponse,UpdateMedcinProfileRequest,UpdatePatientProfileRequest, MedcinResponse1
+from services.blob_store import store_upload, replace_reference, release
 
 router = APIRouter()
 def hash_password(password: str) -> str:
@@ -144,14 +142,9 @@ async def update_medecin_details(
 
         # Handle photo upload like register function
         if photo is not None:
-            upload_dir = os.path.join("static", "uploads")
-            os.makedirs(upload_dir, exist_ok=True)
-            file_extension = os.path.splitext(photo.filename)[1]
-            unique_filename = f"{uuid4()}{file_extension}"
-            file_path = os.path.join(upload_dir, unique_filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(photo.file, buffer)
-            user.photo = f"/static/uploads/{unique_filename}"
+            new_photo = await store_upload(db, photo, "photo")
+            await replace_reference(db, user.photo, new_photo)
+            user.photo = new_photo
 
         # Commit changes
         await db.commit()
@@ -176,6 +169,8 @@ async def update_medecin_details(
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating patient details: {str(e)}")
     
@@ -210,14 +205,9 @@ async def update_patient_details(
 
         # Handle photo upload like register function
         if photo is not None:
-            upload_dir = os.path.join("static", "uploads")
-            os.makedirs(upload_dir, exist_ok=True)
-            file_extension = os.path.splitext(photo.filename)[1]
-            unique_filename = f"{uuid4()}{file_extension}"
-            file_path = os.path.join(upload_dir, unique_filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(photo.file, buffer)
-            user.photo = f"/static/uploads/{unique_filename}"
+            new_photo = await store_upload(db, photo, "photo")
+            await replace_reference(db, user.photo, new_photo)
+            user.photo = new_photo
 
         # Commit changes
         await db.commit()
@@ -241,6 +231,8 @@ async def update_patient_details(
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating patient details: {str(e)}")
 
@@ -406,6 +398,7 @@ async def delete_patient(patient_id: int, db: AsyncSession = Depends(get_db)):
         user = user_result.scalar_one_or_none()
         
         if user:
+            await release(db, user.photo)
             await db.delete(user)
         
         await db.commit()
@@ -447,6 +440,7 @@ async def delete_medecin(medecin_id: int, db: AsyncSession = Depends(get_db)):
         user = user_result.scalar_one_or_none()
         
         if user:
+            await release(db, user.photo)
             await db.delete(user)
         
         await db.commit()
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+async def _run_periodically(name: str, interval: float, job: Callable[[AsyncSession], Awaitable]):
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await job(db)
+            if result:
+                logger.info(f"{name}: {result}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"{name} failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_periodic(name: str, interval: float, job: Callable[[AsyncSession], Awaitable]):
+    """
+    Run `job(db)` every `interval` seconds for the life of the process, each
+    run with its own session. A failing run is logged and retried next time.
+    """
+    if name not in _tasks or _tasks[name].done():
+        _tasks[name] = asyncio.create_task(_run_periodically(name, interval, job), name=name)
+
+
+async def stop_all():
+    for task in _tasks.values():
+        task.cancel()
+    await asyncio.gather(*_tasks.values(), return_exceptions=True)
+    _tasks.clear()
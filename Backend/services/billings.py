@@ -0,0 +1,121 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models.billing import Billing
+from models.Carts import Cart
+from models.patients import Patient
+from models.users import User
+
+EXPORT_BATCH = 1000
+EXPORT_COLUMNS = (
+    Billing.id, Billing.order_id, Billing.date, Billing.amount, Billing.payment_method, Billing.cart_id,
+    Cart.total_price.label("cart_total"), Cart.is_paid.label("cart_is_paid"), Cart.patient_id,
+    User.nom.label("patient_nom"), User.prenom.label("patient_prenom"), User.email.label("patient_email"),
+)
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def billing_filters(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    payment_method: Optional[str] = None,
+) -> list:
+    """
+    WHERE criteria shared by the paginated list and the export. `date_to` is exclusive.
+    """
+    criteria = []
+    if date_from is not None:
+        criteria.append(Billing.date >= _naive_utc(date_from))
+    if date_to is not None:
+        criteria.append(Billing.date < _naive_utc(date_to))
+    if payment_method is not None:
+        criteria.append(Billing.payment_method == payment_method)
+    return criteria
+
+
+def encode_cursor(date: datetime, billing_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{billing_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        date, billing_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date), int(billing_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def billing_page(db: AsyncSession, criteria: list, limit: int, cursor: Optional[str] = None) -> Tuple[List[Billing], Optional[str]]:
+    """
+    One page of billings, newest first, and the cursor of the next page
+    (None on the last one). Seeks on (date, id) through ix_billing_date_id
+    instead of OFFSET, so deep pages cost the same as the first.
+    """
+    query = select(Billing).where(*criteria)
+    if cursor is not None:
+        date, billing_id = decode_cursor(cursor)
+        query = query.where(or_(Billing.date < date, and_(Billing.date == date, Billing.id < billing_id)))
+    result = await db.execute(query.order_by(Billing.date.desc(), Billing.id.desc()).limit(limit + 1))
+    billings = list(result.scalars().all())
+    if len(billings) <= limit:
+        return billings, None
+    billings = billings[:limit]
+    return billings, encode_cursor(billings[-1].date, billings[-1].id)
+
+
+def _export_query(criteria: list):
+    return (
+        select(*EXPORT_COLUMNS)
+        .outerjoin(Cart, Cart.id == Billing.cart_id)
+        .outerjoin(Patient, Patient.id == Cart.patient_id)
+        .outerjoin(User, User.id == Patient.user_id)
+        .where(*criteria)
+        .order_by(Billing.date.desc(), Billing.id.desc())
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_billings(criteria: list, fmt: str) -> AsyncIterator[str]:
+    """
+    Yield the filtered billings with their cart and patient as CSV or NDJSON,
+    EXPORT_BATCH rows per chunk. Rows come from a server-side cursor, so
+    memory stays flat whatever the number of billings.
+    Opens its own session: the response body outlives the request's one.
+    """
+    names = [column.key for column in EXPORT_COLUMNS]
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(_export_query(criteria))
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            async for batch in result.partitions():
+                writer.writerows([_jsonable(value) for value in row] for row in batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            async for batch in result.partitions():
+                yield "".join(
+                    json.dumps({name: _jsonable(value) for name, value in zip(names, row)}) + "\n" for row in batch
+                )
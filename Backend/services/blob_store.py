@@ -0,0 +1,261 @@
+import asyncio
+import glob
+import hashlib
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import case, func, select, text, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.upload_blobs import UploadAlias, UploadBlob
+from models.users import User
+from models.medicaments import Medicament
+from services.image_variants import VARIANT_FORMATS, VARIANT_WIDTHS, is_variant, variant_name
+from services.storage import StorageBackend, get_storage
+from services.uploads import IMAGE_TYPES, save_upload
+
+UPLOADS_ROOT = os.path.join("static", "uploads")
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+GC_GRACE_PERIOD = timedelta(hours=24)
+GC_BATCH_SIZE = 500
+# Advisory lock uploads hold shared until they commit; gc_sweep takes it
+# exclusively, so it never deletes a blob an open transaction has just stored
+BLOB_LOCK = (7303, 0)
+
+
+async def _lock_blobs(db: AsyncSession, exclusive: bool = False):
+    lock = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+    await db.execute(text(f"SELECT {lock}(:namespace, :key)"), {"namespace": BLOB_LOCK[0], "key": BLOB_LOCK[1]})
+
+
+def local_path(public_path: str) -> str:
+    """
+    /static/uploads/abc.jpg -> static/uploads/abc.jpg
+    """
+    return os.path.join("static", *public_path.split("/")[2:])
+
+
+def public_path(file_path: str) -> str:
+    return "/" + os.path.relpath(file_path, ".").replace(os.sep, "/")
+
+
+async def store_upload(db: AsyncSession, upload: UploadFile, kind_name: str) -> str:
+    """
+    Save an upload as a content-addressed blob and register it (unreferenced).
+    Callers record the reference with `acquire` when they assign the path to a row,
+    in this transaction or within GC_GRACE_PERIOD: re-uploading an unreferenced
+    blob restarts its grace period. Returns the path the blob is registered
+    under, which is what callers must store and acquire.
+    """
+    await _lock_blobs(db)
+    stored = await save_upload(upload, kind_name)
+    insert = pg_insert(UploadBlob).values(
+        hash=stored.content_hash,
+        path=stored.path,
+        size=stored.size,
+        content_type=stored.content_type,
+        ref_count=0,
+        released_at=datetime.utcnow(),
+    )
+    result = await db.execute(
+        insert.on_conflict_do_update(
+            index_elements=[UploadBlob.hash],
+            # Always touches the row, so RETURNING gives the path the blob is registered under
+            set_={"released_at": case((UploadBlob.ref_count <= 0, insert.excluded.released_at), else_=UploadBlob.released_at)},
+        )
+        .returning(UploadBlob.path)
+    )
+    path = result.scalar_one()
+    if path != stored.path:
+        # Registered under another directory (medicament images used to have
+        # their own): references go to that path, the copy just written goes
+        await _delete_blob(get_storage(), stored.path)
+    return path
+
+
+async def acquire(db: AsyncSession, path: Optional[str], count: int = 1):
+    if not path:
+        return
+    await db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.path == path)
+        .values(ref_count=UploadBlob.ref_count + count, released_at=None)
+    )
+
+
+async def release(db: AsyncSession, path: Optional[str]):
+    if not path:
+        return
+    await db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.path == path)
+        .values(
+            ref_count=func.greatest(UploadBlob.ref_count - 1, 0),
+            released_at=case((UploadBlob.ref_count <= 1, datetime.utcnow()), else_=UploadBlob.released_at),
+        )
+    )
+
+
+async def replace_reference(db: AsyncSession, old_path: Optional[str], new_path: Optional[str]):
+    if old_path == new_path:
+        return
+    await acquire(db, new_path)
+    await release(db, old_path)
+
+
+def _remove_blob_files(path: str):
+    original = local_path(path)
+    stem, _ = os.path.splitext(original)
+    for file_path in [original, *glob.glob(f"{glob.escape(stem)}_w*")]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+async def _delete_blob(storage: StorageBackend, path: str):
+    if storage.is_local:
+        await asyncio.to_thread(_remove_blob_files, path)
+        return
+    key = path[len("/static/"):]
+    variants = [variant_name(key, width, extension) for width in VARIANT_WIDTHS for extension in VARIANT_FORMATS]
+    await asyncio.gather(*(storage.delete(k) for k in [key, *variants]))
+
+
+async def gc_sweep(db: AsyncSession, grace: timedelta = GC_GRACE_PERIOD) -> int:
+    """
+    Delete blobs nobody has referenced for longer than `grace`, in batches.
+    Returns the number of blobs removed.
+
+    Each batch runs under the exclusive blob lock and removes its files
+    before committing, so an upload of the same content waits for the sweep
+    and then writes the file and row afresh.
+    """
+    cutoff = datetime.utcnow() - grace
+    storage = get_storage()
+    removed = 0
+    while True:
+        await _lock_blobs(db, exclusive=True)
+        result = await db.execute(
+            select(UploadBlob.hash, UploadBlob.path)
+            .where(UploadBlob.ref_count <= 0, UploadBlob.released_at < cutoff)
+            .limit(GC_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        blobs = result.all()
+        if not blobs:
+            await db.commit()
+            break
+        await db.execute(delete(UploadBlob).where(UploadBlob.hash.in_([blob.hash for blob in blobs])))
+        for blob in blobs:
+            await _delete_blob(storage, blob.path)
+        await db.commit()
+        removed += len(blobs)
+    return removed
+
+
+async def recount_references(db: AsyncSession):
+    """
+    Recompute every ref_count from the rows that currently point at a blob.
+    """
+    user_refs = select(func.count()).where(User.photo == UploadBlob.path).scalar_subquery()
+    medicament_refs = select(func.count()).where(Medicament.image == UploadBlob.path).scalar_subquery()
+    await db.execute(update(UploadBlob).values(ref_count=user_refs + medicament_refs))
+    await db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.ref_count == 0, UploadBlob.released_at.is_(None))
+        .values(released_at=datetime.utcnow())
+    )
+
+
+async def load_aliases(db: AsyncSession) -> Dict[str, str]:
+    """
+    Legacy path -> blob path, both relative to the static directory
+    ("uploads/<uuid>.jpg" -> "uploads/<hash>.jpg"), for the static file server.
+    """
+    result = await db.execute(
+        select(UploadAlias.legacy_path, UploadBlob.path).join(UploadBlob, UploadBlob.hash == UploadAlias.blob_hash)
+    )
+    return {legacy[len("/static/"):]: path[len("/static/"):] for legacy, path in result.all()}
+
+
+def _hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _content_type_for(extension: str) -> Optional[str]:
+    for content_type, extensions in IMAGE_TYPES.items():
+        if extension in extensions:
+            return content_type
+    return None
+
+
+async def migrate_legacy_uploads(db: AsyncSession, root: str = UPLOADS_ROOT) -> int:
+    """
+    Move uuid-named uploads to content-addressed names, record an alias for
+    each old path and point users/medicaments at the new paths.
+    """
+    migrated = 0
+    for directory, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            file_path = os.path.join(directory, filename)
+            extension = os.path.splitext(filename)[1].lower()
+            content_type = _content_type_for(extension)
+            if content_type is None or is_variant(file_path) or HASHED_NAME.match(filename):
+                continue
+
+            content_hash = await asyncio.to_thread(_hash_file, file_path)
+            target = os.path.join(directory, f"{content_hash}{IMAGE_TYPES[content_type][0]}")
+            size = os.path.getsize(file_path)
+            if not os.path.exists(target):
+                await asyncio.to_thread(os.replace, file_path, target)
+            # Drops the duplicate (if any) and the variants of the old name,
+            # regenerate them with: python -m services.image_variants
+            await asyncio.to_thread(_remove_blob_files, public_path(file_path))
+
+            legacy, blob_path = public_path(file_path), public_path(target)
+            await db.execute(
+                pg_insert(UploadBlob)
+                .values(hash=content_hash, path=blob_path, size=size, content_type=content_type, ref_count=0)
+                .on_conflict_do_nothing(index_elements=[UploadBlob.hash])
+            )
+            await db.execute(
+                pg_insert(UploadAlias)
+                .values(legacy_path=legacy, blob_hash=content_hash)
+                .on_conflict_do_nothing(index_elements=[UploadAlias.legacy_path])
+            )
+            await db.execute(update(User).where(User.photo == legacy).values(photo=blob_path))
+            await db.execute(update(Medicament).where(Medicament.image == legacy).values(image=blob_path))
+            await db.commit()
+            migrated += 1
+
+    await recount_references(db)
+    await db.commit()
+    return migrated
+
+
+async def _main(command: str):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        if command == "migrate":
+            print(f"Migrated {await migrate_legacy_uploads(db)} uploads")
+        elif command == "gc":
+            print(f"Removed {await gc_sweep(db)} unreferenced blobs")
+        elif command == "recount":
+            await recount_references(db)
+            await db.commit()
+            print("Reference counts rebuilt")
+        else:
+            raise SystemExit("usage: python -m services.blob_store migrate|gc|recount")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else ""))
@@ -0,0 +1,298 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Numeric, case, delete, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.billing import Billing
+from models.Carts import Cart
+from models.appointments import Appointment
+from models.carte_items import cart_medicament
+from models.medicaments import Medicament
+from models.prescription import Prescription
+from models.prescription_medicament import prescription_medicament
+from models.stock_reservations import StockReservation
+from Dto.carte import CartLineOut, CartOut, MedicamentInCart
+from services.inventory import current_stock_query
+
+ABANDONED_CART_TTL = timedelta(days=7)
+SWEEP_BATCH_SIZE = 500
+
+
+def merge_items(items: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """
+    medicament_id -> quantity, summing repeated ids (one upsert can't touch a row twice).
+    """
+    merged: Dict[int, int] = {}
+    for medicament_id, quantity in items:
+        if medicament_id:
+            merged[medicament_id] = merged.get(medicament_id, 0) + quantity
+    return merged
+
+
+async def get_or_create_open_cart(db: AsyncSession, patient_id: int) -> Cart:
+    result = await db.execute(select(Cart).where(Cart.patient_id == patient_id, Cart.is_paid == False))
+    cart = result.scalars().first()
+    if not cart:
+        cart = Cart(patient_id=patient_id, total_price=0.0, is_paid=False)
+        db.add(cart)
+        await db.flush()
+    return cart
+
+
+def _money(value):
+    return func.round(func.cast(value, Numeric(12, 2)), 2)
+
+
+def cart_total(cart_id):
+    """
+    Scalar subquery: sum of quantity * current price over the cart's lines.
+    """
+    return (
+        select(func.coalesce(func.sum(_money(cart_medicament.c.quantity * Medicament.price)), 0.0))
+        .select_from(cart_medicament)
+        .join(Medicament, Medicament.id == cart_medicament.c.medicament_id)
+        .where(cart_medicament.c.cart_id == cart_id)
+        .scalar_subquery()
+    )
+
+
+async def write_lines(db: AsyncSession, cart: Cart, items: Dict[int, int], replace: bool = False, skip_missing: bool = False):
+    """
+    Add `items` to the cart (or make them its exact content with `replace`)
+    in three statements: one IN query checking the medicaments exist, one
+    multi-row upsert of the lines, one UPDATE recomputing the total in SQL.
+    """
+    if items:
+        result = await db.execute(select(Medicament.id).where(Medicament.id.in_(list(items))))
+        found = set(result.scalars().all())
+        missing = [medicament_id for medicament_id in items if medicament_id not in found]
+        if missing and not skip_missing:
+            raise HTTPException(status_code=404, detail=f"Medicament ID {missing[0]} not found")
+        items = {medicament_id: quantity for medicament_id, quantity in items.items() if medicament_id in found}
+
+    if replace:
+        await db.execute(
+            delete(cart_medicament).where(
+                cart_medicament.c.cart_id == cart.id,
+                cart_medicament.c.medicament_id.notin_(list(items)),
+            )
+        )
+    if items:
+        statement = pg_insert(cart_medicament).values([
+            {"cart_id": cart.id, "medicament_id": medicament_id, "quantity": quantity}
+            for medicament_id, quantity in items.items()
+        ])
+        quantity = statement.excluded.quantity if replace else cart_medicament.c.quantity + statement.excluded.quantity
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[cart_medicament.c.cart_id, cart_medicament.c.medicament_id],
+                set_={"quantity": quantity},
+            )
+        )
+    await refresh_total(db, cart)
+
+
+async def refresh_total(db: AsyncSession, cart: Cart):
+    result = await db.execute(
+        update(Cart)
+        .where(Cart.id == cart.id)
+        .values(total_price=cart_total(cart.id))
+        .returning(Cart.total_price)
+        .execution_options(synchronize_session=False)
+    )
+    set_committed_value(cart, "total_price", result.scalar_one())
+
+
+async def prescription_lines(db: AsyncSession, appointment_id: int):
+    """
+    (patient_id, medicament_id, name, available) for every medicament of the
+    appointment's prescription, in one query. `available` is the current
+    stock minus what unexpired reservations of other carts than the
+    patient's open one hold. A prescription without medicaments gives a
+    single row with medicament_id None; no prescription, no rows.
+    """
+    prescribed = (
+        select(prescription_medicament.c.medicament_id)
+        .join(Prescription, Prescription.id == prescription_medicament.c.prescription_id)
+        .where(Prescription.appointment_id == appointment_id)
+    )
+    stock = current_stock_query(prescribed).subquery()
+    patient_cart = (
+        select(Cart.id)
+        .join(Appointment, Appointment.patient_id == Cart.patient_id)
+        .where(Appointment.id == appointment_id, Cart.is_paid == False)
+    )
+    held = (
+        select(StockReservation.medicament_id, func.sum(StockReservation.quantity).label("quantity"))
+        .where(
+            StockReservation.medicament_id.in_(prescribed),
+            StockReservation.cart_id.not_in(patient_cart),
+            StockReservation.expires_at > datetime.utcnow(),
+        )
+        .group_by(StockReservation.medicament_id)
+        .subquery()
+    )
+    result = await db.execute(
+        select(
+            Appointment.patient_id,
+            Medicament.id.label("medicament_id"),
+            Medicament.name,
+            (func.coalesce(stock.c.stock, 0) - func.coalesce(held.c.quantity, 0)).label("available"),
+        )
+        .select_from(Prescription)
+        .join(Appointment, Appointment.id == Prescription.appointment_id)
+        .outerjoin(prescription_medicament, prescription_medicament.c.prescription_id == Prescription.id)
+        .outerjoin(Medicament, Medicament.id == prescription_medicament.c.medicament_id)
+        .outerjoin(stock, stock.c.medicament_id == Medicament.id)
+        .outerjoin(held, held.c.medicament_id == Medicament.id)
+        .where(Prescription.appointment_id == appointment_id)
+        .order_by(Medicament.id)
+    )
+    return result.all()
+
+
+async def fill_from_prescription(db: AsyncSession, appointment_id: int, patient_id: Optional[int] = None) -> Cart:
+    """
+    Put one of each prescribed medicament in the patient's open cart.
+    Lines already in the cart keep their quantity, so filling twice is a no-op.
+    Prescription-only medicaments (legal=False) are allowed here since the
+    prescription covers them, which is why the cart is always the one of the
+    appointment's patient. Runs in the caller's transaction.
+    """
+    rows = await prescription_lines(db, appointment_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Prescription not found")
+    owner = rows[0].patient_id
+    if patient_id is not None and patient_id != owner:
+        raise HTTPException(status_code=403, detail="This prescription belongs to another patient")
+    lines = [row for row in rows if row.medicament_id is not None]
+    if not lines:
+        raise HTTPException(status_code=400, detail="The prescription has no medicaments")
+    out_of_stock = [row.name for row in lines if row.available < 1]
+    if out_of_stock:
+        raise HTTPException(status_code=409, detail=f"Out of stock: {', '.join(out_of_stock)}")
+
+    cart = await get_or_create_open_cart(db, owner)
+    await db.execute(
+        pg_insert(cart_medicament)
+        .values([{"cart_id": cart.id, "medicament_id": row.medicament_id, "quantity": 1} for row in lines])
+        .on_conflict_do_nothing(index_elements=[cart_medicament.c.cart_id, cart_medicament.c.medicament_id])
+    )
+    await refresh_total(db, cart)
+    return cart
+
+
+async def cart_view(db: AsyncSession, *criteria) -> Optional[CartOut]:
+    """
+    The first cart matching `criteria` with its lines, quantities, unit
+    prices, line totals and grand total, all computed in one query. Open
+    carts are priced at current prices; paid carts keep the prices their
+    lines were sold at and the total that was charged.
+    """
+    # Lines of paid carts stamped before unit_price existed fall back to the current price
+    unit_price = case(
+        (Cart.is_paid == True, func.coalesce(cart_medicament.c.unit_price, Medicament.price)),
+        else_=Medicament.price,
+    )
+    line_total = _money(cart_medicament.c.quantity * unit_price)
+    selected = (
+        select(Cart.id).where(*criteria).order_by(Cart.id).limit(1).scalar_subquery()
+    )
+    result = await db.execute(
+        select(
+            Cart.id,
+            Cart.patient_id,
+            Cart.is_paid,
+            Medicament.id.label("medicament_id"),
+            Medicament.name,
+            cart_medicament.c.quantity,
+            func.coalesce(unit_price, 0.0).label("unit_price"),
+            func.coalesce(line_total, 0).label("line_total"),
+            case(
+                (Cart.is_paid == True, func.coalesce(Cart.total_price, 0)),
+                else_=func.coalesce(func.sum(line_total).over(), 0),
+            ).label("total"),
+        )
+        .select_from(Cart)
+        .outerjoin(cart_medicament, cart_medicament.c.cart_id == Cart.id)
+        .outerjoin(Medicament, Medicament.id == cart_medicament.c.medicament_id)
+        .where(Cart.id == selected)
+        .order_by(Medicament.name)
+    )
+    rows = result.all()
+    if not rows:
+        return None
+
+    first = rows[0]
+    lines = [row for row in rows if row.medicament_id is not None]
+    return CartOut(
+        id=first.id,
+        patient_id=first.patient_id,
+        total_price=float(first.total),
+        is_paid=first.is_paid,
+        medicaments=[
+            MedicamentInCart(id=row.medicament_id, name=row.name, price=float(row.unit_price), quantity=row.quantity)
+            for row in lines
+        ],
+        items=[
+            CartLineOut(
+                medicament_id=row.medicament_id,
+                name=row.name,
+                quantity=row.quantity,
+                unit_price=float(row.unit_price),
+                line_total=float(row.line_total),
+            )
+            for row in lines
+        ],
+    )
+
+
+async def expire_abandoned(db: AsyncSession, ttl: timedelta = ABANDONED_CART_TTL) -> Dict[str, int]:
+    """
+    Delete unpaid carts untouched for `ttl`, with their lines and stock
+    reservations, SWEEP_BATCH_SIZE carts per transaction. Carts with a
+    billing (e.g. after reset-payment) are kept, so the billing doesn't lose
+    its cart. Returns what was removed (empty when there was nothing to do).
+    """
+    # Carts from before updated_at existed start their idle clock now
+    stamped = await db.execute(
+        update(Cart).where(Cart.updated_at.is_(None)).values(updated_at=datetime.utcnow())
+    )
+    await db.commit()
+
+    counts = {"carts": 0, "lines": 0, "reservations": 0}
+    cutoff = datetime.utcnow() - ttl
+    while True:
+        result = await db.execute(
+            select(Cart.id)
+            .where(
+                Cart.is_paid == False,
+                Cart.updated_at < cutoff,
+                ~exists(select(Billing.id).where(Billing.cart_id == Cart.id)),
+            )
+            .order_by(Cart.updated_at)
+            .limit(SWEEP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        ids = list(result.scalars().all())
+        if not ids:
+            break
+        reservations = await db.execute(delete(StockReservation).where(StockReservation.cart_id.in_(ids)))
+        lines = await db.execute(delete(cart_medicament).where(cart_medicament.c.cart_id.in_(ids)))
+        # The row locks keep checkout and new lines off these carts until commit
+        carts = await db.execute(
+            delete(Cart).where(Cart.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        counts["carts"] += carts.rowcount
+        counts["lines"] += lines.rowcount
+        counts["reservations"] += reservations.rowcount
+        if len(ids) < SWEEP_BATCH_SIZE:
+            break
+    if stamped.rowcount:
+        counts["stamped"] = stamped.rowcount
+    return {name: count for name, count in counts.items() if count}
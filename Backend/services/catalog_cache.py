@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from models.catalog_versions import CatalogVersion
+from models.stock_ledger import StockMovement
+
+logger = logging.getLogger(__name__)
+
+CATALOG = "medicaments"
+CHANNEL = "catalog_changed"
+# Without a LISTEN connection, re-read the version from the database this often
+VERSION_TTL = 5
+PAGE_CACHE_SIZE = 256
+
+
+class CatalogCache:
+    """
+    Serialized catalog responses cached per catalog version.
+
+    The version lives in `catalog_versions` and is bumped by every catalog
+    write. Workers learn about bumps through Postgres LISTEN/NOTIFY; when the
+    listener is down they fall back to re-reading the version every
+    VERSION_TTL seconds.
+
+    Stock movements (sales above all) leave the version alone, so they never
+    contend on its row: they move the stock mark, the id of the newest
+    ledger movement, re-read every VERSION_TTL seconds. Pages are cached
+    per (version, stock mark) stamp; knowing it is enough to answer
+    If-None-Match without touching the database.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.checked_at = 0.0
+        self.stock_mark: Optional[int] = None
+        self.stock_checked_at = 0.0
+        self.listening = False
+        self._pages: "OrderedDict[Tuple[Tuple[int, int], str], Tuple[str, bytes]]" = OrderedDict()
+
+    def forget(self):
+        """
+        Local write committed: re-read the version on the next request.
+        """
+        self.version = None
+        self.stock_mark = None
+
+    def forget_stock(self):
+        """
+        Local stock movement committed: re-read the stock mark on the next request.
+        """
+        self.stock_mark = None
+
+    def on_notify(self, version: int):
+        if self.version is None or version > self.version:
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    async def current_version(self, db: AsyncSession) -> int:
+        fresh = self.listening or time.monotonic() - self.checked_at < VERSION_TTL
+        if self.version is not None and fresh:
+            return self.version
+        result = await db.execute(select(CatalogVersion.version).where(CatalogVersion.name == CATALOG))
+        self.version = result.scalar_one_or_none() or 0
+        self.checked_at = time.monotonic()
+        return self.version
+
+    async def current_stock_mark(self, db: AsyncSession) -> int:
+        if self.stock_mark is not None and time.monotonic() - self.stock_checked_at < VERSION_TTL:
+            return self.stock_mark
+        self.stock_mark = await db.scalar(select(func.coalesce(func.max(StockMovement.id), 0))) or 0
+        self.stock_checked_at = time.monotonic()
+        return self.stock_mark
+
+    async def current_stamp(self, db: AsyncSession) -> Tuple[int, int]:
+        return await self.current_version(db), await self.current_stock_mark(db)
+
+    def etag(self, stamp: Tuple[int, int], key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        version, stock_mark = stamp
+        return f'"{CATALOG}-{version}.{stock_mark}-{digest}"'
+
+    async def page(self, stamp: Tuple[int, int], key: str, render: Callable[[], Awaitable[bytes]]) -> Tuple[str, bytes]:
+        """
+        (etag, body) for `key` at `stamp`, rendering it on a miss.
+        """
+        cached = self._pages.get((stamp, key))
+        if cached is not None:
+            self._pages.move_to_end((stamp, key))
+            return cached
+        cached = (self.etag(stamp, key), await render())
+        # Only keep pages of the newest stamp: older ones can no longer be served
+        for stale in [k for k in self._pages if k[0] < stamp]:
+            del self._pages[stale]
+        self._pages[(stamp, key)] = cached
+        if len(self._pages) > PAGE_CACHE_SIZE:
+            self._pages.popitem(last=False)
+        return cached
+
+
+catalog_cache = CatalogCache()
+
+
+async def bump_version(db: AsyncSession):
+    """
+    Bump the catalog version inside the caller's transaction and tell the
+    other workers once it commits (NOTIFY is delivered on commit).
+    Call `catalog_cache.forget()` after the commit.
+    """
+    statement = pg_insert(CatalogVersion).values(name=CATALOG, version=1, updated_at=datetime.utcnow())
+    statement = statement.on_conflict_do_update(
+        index_elements=[CatalogVersion.name],
+        set_={"version": CatalogVersion.version + 1, "updated_at": statement.excluded.updated_at},
+    ).returning(CatalogVersion.version)
+    result = await db.execute(statement)
+    version = result.scalar_one()
+    await db.execute(select(func.pg_notify(CHANNEL, str(version))))
+
+
+async def listen_for_changes(engine: AsyncEngine, retry_delay: float = 5):
+    """
+    Keep a LISTEN connection open for the life of the process, reconnecting on failure.
+    Meant to run as a background task started at startup, stopped with `stop_listening`.
+    """
+    def callback(connection, pid, channel, payload):
+        try:
+            catalog_cache.on_notify(int(payload))
+        except ValueError:
+            catalog_cache.forget()
+
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection
+                if not hasattr(driver, "add_listener"):
+                    logger.info("Catalog changes are polled: the database driver has no LISTEN support")
+                    return
+                await driver.add_listener(CHANNEL, callback)
+                # Bumps made while we were disconnected were missed
+                catalog_cache.forget()
+                catalog_cache.listening = True
+                try:
+                    while not driver.is_closed():
+                        await asyncio.sleep(retry_delay)
+                finally:
+                    catalog_cache.listening = False
+                    # Closed rather than handed back to the pool still listening
+                    await conn.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            catalog_cache.listening = False
+            logger.warning(f"Catalog change listener disconnected: {e}")
+        await asyncio.sleep(retry_delay)
+
+
+async def stop_listening(task: Optional[asyncio.Task]):
+    """
+    Cancel the listener task (app shutdown) and wait until its connection is closed.
+    """
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,64 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.Carts import Cart
+from services.inventory import current_stock, record_movements, sell
+from services.reservations import cart_lines, held_by_other_carts, insufficient_stock, release_cart
+from services.sales import record_sale, reverse_sale
+
+
+async def settle_cart(db: AsyncSession, cart: Cart, payment_method: Optional[str] = None, day: Optional[date] = None):
+    """
+    Take the cart's lines out of stock and mark it paid, all or nothing.
+
+    Sale movements are appended to the stock ledger only if every line is
+    covered by current stock minus what other carts still hold; otherwise
+    nothing is applied and 409 is raised. The sale is added to the sales
+    rollups for `day` (today by default). Runs in the caller's transaction;
+    call `catalog_cache.forget_stock()` after the commit.
+    """
+    cart_id = cart.id
+    # Claim the cart first: a concurrent settlement of the same cart stops here
+    claimed = await db.execute(
+        update(Cart).where(Cart.id == cart_id, Cart.is_paid == False).values(is_paid=True).returning(Cart.id)
+    )
+    if claimed.scalar_one_or_none() is None:
+        raise HTTPException(status_code=400, detail="Cart is already marked as paid")
+
+    lines = await cart_lines(db, cart_id)
+    if lines:
+        held = await held_by_other_carts(db, cart_id, list(lines))
+        short = await sell(db, lines, held, reference=f"cart:{cart_id}")
+        if short:
+            levels = await current_stock(db, short)
+            error = await insufficient_stock(db, {i: levels.get(i, 0) - held.get(i, 0) for i in short})
+            await db.rollback()
+            raise error
+        await record_sale(db, cart_id, payment_method, day)
+
+    await release_cart(db, cart_id)
+
+
+async def unsettle_cart(db: AsyncSession, cart: Cart):
+    """
+    Undo settle_cart: mark the cart unpaid, put its lines back in stock as
+    return movements and take the sale back out of the rollups. Raises 400
+    when the cart isn't paid. Runs in the caller's transaction.
+    """
+    cart_id = cart.id
+    # Lock the paid cart and read its sale day before the update below bumps updated_at
+    paid = (await db.execute(
+        select(Cart.updated_at).where(Cart.id == cart_id, Cart.is_paid == True).with_for_update()
+    )).first()
+    if paid is None:
+        raise HTTPException(status_code=400, detail="Cart is not marked as paid")
+    await db.execute(update(Cart).where(Cart.id == cart_id).values(is_paid=False))
+
+    lines = await cart_lines(db, cart_id)
+    if lines:
+        await record_movements(db, "return", lines, reference=f"cart:{cart_id}")
+        await reverse_sale(db, cart_id, paid.updated_at)
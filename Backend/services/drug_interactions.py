@@ -0,0 +1,171 @@
+import json
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from services.medicament_search import tokenize
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "drug_interactions.json")
+SEVERITIES = ("contraindicated", "major", "moderate", "minor")
+
+
+@dataclass(frozen=True)
+class Rule:
+    severity: str
+    message: str
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    What a medicament name resolves to: the INNs it contains and the
+    class bits (classes plus single-drug bits used by class-level rules).
+    """
+    drugs: FrozenSet[str]
+    bits: int
+
+
+def _bits(mask: int) -> Iterable[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+@dataclass
+class InteractionRules:
+    """
+    The dataset compiled for O(1) checks: drug-drug rules in a hashed pair
+    index, rules involving a class as (bit, bit) pairs with a per-bit mask
+    of interacting bits, and an alias index to resolve medicament names.
+    """
+
+    version: int = 0
+    # first token -> [(alias tokens, drug)]
+    aliases: Dict[str, List[Tuple[Tuple[str, ...], str]]] = field(default_factory=dict)
+    drug_bits: Dict[str, int] = field(default_factory=dict)
+    pairs: Dict[Tuple[str, str], Rule] = field(default_factory=dict)
+    bit_pairs: Dict[Tuple[int, int], Rule] = field(default_factory=dict)
+    partners: Dict[int, int] = field(default_factory=dict)
+    bit_names: List[str] = field(default_factory=list)
+
+    @classmethod
+    def compile(cls, dataset: dict) -> "InteractionRules":
+        rules = cls(version=dataset.get("version", 0))
+        for drug, aliases in dataset["drugs"].items():
+            for alias in [drug, *aliases]:
+                tokens = tuple(tokenize(alias))
+                if tokens:
+                    rules.aliases.setdefault(tokens[0], []).append((tokens, drug))
+            rules.drug_bits[drug] = 0
+
+        bit_of: Dict[str, int] = {}
+
+        def bit(name: str) -> int:
+            if name not in bit_of:
+                bit_of[name] = len(rules.bit_names)
+                rules.bit_names.append(name)
+            return bit_of[name]
+
+        for name, drugs in dataset["classes"].items():
+            for drug in drugs:
+                rules.drug_bits[drug] |= 1 << bit(f"class:{name}")
+
+        for entry in dataset["rules"]:
+            a, b = entry["between"]
+            if entry["severity"] not in SEVERITIES:
+                raise ValueError(f"Unknown severity in interaction rule {a} / {b}: {entry['severity']}")
+            rule = Rule(entry["severity"], entry["message"])
+            for side in (a, b):
+                kind, _, name = side.partition(":")
+                if kind not in ("class", "drug") or (kind == "drug" and name not in rules.drug_bits):
+                    raise ValueError(f"Unknown drug or class in interaction rule: {side}")
+                if kind == "class" and side not in bit_of:
+                    raise ValueError(f"Unknown drug or class in interaction rule: {side}")
+            if a.startswith("drug:") and b.startswith("drug:"):
+                rules.pairs[tuple(sorted((a[5:], b[5:])))] = rule
+                continue
+            # A drug named in a class-level rule gets a bit of its own
+            for side in (a, b):
+                if side.startswith("drug:"):
+                    rules.drug_bits[side[5:]] |= 1 << bit(side)
+            x, y = sorted((bit_of[a], bit_of[b]))
+            rules.bit_pairs[(x, y)] = rule
+            rules.partners[x] = rules.partners.get(x, 0) | 1 << y
+            rules.partners[y] = rules.partners.get(y, 0) | 1 << x
+        return rules
+
+    def profile(self, name: str) -> Profile:
+        tokens = tokenize(name)
+        drugs = set()
+        for i, token in enumerate(tokens):
+            for alias, drug in self.aliases.get(token, ()):
+                if tuple(tokens[i:i + len(alias)]) == alias:
+                    drugs.add(drug)
+        bits = 0
+        for drug in drugs:
+            bits |= self.drug_bits[drug]
+        return Profile(frozenset(drugs), bits)
+
+    def between(self, first: Profile, second: Profile) -> List[Rule]:
+        """
+        Every rule triggered by two different medicaments.
+        """
+        found = []
+        for a in first.drugs:
+            for b in second.drugs:
+                rule = self.pairs.get((a, b) if a <= b else (b, a))
+                if rule is not None:
+                    found.append(rule)
+        for x in _bits(first.bits):
+            for y in _bits(self.partners.get(x, 0) & second.bits):
+                found.append(self.bit_pairs[(x, y) if x <= y else (y, x)])
+        # One entry per rule, even when several drug/class paths reach it
+        return list(dict.fromkeys(found))
+
+
+_rules: Optional[InteractionRules] = None
+
+
+def load_rules(path: str = DATASET) -> InteractionRules:
+    """
+    Read and compile the interaction dataset; called once at startup.
+    """
+    global _rules
+    with open(path, encoding="utf-8") as f:
+        _rules = InteractionRules.compile(json.load(f))
+    _profile.cache_clear()
+    return _rules
+
+
+def get_rules() -> InteractionRules:
+    return _rules if _rules is not None else load_rules()
+
+
+@lru_cache(maxsize=4096)
+def _profile(name: str) -> Profile:
+    return get_rules().profile(name)
+
+
+def check_interactions(names: Dict[int, str]) -> List[dict]:
+    """
+    Interactions between the medicaments `names` (id -> name), most severe
+    first. Ten medicaments are 45 pairs of set and bitmask lookups.
+    """
+    rules = get_rules()
+    profiles = [(medicament_id, name, _profile(name)) for medicament_id, name in sorted(names.items())]
+    found = []
+    for i, (first_id, first_name, first) in enumerate(profiles):
+        if not (first.drugs or first.bits):
+            continue
+        for second_id, second_name, second in profiles[i + 1:]:
+            for rule in rules.between(first, second):
+                found.append({
+                    "medicament_ids": [first_id, second_id],
+                    "medicaments": [first_name, second_name],
+                    "severity": rule.severity,
+                    "message": rule.message,
+                })
+    found.sort(key=lambda interaction: (SEVERITIES.index(interaction["severity"]), interaction["medicament_ids"]))
+    return found
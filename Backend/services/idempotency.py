@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models.idempotency_keys import IdempotencyKey
+
+KEY_TTL = timedelta(hours=24)
+# A claim still pending after this is taken to be abandoned (its worker died
+# before storing the response) and the next request with the key runs again
+PENDING_LEASE = timedelta(minutes=2)
+# How long a duplicate waits for the first request (run by another worker) to finish
+WAIT_TIMEOUT = 30
+POLL_INTERVAL = 0.2
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# (scope, key) -> (request hash, future of (status, body)) for requests running in this process
+_inflight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+
+def request_hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _mismatch() -> HTTPException:
+    return HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+
+def _replay(status_code: int, body: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content=json.loads(body), headers={REPLAYED_HEADER: "true"})
+
+
+async def _claim(scope: str, key: str, hashed: str, claimed_at: datetime) -> Optional[IdempotencyKey]:
+    """
+    Insert the pending row, or take over an expired or abandoned one.
+    Returns None when we own the key, else the existing row.
+    """
+    statement = pg_insert(IdempotencyKey).values(
+        scope=scope, key=key, request_hash=hashed, created_at=claimed_at, expires_at=claimed_at + KEY_TTL
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+        set_={
+            "request_hash": statement.excluded.request_hash,
+            "status_code": None,
+            "response_body": None,
+            "created_at": statement.excluded.created_at,
+            "expires_at": statement.excluded.expires_at,
+        },
+        # Not purged yet is not the same as still valid
+        where=or_(
+            IdempotencyKey.expires_at < claimed_at,
+            and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.created_at < claimed_at - PENDING_LEASE),
+        ),
+    ).returning(IdempotencyKey.key)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(statement)
+        claimed = result.scalar_one_or_none() is not None
+        await db.commit()
+        if claimed:
+            return None
+        return await db.get(IdempotencyKey, (scope, key))
+
+
+async def _wait_for_other_worker(scope: str, key: str) -> IdempotencyKey:
+    deadline = asyncio.get_running_loop().time() + WAIT_TIMEOUT
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        async with AsyncSessionLocal() as db:
+            row = await db.get(IdempotencyKey, (scope, key))
+        if row is None or row.status_code is not None:
+            return row
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+
+async def _finish(scope: str, key: str, claimed_at: datetime, status_code: Optional[int], body: Optional[str]):
+    async with AsyncSessionLocal() as db:
+        row = await db.get(IdempotencyKey, (scope, key), with_for_update=True)
+        # Past its lease the claim may have been taken over: leave the new owner's row alone
+        if row is not None and row.created_at == claimed_at:
+            if status_code is None:
+                # Failed on our side: forget the key so the client can retry
+                await db.delete(row)
+            else:
+                row.status_code = status_code
+                row.response_body = body
+        await db.commit()
+
+
+async def idempotent(
+    scope: str,
+    key: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+    serialize: Callable[[Any], Any] = lambda result: result,
+) -> JSONResponse:
+    """
+    Run `handler` once per (scope, key). Retries with the same payload get
+    the stored response (with an Idempotent-Replayed header), concurrent
+    duplicates wait for the first request instead of running again, and a
+    reused key with a different payload is rejected with 422. Client errors
+    (4xx) are stored like successes; server errors release the key.
+
+    A worker dying between the handler's commit and storing the response
+    leaves a pending claim; after PENDING_LEASE the next retry runs the
+    handler again. Handlers must tolerate that: billing refuses an already
+    paid cart, and payment intents carry their own provider idempotency key.
+    """
+    hashed = request_hash(payload)
+    inflight = _inflight.get((scope, key))
+    if inflight is not None:
+        if inflight[0] != hashed:
+            raise _mismatch()
+        status_code, body = await asyncio.shield(inflight[1])
+        return _replay(status_code, body)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[(scope, key)] = (hashed, future)
+    try:
+        status_code, body, replayed = await _run_once(scope, key, hashed, handler, serialize)
+        future.set_result((status_code, body))
+    except BaseException as e:
+        future.set_exception(e if isinstance(e, HTTPException) else HTTPException(status_code=500, detail="Original request failed"))
+        # Nobody may be waiting on it: avoid "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        _inflight.pop((scope, key), None)
+    if replayed:
+        return _replay(status_code, body)
+    return JSONResponse(status_code=status_code, content=json.loads(body))
+
+
+async def _run_once(scope, key, hashed, handler, serialize) -> Tuple[int, str, bool]:
+    claimed_at = datetime.utcnow()
+    existing = await _claim(scope, key, hashed, claimed_at)
+    if existing is not None:
+        if existing.request_hash != hashed:
+            raise _mismatch()
+        if existing.status_code is None:
+            existing = await _wait_for_other_worker(scope, key)
+            if existing is None:
+                raise HTTPException(status_code=409, detail="The first request with this Idempotency-Key failed, retry")
+        return existing.status_code, existing.response_body, True
+
+    try:
+        result = await handler()
+    except HTTPException as e:
+        if e.status_code >= 500:
+            await _finish(scope, key, claimed_at, None, None)
+            raise
+        status_code, body = e.status_code, json.dumps({"detail": e.detail})
+    except BaseException:
+        await _finish(scope, key, claimed_at, None, None)
+        raise
+    else:
+        status_code, body = 200, json.dumps(serialize(result), default=str)
+    await _finish(scope, key, claimed_at, status_code, body)
+    return status_code, body, False
+
+
+async def purge_expired(db: AsyncSession) -> int:
+    result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+    await db.commit()
+    return result.rowcount
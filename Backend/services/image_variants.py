@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (64, 256, 1024)
+VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".jfif", ".png", ".webp"}
+VARIANT_NAME = re.compile(r"_w\d+\.(webp|jpg)$")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = set()
+
+
+def variant_name(path: str, width: int, extension: str) -> str:
+    """
+    static/uploads/abc.png -> static/uploads/abc_w256.webp
+    """
+    stem, _ = os.path.splitext(path)
+    return f"{stem}_w{width}.{extension}"
+
+
+def is_variant(path: str) -> bool:
+    return VARIANT_NAME.search(path) is not None
+
+
+def generate_variants(path: str) -> List[str]:
+    """
+    Write resized WebP and JPEG copies of `path` next to it.
+    CPU bound, meant to run in the process pool.
+    """
+    created = []
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        for width in VARIANT_WIDTHS:
+            # Never upscale: small originals are served as they are
+            if width >= image.width:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, image_format in VARIANT_FORMATS.items():
+                target = variant_name(path, width, extension)
+                frame = resized
+                if image_format == "JPEG" or not has_alpha:
+                    frame = resized.convert("RGB")
+                temp_path = f"{target}.part"
+                frame.save(temp_path, image_format, quality=80, optimize=True)
+                os.replace(temp_path, target)
+                created.append(target)
+    return created
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2))
+    return _pool
+
+
+def _on_done(future, publish):
+    _pending.discard(future)
+    if future.exception() is not None:
+        logger.error(f"Failed to generate image variants: {future.exception()}")
+    elif publish is not None:
+        task = asyncio.ensure_future(publish(future.result()))
+        _pending.add(task)
+        task.add_done_callback(lambda t: _on_done(t, None))
+
+
+def schedule_variants(path: str, publish: Optional[Callable[[List[str]], Awaitable]] = None):
+    """
+    Queue variant generation for a freshly stored upload without waiting for it.
+    `publish`, when given, is awaited with the created paths (used to push
+    them to remote storage).
+    """
+    future = asyncio.get_running_loop().run_in_executor(_get_pool(), generate_variants, path)
+    _pending.add(future)
+    future.add_done_callback(lambda f: _on_done(f, publish))
+
+
+def pick_variant(path: str, width: int, accept_webp: bool) -> Optional[str]:
+    """
+    Return the smallest existing variant of `path` at least `width` pixels wide.
+    """
+    extension = "webp" if accept_webp else "jpg"
+    for candidate in VARIANT_WIDTHS:
+        if candidate >= width:
+            target = variant_name(path, candidate, extension)
+            if os.path.isfile(target):
+                return target
+    return None
+
+
+def _find_sources(root: str) -> List[str]:
+    sources = []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS and not is_variant(path):
+                sources.append(path)
+    return sources
+
+
+def _backfill_one(path: str) -> int:
+    try:
+        return len(generate_variants(path))
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return 0
+
+
+def backfill(root: str = os.path.join("static", "uploads"), workers: Optional[int] = None) -> int:
+    """
+    Generate variants for every existing upload under `root` in parallel.
+    """
+    sources = _find_sources(root)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        created = sum(pool.map(_backfill_one, sources, chunksize=8))
+    print(f"Processed {len(sources)} images, wrote {created} variants")
+    return created
+
+
+if __name__ == "__main__":
+    # python -m services.image_variants [uploads_dir]
+    backfill(*sys.argv[1:2])
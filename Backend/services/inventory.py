@@ -0,0 +1,249 @@
+import asyncio
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, bindparam, func, insert, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.medicaments import Medicament
+from models.stock_ledger import MOVEMENT_KINDS, StockMovement, StockSnapshot
+
+# Namespace of the transaction-level advisory locks guarding a medicament's stock
+LOCK_NAMESPACE = 7301
+# Advisory lock every ledger writer holds shared until it commits; compaction
+# takes it exclusively to read a watermark no open transaction can fall under
+LEDGER_LOCK = (7302, 0)
+LOW_STOCK_THRESHOLD = 10
+
+_lock_statement = text(
+    "SELECT pg_advisory_xact_lock(:namespace, k) FROM (SELECT unnest(:ids) AS k ORDER BY k) AS ordered"
+).bindparams(bindparam("ids", type_=ARRAY(Integer)))
+
+
+async def lock_stock(db: AsyncSession, medicament_ids: Iterable[int]):
+    """
+    Serialize stock checks on these medicaments until the transaction ends.
+    Advisory locks, taken in id order, so the medicament rows themselves
+    are never locked or rewritten by sales.
+    """
+    ids = sorted(set(medicament_ids))
+    if ids:
+        await db.execute(_lock_statement, {"namespace": LOCK_NAMESPACE, "ids": ids})
+
+
+def current_stock_query(medicament_ids: Optional[List[int]] = None):
+    """
+    (medicament_id, stock) = snapshot + movements after it.
+    """
+    tail = (
+        select(StockMovement.medicament_id, func.sum(StockMovement.quantity).label("quantity"))
+        .outerjoin(StockSnapshot, StockSnapshot.medicament_id == StockMovement.medicament_id)
+        .where(StockMovement.id > func.coalesce(StockSnapshot.last_movement_id, 0))
+        .group_by(StockMovement.medicament_id)
+    )
+    if medicament_ids is not None:
+        tail = tail.where(StockMovement.medicament_id.in_(medicament_ids))
+    tail = tail.subquery()
+    query = (
+        select(
+            Medicament.id.label("medicament_id"),
+            (func.coalesce(StockSnapshot.quantity, 0) + func.coalesce(tail.c.quantity, 0)).label("stock"),
+        )
+        .outerjoin(StockSnapshot, StockSnapshot.medicament_id == Medicament.id)
+        .outerjoin(tail, tail.c.medicament_id == Medicament.id)
+    )
+    if medicament_ids is not None:
+        query = query.where(Medicament.id.in_(medicament_ids))
+    return query
+
+
+async def current_stock(db: AsyncSession, medicament_ids: Optional[List[int]] = None) -> Dict[int, int]:
+    result = await db.execute(current_stock_query(medicament_ids))
+    return {medicament_id: int(stock) for medicament_id, stock in result.all()}
+
+
+async def record_movements(db: AsyncSession, kind: str, quantities: Dict[int, int], reference: Optional[str] = None):
+    """
+    Append one movement per medicament in a single INSERT. Zero quantities are skipped.
+    """
+    if kind not in MOVEMENT_KINDS:
+        raise ValueError(f"Unknown stock movement kind: {kind}")
+    rows = [
+        {"medicament_id": medicament_id, "kind": kind, "quantity": quantity, "reference": reference, "created_at": datetime.utcnow()}
+        for medicament_id, quantity in quantities.items()
+        if quantity
+    ]
+    if rows:
+        await db.execute(
+            text("SELECT pg_advisory_xact_lock_shared(:namespace, :key)"),
+            {"namespace": LEDGER_LOCK[0], "key": LEDGER_LOCK[1]},
+        )
+        await db.execute(insert(StockMovement), rows)
+
+
+async def adjust_to(db: AsyncSession, targets: Dict[int, int], reference: Optional[str] = None):
+    """
+    Record the adjustments bringing each medicament to its target stock (admin edits, imports).
+    """
+    await lock_stock(db, targets)
+    levels = await current_stock(db, list(targets))
+    await record_movements(
+        db, "adjustment",
+        {medicament_id: target - levels.get(medicament_id, 0) for medicament_id, target in targets.items()},
+        reference,
+    )
+
+
+async def sell(db: AsyncSession, quantities: Dict[int, int], held: Dict[int, int], reference: str) -> List[int]:
+    """
+    Append sale movements if every line is covered by current stock minus
+    `held` (what other carts reserve). All or nothing: returns the ids that
+    are short and writes nothing when there are any.
+    """
+    await lock_stock(db, quantities)
+    levels = await current_stock(db, list(quantities))
+    short = [
+        medicament_id for medicament_id, quantity in quantities.items()
+        if levels.get(medicament_id, 0) - held.get(medicament_id, 0) < quantity
+    ]
+    if not short:
+        await record_movements(db, "sale", {medicament_id: -quantity for medicament_id, quantity in quantities.items()}, reference)
+    return short
+
+
+async def compact(db: AsyncSession) -> int:
+    """
+    Fold settled movements into stock_snapshots and copy the result to
+    medicaments.stock (kept as a lagging, read-only figure). One statement
+    per step; returns the number of medicaments compacted.
+
+    The watermark is read under the exclusive ledger lock: once it is granted
+    every transaction that inserted movements has ended, and any later one
+    gets a higher id, so no movement at or below it can still commit.
+    """
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:namespace, :key)"),
+        {"namespace": LEDGER_LOCK[0], "key": LEDGER_LOCK[1]},
+    )
+    watermark = await db.scalar(select(func.max(StockMovement.id)))
+    # Writers only wait for the read above, not for the fold
+    await db.commit()
+    if watermark is None:
+        return 0
+    folded = (
+        select(
+            StockMovement.medicament_id,
+            (func.coalesce(StockSnapshot.quantity, 0) + func.sum(StockMovement.quantity)).label("quantity"),
+            func.max(StockMovement.id).label("last_movement_id"),
+            func.now().label("taken_at"),
+        )
+        .outerjoin(StockSnapshot, StockSnapshot.medicament_id == StockMovement.medicament_id)
+        .where(
+            StockMovement.id > func.coalesce(StockSnapshot.last_movement_id, 0),
+            StockMovement.id <= watermark,
+        )
+        .group_by(StockMovement.medicament_id, StockSnapshot.quantity)
+    )
+    statement = pg_insert(StockSnapshot).from_select(["medicament_id", "quantity", "last_movement_id", "taken_at"], folded)
+    statement = statement.on_conflict_do_update(
+        index_elements=[StockSnapshot.medicament_id],
+        set_={
+            "quantity": statement.excluded.quantity,
+            "last_movement_id": statement.excluded.last_movement_id,
+            "taken_at": statement.excluded.taken_at,
+        },
+    ).returning(StockSnapshot.medicament_id)
+    compacted = (await db.execute(statement)).scalars().all()
+    if compacted:
+        await db.execute(
+            update(Medicament)
+            .where(Medicament.id == StockSnapshot.medicament_id, Medicament.id.in_(compacted))
+            .values(stock=StockSnapshot.quantity)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return len(compacted)
+
+
+async def initialize_snapshots(db: AsyncSession) -> int:
+    """
+    One-off: seed snapshots from medicaments.stock for medicaments the ledger doesn't know yet.
+    """
+    known = select(StockMovement.medicament_id).union(select(StockSnapshot.medicament_id))
+    statement = pg_insert(StockSnapshot).from_select(
+        ["medicament_id", "quantity", "last_movement_id", "taken_at"],
+        select(Medicament.id, Medicament.stock, 0, func.now()).where(Medicament.id.notin_(known)),
+    ).on_conflict_do_nothing()
+    result = await db.execute(statement)
+    await db.commit()
+    return result.rowcount
+
+
+class LowStockTracker:
+    """
+    Current stock per medicament kept up to date from the ledger tail: each
+    refresh only reads movements newer than the last one seen. A full
+    re-read happens after every compaction to pick up late commits.
+    """
+
+    def __init__(self):
+        self.levels: Dict[int, int] = {}
+        self.last_movement_id = 0
+        self._lock = asyncio.Lock()
+
+    async def reload(self, db: AsyncSession):
+        async with self._lock:
+            self.last_movement_id = await db.scalar(select(func.coalesce(func.max(StockMovement.id), 0)))
+            self.levels = await current_stock(db)
+
+    async def refresh(self, db: AsyncSession):
+        if not self.levels and not self.last_movement_id:
+            await self.reload(db)
+            return
+        async with self._lock:
+            result = await db.execute(
+                select(StockMovement.medicament_id, func.sum(StockMovement.quantity), func.max(StockMovement.id))
+                .where(StockMovement.id > self.last_movement_id)
+                .group_by(StockMovement.medicament_id)
+            )
+            for medicament_id, quantity, last_id in result.all():
+                self.levels[medicament_id] = self.levels.get(medicament_id, 0) + int(quantity)
+                self.last_movement_id = max(self.last_movement_id, last_id)
+
+    def report(self, threshold: int = LOW_STOCK_THRESHOLD) -> List[Tuple[int, int]]:
+        """
+        (medicament_id, stock) at or below `threshold`, lowest first.
+        """
+        return sorted(
+            ((medicament_id, stock) for medicament_id, stock in self.levels.items() if stock <= threshold),
+            key=lambda item: (item[1], item[0]),
+        )
+
+
+low_stock = LowStockTracker()
+
+
+async def compact_and_reload(db: AsyncSession) -> int:
+    compacted = await compact(db)
+    await low_stock.reload(db)
+    return compacted
+
+
+async def _main(command: str):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        if command == "init":
+            print(f"Seeded {await initialize_snapshots(db)} stock snapshots")
+        elif command == "compact":
+            print(f"Compacted stock of {await compact(db)} medicaments")
+        else:
+            raise SystemExit("usage: python -m services.inventory init|compact")
+
+
+if __name__ == "__main__":
+    # python -m services.inventory init      (once, before the ledger goes live)
+    # python -m services.inventory compact
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else ""))
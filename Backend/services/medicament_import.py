@@ -0,0 +1,197 @@
+import asyncio
+import codecs
+import csv
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from Dto.medicamentdto import MedicamentCreate
+from models.medicaments import Medicament
+from services.blob_store import acquire
+from services.catalog_cache import bump_version, catalog_cache
+from services.inventory import adjust_to, record_movements
+
+# 8 columns per row keeps a batch well under the 32767 bind parameter limit
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+FORMATS = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json": "ndjson",
+}
+# Only set when a row creates the medicament: existing images are left alone,
+# and the stock of existing medicaments moves through ledger adjustments
+INSERT_ONLY_COLUMNS = {"image", "stock"}
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+
+    def add_error(self, row: int, name: Optional[str], messages: List[str]):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "name": name, "errors": messages})
+
+    def as_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yield (line number, line) from a byte stream without buffering it whole.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    number = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            number += 1
+            yield number, line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield number + 1, pending.rstrip("\r")
+
+
+async def iter_csv_records(lines: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Rows keyed by the header line. A quoted field may span lines: a record
+    is complete once it holds an even number of quote characters.
+    """
+    header = None
+    record, start = "", 0
+    async for number, line in lines:
+        record = f"{record}\n{line}" if record else line
+        start = start or number
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record_start, record, start = start, "", 0
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+        yield record_start, dict(zip(header, values))
+    if record:
+        yield start, {"__error__": "Unterminated quoted field"}
+
+
+async def iter_ndjson_records(lines: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Tuple[int, dict]]:
+    async for number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            value = {"__error__": f"Invalid JSON: {e}"}
+        if not isinstance(value, dict):
+            value = {"__error__": "Each line must be a JSON object"}
+        yield number, value
+
+
+def _validate_batch(records: List[Tuple[int, dict]], from_csv: bool) -> Tuple[List[dict], List[Tuple[int, Optional[str], List[str]]]]:
+    """
+    CPU bound, runs in a worker thread. Returns the valid rows (last one wins
+    per name) and the rejected ones.
+    """
+    valid: Dict[str, dict] = {}
+    rejected = []
+    for number, record in records:
+        if "__error__" in record:
+            rejected.append((number, None, [record["__error__"]]))
+            continue
+        if from_csv:
+            # Empty CSV cells mean "not given", so optional fields fall back to their defaults
+            record = {key: value.strip() for key, value in record.items() if key and value is not None and value.strip() != ""}
+        try:
+            medicament = MedicamentCreate.model_validate(record)
+        except ValidationError as e:
+            messages = [f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}" for error in e.errors()]
+            rejected.append((number, record.get("name"), messages))
+            continue
+        valid[medicament.name] = medicament.model_dump()
+    return list(valid.values()), rejected
+
+
+async def _upsert_batch(db: AsyncSession, rows: List[dict]) -> Tuple[int, int]:
+    statement = pg_insert(Medicament).values(rows)
+    updates = {
+        column.name: statement.excluded[column.name]
+        for column in Medicament.__table__.columns
+        if column.name not in ("id", "name") and column.name not in INSERT_ONLY_COLUMNS
+    }
+    statement = statement.on_conflict_do_update(index_elements=[Medicament.name], set_=updates)
+    # xmax is 0 for freshly inserted tuples, non-zero for updated ones
+    result = await db.execute(statement.returning(
+        Medicament.id, Medicament.name, Medicament.image, literal_column("xmax = 0").label("inserted")
+    ))
+    returned = result.all()
+    inserted = [row for row in returned if row.inserted]
+    for path, count in Counter(row.image for row in inserted if row.image).items():
+        await acquire(db, path, count)
+    stock = {row["name"]: row["stock"] for row in rows}
+    await record_movements(db, "receipt", {row.id: stock[row.name] for row in inserted}, "import")
+    await adjust_to(db, {row.id: stock[row.name] for row in returned if not row.inserted}, "import")
+    await bump_version(db)
+    await db.commit()
+    return len(inserted), len(returned) - len(inserted)
+
+
+async def import_medicaments(db: AsyncSession, chunks: AsyncIterator[bytes], file_format: str) -> ImportReport:
+    """
+    Validate and upsert (on name) medicaments from a CSV or NDJSON stream,
+    one transaction per batch. Bad rows are reported, not fatal.
+    """
+    from_csv = file_format == "csv"
+    lines = iter_lines(chunks)
+    records = iter_csv_records(lines) if from_csv else iter_ndjson_records(lines)
+    report = ImportReport()
+
+    async def flush(batch):
+        rows, rejected = await asyncio.to_thread(_validate_batch, batch, from_csv)
+        for number, name, messages in rejected:
+            report.add_error(number, name, messages)
+        if rows:
+            inserted, updated = await _upsert_batch(db, rows)
+            report.inserted += inserted
+            report.updated += updated
+
+    try:
+        batch = []
+        async for record in records:
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+    finally:
+        catalog_cache.forget()
+    return report
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str]) -> Optional[str]:
+    if requested:
+        return requested
+    return FORMATS.get((content_type or "").split(";")[0].strip().lower())
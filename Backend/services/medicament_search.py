@@ -0,0 +1,229 @@
+import asyncio
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.medicaments import Medicament
+from services.catalog_cache import catalog_cache
+from services.inventory import current_stock
+
+TOKEN = re.compile(r"[a-z0-9]+")
+# Share of the query's trigrams a candidate must contain to count as a fuzzy match
+MIN_TRIGRAM_OVERLAP = 0.4
+
+COLUMNS = (
+    Medicament.id, Medicament.name, Medicament.description, Medicament.price, Medicament.image,
+    Medicament.dosage, Medicament.duration, Medicament.stock, Medicament.legal,
+)
+
+
+def normalize(text: Optional[str]) -> str:
+    """
+    "Paracétamol 500mg" -> "paracetamol 500mg"
+    """
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN.findall(normalize(text))
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # every medicament with a token going through this node
+        self.ids: Set[int] = set()
+
+
+class PrefixTrie:
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, token: str, item_id: int):
+        node = self.root
+        for char in token:
+            node = node.children.setdefault(char, _TrieNode())
+            node.ids.add(item_id)
+
+    def lookup(self, prefix: str) -> Set[int]:
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+
+@dataclass
+class MedicamentIndex:
+    """
+    In-memory search index over the catalog: a prefix trie for
+    autocomplete on name and description tokens, and a trigram index
+    for typo-tolerant matches.
+    """
+
+    rows: Dict[int, dict] = field(default_factory=dict)
+    name_trie: PrefixTrie = field(default_factory=PrefixTrie)
+    description_trie: PrefixTrie = field(default_factory=PrefixTrie)
+    # trigram -> tokens containing it, token -> medicaments using it (in name / in description)
+    trigram_tokens: Dict[str, Set[str]] = field(default_factory=lambda: defaultdict(set))
+    name_tokens: Dict[str, Set[int]] = field(default_factory=lambda: defaultdict(set))
+    description_tokens: Dict[str, Set[int]] = field(default_factory=lambda: defaultdict(set))
+    # catalog version the rows were read at, and stock mark of their stock figures
+    version: int = -1
+    stock_mark: int = -1
+
+    @classmethod
+    def build(cls, rows: List[dict]) -> "MedicamentIndex":
+        index = cls()
+        for row in rows:
+            item_id = row["id"]
+            index.rows[item_id] = row
+            for token in set(tokenize(row["name"])):
+                index.name_trie.add(token, item_id)
+                index.name_tokens[token].add(item_id)
+            for token in set(tokenize(row["description"])):
+                index.description_trie.add(token, item_id)
+                index.description_tokens[token].add(item_id)
+        for token in set(index.name_tokens) | set(index.description_tokens):
+            for gram in trigrams(token):
+                index.trigram_tokens[gram].add(token)
+        return index
+
+    def restock(self, levels: Dict[int, int], stock_mark: int):
+        """
+        New stock figures for an unchanged catalog: the tokens stay as they are.
+        """
+        for item_id, row in self.rows.items():
+            row["stock"] = levels.get(item_id, row["stock"])
+        self.stock_mark = stock_mark
+
+    def _fuzzy_tokens(self, term: str) -> Dict[str, float]:
+        """
+        Indexed tokens sharing enough trigrams with `term`, with their similarity.
+        """
+        wanted = trigrams(term)
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in wanted:
+            for token in self.trigram_tokens.get(gram, ()):
+                shared[token] += 1
+        matches = {}
+        for token, count in shared.items():
+            if count / len(wanted) >= MIN_TRIGRAM_OVERLAP:
+                matches[token] = count / len(wanted | trigrams(token))
+        return matches
+
+    def _score(self, terms: List[str], query: str) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            term_scores: Dict[int, float] = {}
+
+            def bump(ids, score):
+                for item_id in ids:
+                    if score > term_scores.get(item_id, 0):
+                        term_scores[item_id] = score
+
+            bump(self.name_trie.lookup(term), 3.0)
+            bump(self.name_tokens.get(term, ()), 4.0)
+            bump(self.description_trie.lookup(term), 1.0)
+            if len(term) >= 3:
+                for token, similarity in self._fuzzy_tokens(term).items():
+                    bump(self.name_tokens.get(token, ()), 2.5 * similarity)
+                    bump(self.description_tokens.get(token, ()), 0.8 * similarity)
+            if not term_scores:
+                # every term has to match something
+                return {}
+            if scores:
+                scores = {item_id: scores[item_id] + s for item_id, s in term_scores.items() if item_id in scores}
+            else:
+                scores = dict(term_scores)
+            if not scores:
+                return {}
+
+        for item_id in scores:
+            name = normalize(self.rows[item_id]["name"])
+            if name == query:
+                scores[item_id] += 10
+            elif name.startswith(query):
+                scores[item_id] += 5
+        return scores
+
+    def search(
+        self,
+        q: str,
+        legal: Optional[bool] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[int, List[dict]]:
+        """
+        Return (total matches, one page of rows), best matches first.
+        An empty query lists the filtered catalog by name.
+        """
+        terms = tokenize(q)
+        if terms:
+            scores = self._score(terms, " ".join(terms))
+        else:
+            scores = dict.fromkeys(self.rows, 0.0)
+
+        def keep(row):
+            if legal is not None and row["legal"] != legal:
+                return False
+            if in_stock is not None and (row["stock"] > 0) != in_stock:
+                return False
+            price = row["price"]
+            if min_price is not None and (price is None or price < min_price):
+                return False
+            if max_price is not None and (price is None or price > max_price):
+                return False
+            return True
+
+        matches = [(score, self.rows[item_id]) for item_id, score in scores.items() if keep(self.rows[item_id])]
+        matches.sort(key=lambda match: (-match[0], match[1]["name"].lower(), match[1]["id"]))
+        return len(matches), [row for _, row in matches[offset:offset + limit]]
+
+
+_index: Optional[MedicamentIndex] = None
+_lock = asyncio.Lock()
+
+
+async def get_index(db: AsyncSession) -> MedicamentIndex:
+    """
+    The index for the current catalog version, rebuilt off the event loop when
+    the version moved; when only the stock mark moved, just the stock figures are re-read.
+    """
+    global _index
+    version, stock_mark = await catalog_cache.current_stamp(db)
+    if _index is not None and (_index.version, _index.stock_mark) == (version, stock_mark):
+        return _index
+    async with _lock:
+        if _index is not None and _index.version == version and _index.stock_mark != stock_mark:
+            _index.restock(await current_stock(db), stock_mark)
+        if _index is None or _index.version != version:
+            result = await db.execute(select(*COLUMNS))
+            rows = [dict(row._mapping) for row in result]
+            levels = await current_stock(db)
+            for row in rows:
+                row["stock"] = levels.get(row["id"], row["stock"])
+            index = await asyncio.to_thread(MedicamentIndex.build, rows)
+            index.version = version
+            index.stock_mark = stock_mark
+            _index = index
+        return _index
@@ -0,0 +1,152 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models.billing import Billing
+from models.Carts import Cart
+from models.payment_events import PaymentEvent
+from services.catalog_cache import catalog_cache
+from services.checkout import settle_cart
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Unexpected failures are retried on later runs, then parked with their error
+MAX_ATTEMPTS = 5
+SUCCEEDED = "payment_intent.succeeded"
+CURRENCY = "usd"
+
+
+async def record_event(db: AsyncSession, event: dict) -> bool:
+    """
+    Store a verified webhook event in the inbox. Returns False when the
+    provider redelivered an event id we already have.
+    """
+    result = await db.execute(
+        pg_insert(PaymentEvent)
+        .values(
+            id=event["id"],
+            type=event["type"],
+            payload=json.dumps(event),
+            received_at=datetime.utcnow(),
+            attempts=0,
+        )
+        .on_conflict_do_nothing(index_elements=[PaymentEvent.id])
+        .returning(PaymentEvent.id)
+    )
+    stored = result.scalar_one_or_none() is not None
+    await db.commit()
+    return stored
+
+
+async def _settle_payment(db: AsyncSession, intent: dict) -> Optional[str]:
+    """
+    Settle the cart a succeeded PaymentIntent was created for and record its
+    billing. Returns a note when there was nothing to do; a payment in another
+    currency or short of the cart total is refused with 402 and parked.
+    """
+    cart_id = (intent.get("metadata") or {}).get("cart_id")
+    if not cart_id:
+        return "no cart attached to the payment"
+    cart = await db.get(Cart, int(cart_id))
+    if cart is None:
+        return f"cart {cart_id} not found"
+    if cart.is_paid:
+        # Settled through /billing/add or an earlier delivery
+        return f"cart {cart_id} already paid"
+    # The client picks the intent amount, so only what was actually received counts
+    received = intent.get("amount_received", intent.get("amount", 0))
+    currency = intent.get("currency") or CURRENCY
+    due = round(cart.total_price * 100)
+    if currency.lower() != CURRENCY or received < due:
+        raise HTTPException(
+            status_code=402,
+            detail=f"Payment of {received} {currency} does not cover cart {cart_id} ({due} {CURRENCY})",
+        )
+    payment_method = (intent.get("payment_method_types") or ["card"])[0]
+    paid_at = datetime.utcfromtimestamp(intent["created"]) if intent.get("created") else datetime.utcnow()
+    await settle_cart(db, cart, payment_method, paid_at.date())
+    db.add(Billing(
+        order_id=intent["id"],
+        cart_id=cart.id,
+        amount=received / 100,
+        payment_method=payment_method,
+        date=paid_at,
+    ))
+    return None
+
+
+HANDLERS = {SUCCEEDED: _settle_payment}
+
+
+async def _apply(event_id: str) -> bool:
+    """
+    Apply one inbox event in its own transaction. The row lock (SKIP LOCKED)
+    keeps two workers from applying the same event.
+    """
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(PaymentEvent)
+            .where(PaymentEvent.id == event_id, PaymentEvent.processed_at.is_(None))
+            .with_for_update(skip_locked=True)
+        )).scalar_one_or_none()
+        if row is None:
+            return False
+        handler = HANDLERS.get(row.type)
+        note = None
+        try:
+            if handler is not None:
+                note = await handler(db, json.loads(row.payload)["data"]["object"])
+        except HTTPException as e:
+            # Business refusal (e.g. stock ran out): retrying won't help, park it for a human
+            await db.rollback()
+            note = f"{e.status_code}: {e.detail}"
+            logger.warning(f"Payment event {event_id} not applied: {note}")
+        except Exception as e:
+            await db.rollback()
+            await _record_failure(event_id, str(e))
+            return False
+        row = await db.get(PaymentEvent, event_id, with_for_update=True)
+        row.processed_at = datetime.utcnow()
+        row.attempts += 1
+        row.error = note
+        await db.commit()
+        return True
+
+
+async def _record_failure(event_id: str, error: str):
+    async with AsyncSessionLocal() as db:
+        row = await db.get(PaymentEvent, event_id)
+        row.attempts += 1
+        row.error = error
+        if row.attempts >= MAX_ATTEMPTS:
+            row.processed_at = datetime.utcnow()
+            logger.error(f"Payment event {event_id} given up after {row.attempts} attempts: {error}")
+        await db.commit()
+
+
+async def process_pending(db: AsyncSession, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """
+    Apply up to `batch_size` unprocessed inbox events, oldest first.
+    Meant for start_periodic; each event commits on its own so one bad
+    event never holds back the rest of the batch.
+    """
+    event_ids: List[str] = list((await db.execute(
+        select(PaymentEvent.id)
+        .where(PaymentEvent.processed_at.is_(None))
+        .order_by(PaymentEvent.received_at)
+        .limit(batch_size)
+    )).scalars().all())
+    applied = 0
+    for event_id in event_ids:
+        applied += await _apply(event_id)
+    if applied:
+        catalog_cache.forget_stock()
+    return {"applied": applied, "pending": len(event_ids) - applied} if event_ids else {}
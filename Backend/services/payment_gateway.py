@@ -0,0 +1,263 @@
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import stripe
+from fastapi import HTTPException
+
+CALL_TIMEOUT = float(os.getenv("PAYMENT_CALL_TIMEOUT", "10"))
+MAX_CONCURRENT_CALLS = int(os.getenv("PAYMENT_MAX_CONCURRENT_CALLS", "8"))
+MAX_NETWORK_RETRIES = 2
+# Reject webhook deliveries signed more than this many seconds ago (replays)
+WEBHOOK_TOLERANCE = 300
+
+
+@dataclass
+class PaymentIntent:
+    id: str
+    client_secret: str
+    amount: int
+    currency: str
+    status: str
+    created: int
+    metadata: Dict[str, str]
+
+
+class PaymentGateway(ABC):
+    """
+    What the payment routes need from a payment provider. All calls are
+    async and never block the event loop.
+    """
+
+    webhook_secret: Optional[str] = None
+
+    def parse_webhook(self, payload: bytes, signature: Optional[str]) -> dict:
+        """
+        Verify a webhook delivery's Stripe-Signature header against the raw
+        body and return the decoded event. Pure HMAC, no network call.
+        """
+        if not self.webhook_secret:
+            raise HTTPException(status_code=500, detail="Webhook secret is not configured")
+        try:
+            stripe.WebhookSignature.verify_header(payload, signature, self.webhook_secret, WEBHOOK_TOLERANCE)
+            event = json.loads(payload)
+        except (stripe.error.SignatureVerificationError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid webhook signature")
+        if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+            raise HTTPException(status_code=400, detail="Malformed webhook event")
+        return event
+
+    @abstractmethod
+    async def create_payment_intent(
+        self, amount: int, currency: str = "usd", idempotency_key: Optional[str] = None, metadata: Optional[Dict[str, str]] = None
+    ) -> PaymentIntent:
+        ...
+
+    @abstractmethod
+    async def retrieve_payment_intent(self, intent_id: str) -> PaymentIntent:
+        ...
+
+    @abstractmethod
+    async def list_payment_intents(
+        self, created_from: datetime, created_to: datetime, starting_after: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[PaymentIntent], bool]:
+        """
+        One page of intents created in [created_from, created_to) (naive UTC),
+        newest first, and whether more pages follow `starting_after`.
+        An unknown `starting_after` is a 400.
+        """
+
+
+def _from_stripe(intent) -> PaymentIntent:
+    return PaymentIntent(
+        id=getattr(intent, "id", None),
+        client_secret=intent.client_secret,
+        amount=getattr(intent, "amount", None),
+        currency=getattr(intent, "currency", None),
+        status=getattr(intent, "status", None),
+        created=getattr(intent, "created", None),
+        metadata=dict(getattr(intent, "metadata", None) or {}),
+    )
+
+
+def _timestamp(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+class StripeGateway(PaymentGateway):
+    """
+    The blocking Stripe SDK run on a small dedicated thread pool, over a
+    pooled keep-alive HTTP client. Network errors are retried by the SDK
+    (safe: the SDK sends an idempotency key with every POST); each attempt
+    is bounded by `timeout`.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        webhook_secret: Optional[str] = None,
+        timeout: float = CALL_TIMEOUT,
+        max_workers: int = MAX_CONCURRENT_CALLS,
+    ):
+        if api_key:
+            stripe.api_key = api_key
+        self.webhook_secret = webhook_secret
+        stripe.max_network_retries = MAX_NETWORK_RETRIES
+        stripe.default_http_client = stripe.RequestsClient(timeout=timeout)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stripe")
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs)),
+                timeout=self.timeout * (MAX_NETWORK_RETRIES + 1),
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Payment provider timed out")
+        except stripe.error.CardError as e:
+            raise HTTPException(status_code=402, detail=e.user_message or str(e))
+        except stripe.error.InvalidRequestError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except stripe.error.StripeError as e:
+            raise HTTPException(status_code=502, detail=f"Payment provider error: {e}")
+
+    async def create_payment_intent(self, amount, currency="usd", idempotency_key=None, metadata=None):
+        options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+        if metadata:
+            options["metadata"] = metadata
+        intent = await self._call(
+            stripe.PaymentIntent.create,
+            amount=amount,
+            currency=currency,
+            payment_method_types=["card"],
+            **options,
+        )
+        return _from_stripe(intent)
+
+    async def retrieve_payment_intent(self, intent_id):
+        return _from_stripe(await self._call(stripe.PaymentIntent.retrieve, intent_id))
+
+    async def list_payment_intents(self, created_from, created_to, starting_after=None, limit=100):
+        options = {"starting_after": starting_after} if starting_after else {}
+        page = await self._call(
+            stripe.PaymentIntent.list,
+            created={"gte": _timestamp(created_from), "lt": _timestamp(created_to)},
+            limit=limit,
+            **options,
+        )
+        return [_from_stripe(intent) for intent in page.data], bool(page.has_more)
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-memory gateway for offline runs and tests (PAYMENT_GATEWAY=fake).
+    `latency` (seconds) simulates the provider round-trip.
+    """
+
+    def __init__(self, latency: float = float(os.getenv("PAYMENT_FAKE_LATENCY_MS", "0")) / 1000, webhook_secret: str = "whsec_fake"):
+        self.latency = latency
+        self.webhook_secret = webhook_secret
+        self.intents: Dict[str, PaymentIntent] = {}
+        self._by_idempotency_key: Dict[str, str] = {}
+        self._ids = itertools.count(1)
+
+    async def create_payment_intent(self, amount, currency="usd", idempotency_key=None, metadata=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if idempotency_key in self._by_idempotency_key:
+            return self.intents[self._by_idempotency_key[idempotency_key]]
+        intent_id = f"pi_fake_{next(self._ids):08d}"
+        intent = PaymentIntent(
+            id=intent_id,
+            client_secret=f"{intent_id}_secret_{secrets.token_hex(8)}",
+            amount=amount,
+            currency=currency,
+            status="requires_payment_method",
+            created=int(time.time()),
+            metadata=dict(metadata or {}),
+        )
+        self.intents[intent_id] = intent
+        if idempotency_key:
+            self._by_idempotency_key[idempotency_key] = intent_id
+        return intent
+
+    def sign(self, payload: bytes, timestamp: Optional[int] = None) -> str:
+        """
+        Stripe-Signature header for `payload`, to replay webhooks locally.
+        """
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        signature = stripe.WebhookSignature._compute_signature(f"{timestamp}.{payload.decode()}", self.webhook_secret)
+        return f"t={timestamp},v1={signature}"
+
+    async def retrieve_payment_intent(self, intent_id):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if intent_id not in self.intents:
+            raise HTTPException(status_code=400, detail=f"No such payment_intent: {intent_id}")
+        return self.intents[intent_id]
+
+    async def list_payment_intents(self, created_from, created_to, starting_after=None, limit=100):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        window = sorted(
+            (intent for intent in self.intents.values()
+             if _timestamp(created_from) <= intent.created < _timestamp(created_to)),
+            key=lambda intent: (intent.created, intent.id),
+            reverse=True,
+        )
+        start = 0
+        if starting_after is not None:
+            position = next((i for i, intent in enumerate(window) if intent.id == starting_after), None)
+            if position is None:
+                raise HTTPException(status_code=400, detail=f"No such payment_intent: {starting_after}")
+            start = position + 1
+        return window[start:start + limit], start + limit < len(window)
+
+    def confirm(self, intent_id: str, status: str = "succeeded") -> dict:
+        """
+        Settle a fake intent and return the webhook event Stripe would send.
+        """
+        intent = self.intents[intent_id]
+        intent.status = status
+        event_type = "payment_intent.succeeded" if status == "succeeded" else "payment_intent.payment_failed"
+        return {
+            "id": f"evt_{intent_id}_{status}",
+            "type": event_type,
+            "data": {"object": {
+                "id": intent.id, "amount": intent.amount, "amount_received": intent.amount if status == "succeeded" else 0,
+                "currency": intent.currency, "status": status, "created": intent.created,
+                "payment_method_types": ["card"], "metadata": intent.metadata,
+            }},
+        }
+
+
+_gateway: Optional[PaymentGateway] = None
+
+
+def get_gateway() -> PaymentGateway:
+    """
+    PAYMENT_GATEWAY=stripe (default) | fake
+    Stripe reads its key from `stripe.api_key` and STRIPE_WEBHOOK_SECRET.
+    """
+    global _gateway
+    if _gateway is None:
+        if os.getenv("PAYMENT_GATEWAY", "stripe") == "fake":
+            _gateway = FakeGateway()
+        else:
+            _gateway = StripeGateway(api_key=os.getenv("stripe.api_key"), webhook_secret=os.getenv("STRIPE_WEBHOOK_SECRET"))
+    return _gateway
+
+
+def set_gateway(gateway: PaymentGateway):
+    global _gateway
+    _gateway = gateway
@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import json
+import os
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+HEADER_COLOR = "0.102 0.302 0.698"  # #1a4db2, as in the printed page
+CACHE_SIZE = 128
+
+# Helvetica advance widths (1/1000 em) for ASCII 32..126, from the standard AFM
+_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_rendering: Dict[str, asyncio.Future] = {}
+
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    units = sum(_WIDTHS[ord(c) - 32] if 32 <= ord(c) <= 126 else 556 for c in text)
+    # Helvetica-Bold runs about 5% wider
+    return units * size / 1000 * (1.05 if bold else 1.0)
+
+
+def wrap(text: str, width: float, size: float, bold: bool = False) -> List[str]:
+    lines = []
+    for paragraph in (text or "").splitlines() or [""]:
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if text_width(candidate, size, bold) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # A single word wider than the column is cut
+            while text_width(word, size, bold) > width and len(word) > 1:
+                cut = max(1, int(len(word) * width / text_width(word, size, bold)))
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def _pdf_string(text: str) -> str:
+    # WinAnsiEncoding is cp1252: one byte per character once encoded. Anything
+    # outside it (Arabic names in particular) prints as "?", see render_pdf
+    raw = text.encode("cp1252", "replace").decode("latin-1")
+    return "(" + raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+class _Layout:
+    """
+    Top-down text layout over as many A4 pages as needed.
+    """
+
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def ensure(self, height: float):
+        if self.y - height < MARGIN + 20:
+            self.new_page()
+
+    def text(self, x: float, y: float, text: str, size: float = 11, bold: bool = False, color: str = "0 0 0"):
+        font = "F2" if bold else "F1"
+        self.pages[-1].append(f"BT {color} rg /{font} {size} Tf {x:.2f} {y:.2f} Td {_pdf_string(text)} Tj ET")
+
+    def line(self, text: str, size: float = 11, bold: bool = False, x: float = MARGIN, gap: float = 4):
+        self.ensure(size + gap)
+        self.y -= size
+        self.text(x, self.y, text, size, bold)
+        self.y -= gap
+
+    def paragraph(self, text: str, size: float = 11, x: float = MARGIN, width: float = PAGE_WIDTH - 2 * MARGIN):
+        for line in wrap(text, width, size):
+            self.line(line, size, x=x)
+
+    def rule(self):
+        self.ensure(10)
+        self.y -= 5
+        self.pages[-1].append(f"0.8 0.8 0.8 RG 0.5 w {MARGIN} {self.y:.2f} m {PAGE_WIDTH - MARGIN} {self.y:.2f} l S")
+        self.y -= 5
+
+    def band(self, height: float, title: str):
+        self.pages[-1].append(f"{HEADER_COLOR} rg 0 {PAGE_HEIGHT - height} {PAGE_WIDTH} {height} re f")
+        self.text(MARGIN, PAGE_HEIGHT - height / 2 - 7, title, 20, True, "1 1 1")
+        self.y = PAGE_HEIGHT - height - 25
+
+
+def _layout(document: dict) -> List[List[str]]:
+    layout = _Layout()
+    layout.band(80, "MEDICAL PRESCRIPTION")
+
+    doctor = document["doctor"]
+    top = layout.y
+    layout.line(f"Dr. {doctor['name']}".strip(), 13, True)
+    for detail in (doctor.get("grade"), doctor.get("adresse"), doctor.get("ville")):
+        if detail:
+            layout.line(detail, 10)
+    left_bottom = layout.y
+    layout.y = top
+    right = PAGE_WIDTH / 2 + 60
+    layout.line("Date", 9, True, x=right)
+    layout.line(document["date"], 11, x=right)
+    if document.get("patient"):
+        layout.line("Patient", 9, True, x=right)
+        layout.line(document["patient"], 11, x=right)
+    layout.y = min(layout.y, left_bottom)
+    layout.rule()
+
+    layout.line("PRESCRIPTION", 14, True, gap=8)
+    layout.paragraph(document["content"])
+
+    medications = document.get("medications") or []
+    if medications:
+        layout.y -= 10
+        layout.line("Prescribed Medications", 13, True, gap=8)
+        columns = ((MARGIN, "Name", 210), (MARGIN + 220, "Dosage", 130), (MARGIN + 360, "Duration", 135))
+        layout.ensure(16)
+        layout.y -= 10
+        for x, title, _ in columns:
+            layout.text(x, layout.y, title, 10, True)
+        layout.y -= 4
+        layout.rule()
+        for medication in medications:
+            cells = [wrap(medication.get(key) or "-", width, 10) for key, (_, _, width) in zip(("name", "dosage", "duration"), columns)]
+            rows = max(len(cell) for cell in cells)
+            layout.ensure(rows * 13 + 4)
+            for (x, _, _), cell in zip(columns, cells):
+                for i, text in enumerate(cell):
+                    layout.text(x, layout.y - 10 - i * 13, text, 10)
+            layout.y -= rows * 13 + 4
+    return layout.pages
+
+
+def render_pdf(document: dict) -> bytes:
+    """
+    Lay out and serialize a prescription as a PDF (Helvetica, A4), with no
+    dependency beyond zlib. Deterministic: the same document always gives
+    the same bytes. CPU bound, meant to run in the process pool.
+
+    Limitation: the standard Helvetica fonts only cover cp1252 (Latin
+    scripts, French accents included). Other characters, such as Arabic
+    patient or doctor names, are replaced with "?". Printing them needs an
+    embedded Unicode font plus Arabic shaping and right-to-left layout,
+    which this writer doesn't do.
+    """
+    pages = _layout(document)
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for number, operations in enumerate(pages, start=1):
+        footer = f"Page {number} of {len(pages)}"
+        operations = operations + [
+            f"BT 0.5 0.5 0.5 rg /F1 8 Tf {PAGE_WIDTH - MARGIN - text_width(footer, 8):.2f} 30 Td {_pdf_string(footer)} Tj ET"
+        ]
+        stream = zlib.compress("\n".join(operations).encode("latin-1"))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def document_hash(document: dict) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, min(4, (os.cpu_count() or 2) // 2)))
+    return _pool
+
+
+def shutdown_pool():
+    """
+    Stop the render workers (app shutdown). Queued renders are cancelled;
+    the next render starts a new pool.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def prescription_pdf(document: dict, etag: Optional[str] = None) -> bytes:
+    """
+    The PDF for `document`, from the cache when this content was rendered
+    before. Concurrent requests for the same content share one render.
+    """
+    etag = etag or document_hash(document)
+    pdf = _cache.get(etag)
+    if pdf is not None:
+        _cache.move_to_end(etag)
+        return pdf
+    if etag not in _rendering:
+        _rendering[etag] = asyncio.get_running_loop().run_in_executor(_get_pool(), render_pdf, document)
+    try:
+        pdf = await asyncio.shield(_rendering[etag])
+    finally:
+        _rendering.pop(etag, None)
+    _cache[etag] = pdf
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return pdf
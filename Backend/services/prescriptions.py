@@ -0,0 +1,180 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+
+from Dto.prescriptiondto import PrescribedMedicament, PrescriptionOut
+from models.appointments import Appointment
+from models.medecins import Medecin
+from models.medicaments import Medicament
+from models.patients import Patient
+from models.prescription import Prescription
+from models.prescription_medicament import prescription_medicament
+from models.users import User
+from services.drug_interactions import check_interactions
+
+
+def prescription_query(*criteria):
+    """
+    Prescriptions matching `criteria` with their medicament ids: one SELECT
+    for the prescriptions, one SELECT ... IN for all their medicaments.
+    """
+    return (
+        select(Prescription)
+        .where(*criteria)
+        .options(selectinload(Prescription.medicaments).load_only(Medicament.id, Medicament.name))
+    )
+
+
+def prescription_filters(
+    medecin_id: Optional[int] = None,
+    patient_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> list:
+    """
+    Criteria on the prescription's appointment. `date_to` is exclusive.
+    """
+    criteria = []
+    if medecin_id is not None:
+        criteria.append(Appointment.medecin_id == medecin_id)
+    if patient_id is not None:
+        criteria.append(Appointment.patient_id == patient_id)
+    if date_from is not None:
+        criteria.append(Appointment.date >= date_from)
+    if date_to is not None:
+        criteria.append(Appointment.date < date_to)
+    if not criteria:
+        return []
+    return [Prescription.appointment_id.in_(select(Appointment.id).where(*criteria))]
+
+
+def _out(prescription_id: int, appointment_id: int, content: str, names: Dict[int, str], interactions: List[dict] = ()) -> PrescriptionOut:
+    ids = sorted(names)
+    return PrescriptionOut(
+        id=prescription_id,
+        content=content,
+        appointment_id=appointment_id,
+        medicament_ids=ids,
+        medicaments=[PrescribedMedicament(id=medicament_id, name=names[medicament_id]) for medicament_id in ids],
+        interactions=list(interactions),
+    )
+
+
+def to_out(prescription: Prescription) -> PrescriptionOut:
+    return _out(
+        prescription.id,
+        prescription.appointment_id,
+        prescription.content,
+        {medicament.id: medicament.name for medicament in prescription.medicaments},
+    )
+
+
+async def prescription_page(
+    db: AsyncSession, criteria: list, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[PrescriptionOut], Optional[str]]:
+    """
+    One page of prescriptions, newest first, and the cursor of the next
+    page (None on the last one). Seeks on the primary key instead of OFFSET.
+    """
+    query = prescription_query(*criteria)
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(Prescription.id < int(cursor))
+    result = await db.execute(query.order_by(Prescription.id.desc()).limit(limit + 1))
+    prescriptions = list(result.scalars().all())
+    next_cursor = None
+    if len(prescriptions) > limit:
+        prescriptions = prescriptions[:limit]
+        next_cursor = str(prescriptions[-1].id)
+    return [to_out(prescription) for prescription in prescriptions], next_cursor
+
+
+async def get_by_appointment(db: AsyncSession, appointment_id: int) -> Optional[Prescription]:
+    result = await db.execute(prescription_query(Prescription.appointment_id == appointment_id))
+    return result.scalar_one_or_none()
+
+
+async def medicament_names(db: AsyncSession, ids: List[int]) -> Dict[int, str]:
+    """
+    id -> name for every id in one IN query; 400 naming the unknown ones.
+    """
+    result = await db.execute(select(Medicament.id, Medicament.name).where(Medicament.id.in_(ids)))
+    names = dict(result.all())
+    missing = [medicament_id for medicament_id in ids if medicament_id not in names]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Some medicaments not found: {', '.join(map(str, missing))}")
+    return names
+
+
+async def save_prescription(db: AsyncSession, appointment_id: int, content: str, medicament_ids: List[int]) -> PrescriptionOut:
+    """
+    Create or replace the appointment's prescription in one transaction:
+    one IN query validating the medicaments, one upsert of the prescription,
+    one DELETE and one multi-row INSERT of its medicament lines.
+    400 naming every unknown medicament id. Interactions between the
+    medicaments are returned with the saved prescription, not enforced.
+    """
+    ids = list(dict.fromkeys(medicament_ids))
+    names = await medicament_names(db, ids)
+
+    statement = pg_insert(Prescription).values(appointment_id=appointment_id, content=content)
+    result = await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Prescription.appointment_id],
+            set_={"content": statement.excluded.content},
+        ).returning(Prescription.id)
+    )
+    prescription_id = result.scalar_one()
+    await db.execute(delete(prescription_medicament).where(prescription_medicament.c.prescription_id == prescription_id))
+    await db.execute(
+        insert(prescription_medicament),
+        [{"prescription_id": prescription_id, "medicament_id": medicament_id} for medicament_id in ids],
+    )
+    await db.commit()
+    return _out(prescription_id, appointment_id, content, names, check_interactions(names))
+
+
+async def load_pdf_document(db: AsyncSession, appointment_id: int) -> Optional[dict]:
+    """
+    Everything printed on the prescription PDF, in two queries.
+    """
+    doctor, patient = aliased(User), aliased(User)
+    result = await db.execute(
+        select(
+            Prescription.id, Prescription.content, Appointment.date,
+            doctor.nom.label("doctor_nom"), doctor.prenom.label("doctor_prenom"),
+            Medecin.grade, Medecin.adresse, Medecin.ville,
+            patient.nom.label("patient_nom"), patient.prenom.label("patient_prenom"),
+        )
+        .join(Appointment, Appointment.id == Prescription.appointment_id)
+        .outerjoin(Medecin, Medecin.id == Appointment.medecin_id)
+        .outerjoin(doctor, doctor.id == Medecin.user_id)
+        .outerjoin(Patient, Patient.id == Appointment.patient_id)
+        .outerjoin(patient, patient.id == Patient.user_id)
+        .where(Prescription.appointment_id == appointment_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    medications = await db.execute(
+        select(Medicament.name, Medicament.dosage, Medicament.duration)
+        .join(prescription_medicament, prescription_medicament.c.medicament_id == Medicament.id)
+        .where(prescription_medicament.c.prescription_id == row.id)
+        .order_by(Medicament.name)
+    )
+    return {
+        "doctor": {
+            "name": " ".join(filter(None, (row.doctor_prenom, row.doctor_nom))),
+            "grade": row.grade, "adresse": row.adresse, "ville": row.ville,
+        },
+        "patient": " ".join(filter(None, (row.patient_prenom, row.patient_nom))),
+        "date": row.date.strftime("%d/%m/%Y"),
+        "content": row.content,
+        "medications": [dict(medication._mapping) for medication in medications],
+    }
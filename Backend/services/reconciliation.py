@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, and_, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.billing import Billing
+from models.Carts import Cart
+from services.catalog_cache import catalog_cache
+from services.checkout import settle_cart, unsettle_cart
+from services.payment_gateway import PaymentGateway, get_gateway
+
+PAGE_SIZE = 100
+STREAM_BATCH = 1000
+# Mismatches kept in the report; the counts cover all of them
+MAX_DETAILS = 1000
+STRIPE_PREFIX = "pi_"
+# Intents that will never be paid without a new attempt by the patient
+FAILED_STATUSES = ("canceled", "requires_payment_method")
+
+# Per-run staging of the provider's intents, so both sides can be read back sorted
+_staged = Table(
+    "reconciliation_intents",
+    MetaData(),
+    Column("id", String(255), primary_key=True),
+    Column("status", String(50)),
+    Column("amount", Integer),
+    Column("created", DateTime),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+@dataclass
+class ReconciliationReport:
+    intents: int = 0
+    billings: int = 0
+    matched: int = 0
+    mismatches: Dict[str, int] = field(default_factory=dict)
+    repaired: int = 0
+    details: List[dict] = field(default_factory=list)
+
+    def add(self, kind: str, **detail):
+        self.mismatches[kind] = self.mismatches.get(kind, 0) + 1
+        if len(self.details) < MAX_DETAILS:
+            self.details.append({"kind": kind, **detail})
+
+
+async def _stage_intents(db: AsyncSession, gateway: PaymentGateway, start: datetime, end: datetime) -> int:
+    staged = 0
+    cursor = None
+    while True:
+        page, has_more = await gateway.list_payment_intents(start, end, starting_after=cursor, limit=PAGE_SIZE)
+        if page:
+            await db.execute(insert(_staged), [
+                {"id": intent.id, "status": intent.status, "amount": intent.amount,
+                 "created": datetime.utcfromtimestamp(intent.created)}
+                for intent in page
+            ])
+            staged += len(page)
+            cursor = page[-1].id
+        if not has_more or not page:
+            return staged
+
+
+async def _stream(db: AsyncSession, query) -> AsyncIterator:
+    result = await db.stream(query.execution_options(yield_per=STREAM_BATCH))
+    async for row in result:
+        yield row
+
+
+def _byte_order(db: AsyncSession, column):
+    """
+    Sort `column` the way Python compares str. Postgres follows the database
+    locale unless told otherwise (pi_3Pa... after pi_3PB... in en_US); SQLite
+    always compares bytes.
+    """
+    return column.collate("C") if db.bind.dialect.name == "postgresql" else column
+
+
+async def _next(rows: AsyncIterator):
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def reconcile(
+    db: AsyncSession, start: datetime, end: datetime, repair: bool = False, gateway: Optional[PaymentGateway] = None
+) -> ReconciliationReport:
+    """
+    Compare the intents created in [start, end) with the billings that
+    reference them or are dated in the window.
+
+    Intents are paged from the gateway into a temporary table, then both
+    sides are read back ordered by order id through server-side cursors
+    and merge-joined, so memory stays flat over a month of payments (only
+    the carts to repair are kept). Both sides sort by byte order (collation
+    "C"), the order the join compares ids in, whatever the database locale.
+
+    With `repair`, carts whose intent succeeded are settled and carts whose
+    intent failed are unsettled, each in its own transaction through
+    checkout, so stock and sales rollups follow the paid flag. Refusals
+    (e.g. stock ran out) are reported; amounts and missing billings are
+    only reported.
+    """
+    gateway = gateway or get_gateway()
+    report = ReconciliationReport()
+    repairs: Dict[int, _Repair] = {}
+    async with db.begin():
+        await db.run_sync(lambda session: _staged.create(session.connection()))
+        report.intents = await _stage_intents(db, gateway, start, end)
+
+        intents = _stream(
+            db, select(_staged.c.id, _staged.c.status, _staged.c.amount).order_by(_byte_order(db, _staged.c.id))
+        )
+        billings = _stream(
+            db,
+            select(
+                Billing.id, Billing.order_id, Billing.amount, Billing.cart_id, Billing.payment_method, Billing.date,
+                Cart.is_paid,
+            )
+            .outerjoin(Cart, Cart.id == Billing.cart_id)
+            .where(
+                Billing.order_id.like(f"{STRIPE_PREFIX}%"),
+                or_(and_(Billing.date >= start, Billing.date < end), Billing.order_id.in_(select(_staged.c.id))),
+            )
+            .order_by(_byte_order(db, Billing.order_id), Billing.id),
+        )
+
+        intent, billing = await _next(intents), await _next(billings)
+        intent_billed = False
+        while intent is not None or billing is not None:
+            if billing is None or (intent is not None and intent.id < billing.order_id):
+                if intent.status == "succeeded" and not intent_billed:
+                    report.add("unbilled_payment", intent_id=intent.id, amount=intent.amount / 100)
+                intent, intent_billed = await _next(intents), False
+                continue
+            report.billings += 1
+            if intent is not None and intent.id == billing.order_id:
+                if intent_billed:
+                    report.add("duplicate_billing", billing_id=billing.id, order_id=billing.order_id)
+                else:
+                    _check(report, billing, intent, repairs)
+                intent_billed = True
+            else:
+                # Intent created outside the window, or unknown to the provider
+                _check(report, billing, await _lookup(gateway, billing.order_id), repairs)
+            billing = await _next(billings)
+
+    if repair:
+        for cart_id, fix in repairs.items():
+            report.repaired += await _repair(db, cart_id, fix, report)
+        if report.repaired:
+            catalog_cache.forget_stock()
+    return report
+
+
+class _Intent(NamedTuple):
+    id: str
+    status: str
+    amount: int
+
+
+class _Repair(NamedTuple):
+    is_paid: bool
+    payment_method: Optional[str] = None
+    day: Optional[date] = None
+
+
+async def _lookup(gateway: PaymentGateway, intent_id: str) -> Optional[_Intent]:
+    try:
+        intent = await gateway.retrieve_payment_intent(intent_id)
+    except HTTPException as e:
+        if e.status_code != 400:
+            raise
+        return None
+    return _Intent(intent.id, intent.status, intent.amount)
+
+
+def _check(report: ReconciliationReport, billing, intent: Optional[_Intent], repairs: Dict[int, _Repair]):
+    if intent is None:
+        report.add("unknown_intent", billing_id=billing.id, order_id=billing.order_id)
+        return
+    if intent.status in FAILED_STATUSES:
+        report.add("billing_without_payment", billing_id=billing.id, order_id=billing.order_id, status=intent.status)
+        if billing.cart_id is not None and billing.is_paid:
+            repairs[billing.cart_id] = _Repair(False)
+        return
+    if intent.status != "succeeded":
+        report.add("payment_pending", billing_id=billing.id, order_id=billing.order_id, status=intent.status)
+        return
+    matched = True
+    if round(billing.amount * 100) != intent.amount:
+        report.add("amount_mismatch", billing_id=billing.id, order_id=billing.order_id,
+                   billed=billing.amount, paid=intent.amount / 100)
+        matched = False
+    if billing.cart_id is not None and not billing.is_paid:
+        report.add("cart_not_marked_paid", cart_id=billing.cart_id, order_id=billing.order_id)
+        repairs[billing.cart_id] = _Repair(True, billing.payment_method, billing.date.date() if billing.date else None)
+        matched = False
+    report.matched += matched
+
+
+async def _repair(db: AsyncSession, cart_id: int, fix: _Repair, report: ReconciliationReport) -> bool:
+    cart = await db.get(Cart, cart_id)
+    if cart is None:
+        return False
+    try:
+        if fix.is_paid:
+            await settle_cart(db, cart, fix.payment_method, fix.day)
+        else:
+            await unsettle_cart(db, cart)
+    except HTTPException as e:
+        await db.rollback()
+        report.add("repair_refused", cart_id=cart_id, reason=f"{e.status_code}: {e.detail}")
+        return False
+    await db.commit()
+    return True
+
+
+def _month(value: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(value, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+async def _main(args):
+    import main  # noqa: F401  configures every mapper
+    from database import AsyncSessionLocal
+
+    start, end = _month(args.month)
+    async with AsyncSessionLocal() as db:
+        report = await reconcile(db, start, end, repair=args.repair)
+    print(f"{report.intents} payment intents, {report.billings} billings, {report.matched} matched")
+    for kind, count in sorted(report.mismatches.items()):
+        print(f"  {kind}: {count}")
+    for detail in report.details:
+        print(f"  {detail}")
+    if args.repair:
+        print(f"Repaired {report.repaired} carts")
+
+
+if __name__ == "__main__":
+    # python -m services.reconciliation --month 2024-05 [--repair]
+    parser = argparse.ArgumentParser(description="Reconcile billings with payment intents")
+    parser.add_argument("--month", default=(datetime.utcnow().replace(day=1) - timedelta(days=1)).strftime("%Y-%m"),
+                        help="YYYY-MM, defaults to last month")
+    parser.add_argument("--repair", action="store_true", help="fix carts whose paid flag contradicts the payment")
+    asyncio.run(_main(parser.parse_args()))
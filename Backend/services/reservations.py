@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.carte_items import cart_medicament
+from models.medicaments import Medicament
+from models.stock_reservations import StockReservation
+from services.inventory import current_stock, lock_stock
+
+RESERVATION_TTL = timedelta(minutes=30)
+SWEEP_BATCH_SIZE = 1000
+
+
+async def cart_lines(db: AsyncSession, cart_id: int) -> Dict[int, int]:
+    """
+    medicament_id -> quantity for every line of the cart.
+    """
+    result = await db.execute(
+        select(cart_medicament.c.medicament_id, func.sum(cart_medicament.c.quantity))
+        .where(cart_medicament.c.cart_id == cart_id)
+        .group_by(cart_medicament.c.medicament_id)
+    )
+    return {medicament_id: int(quantity) for medicament_id, quantity in result.all()}
+
+
+async def held_by_other_carts(db: AsyncSession, cart_id: int, medicament_ids: List[int]) -> Dict[int, int]:
+    """
+    medicament_id -> unexpired quantity held by carts other than `cart_id`.
+    """
+    result = await db.execute(
+        select(StockReservation.medicament_id, func.sum(StockReservation.quantity))
+        .where(
+            StockReservation.medicament_id.in_(medicament_ids),
+            StockReservation.cart_id != cart_id,
+            StockReservation.expires_at > datetime.utcnow(),
+        )
+        .group_by(StockReservation.medicament_id)
+    )
+    return {medicament_id: int(quantity) for medicament_id, quantity in result.all()}
+
+
+async def insufficient_stock(db: AsyncSession, shortages: Dict[int, int]) -> HTTPException:
+    """
+    409 naming the short medicaments, with what is still available for each.
+    """
+    result = await db.execute(select(Medicament.id, Medicament.name).where(Medicament.id.in_(list(shortages))))
+    names = dict(result.all())
+    details = [f"{names.get(medicament_id, medicament_id)} (available {max(available, 0)})" for medicament_id, available in shortages.items()]
+    return HTTPException(status_code=409, detail=f"Insufficient stock for: {', '.join(details)}")
+
+
+async def reserve_cart(db: AsyncSession, cart_id: int):
+    """
+    Make the cart's reservations match its lines and push their expiry back.
+    Raises 409 if some line can't be covered by the stock other carts don't hold.
+    Runs in the caller's transaction.
+    """
+    lines = await cart_lines(db, cart_id)
+    await db.execute(
+        delete(StockReservation).where(
+            StockReservation.cart_id == cart_id,
+            StockReservation.medicament_id.notin_(list(lines)),
+        )
+    )
+    if not lines:
+        return
+
+    ids = list(lines)
+    await lock_stock(db, ids)
+    levels = await current_stock(db, ids)
+    held = await held_by_other_carts(db, cart_id, ids)
+    available = {medicament_id: levels.get(medicament_id, 0) - held.get(medicament_id, 0) for medicament_id in ids}
+    shortages = {medicament_id: available[medicament_id] for medicament_id in ids if available[medicament_id] < lines[medicament_id]}
+    if shortages:
+        raise await insufficient_stock(db, shortages)
+
+    expires_at = datetime.utcnow() + RESERVATION_TTL
+    statement = pg_insert(StockReservation).values([
+        {"cart_id": cart_id, "medicament_id": medicament_id, "quantity": quantity, "expires_at": expires_at}
+        for medicament_id, quantity in lines.items()
+    ])
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[StockReservation.cart_id, StockReservation.medicament_id],
+            set_={"quantity": statement.excluded.quantity, "expires_at": statement.excluded.expires_at},
+        )
+    )
+
+
+async def release_cart(db: AsyncSession, cart_id: int):
+    await db.execute(delete(StockReservation).where(StockReservation.cart_id == cart_id))
+
+
+async def release_expired(db: AsyncSession) -> int:
+    """
+    Delete expired holds in batches. Expired holds already stop counting
+    against available stock, this only keeps the table small.
+    """
+    released = 0
+    while True:
+        expired = (
+            select(StockReservation.id)
+            .where(StockReservation.expires_at <= datetime.utcnow())
+            .limit(SWEEP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.execute(delete(StockReservation).where(StockReservation.id.in_(expired)))
+        await db.commit()
+        released += result.rowcount
+        if result.rowcount < SWEEP_BATCH_SIZE:
+            return released
@@ -0,0 +1,194 @@
+import asyncio
+import sys
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import Date, Numeric, cast, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.billing import Billing
+from models.Carts import Cart
+from models.carte_items import cart_medicament
+from models.medicaments import Medicament
+from models.sales_rollups import SalesRollup
+
+UNKNOWN_METHOD = "unknown"
+GRANULARITIES = ("day", "week", "month")
+GROUPINGS = ("total", "medicament", "payment_method")
+
+
+def _upsert(rows):
+    """
+    INSERT ... SELECT `rows` (day, medicament_id, payment_method, units, revenue)
+    into the rollups, adding to the rows already there.
+    """
+    statement = pg_insert(SalesRollup).from_select(
+        ["day", "medicament_id", "payment_method", "units", "revenue"], rows
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[SalesRollup.day, SalesRollup.medicament_id, SalesRollup.payment_method],
+        set_={
+            "units": SalesRollup.units + statement.excluded.units,
+            "revenue": SalesRollup.revenue + statement.excluded.revenue,
+        },
+    )
+
+
+def _sold_price():
+    # Lines sold before unit_price was stamped fall back to the current price
+    return func.coalesce(cart_medicament.c.unit_price, Medicament.price, 0.0)
+
+
+def _cart_rows(cart_id: int, day: date, payment_method: str, reverse: bool = False):
+    """
+    The cart's rollup rows at the prices stamped on its lines, negated with `reverse`.
+    """
+    units = func.sum(cart_medicament.c.quantity)
+    revenue = func.sum(cart_medicament.c.quantity * _sold_price())
+    return (
+        select(
+            literal(day, Date),
+            cart_medicament.c.medicament_id,
+            literal(payment_method),
+            -units if reverse else units,
+            -revenue if reverse else revenue,
+        )
+        .join(Medicament, Medicament.id == cart_medicament.c.medicament_id)
+        .where(cart_medicament.c.cart_id == cart_id)
+        .group_by(cart_medicament.c.medicament_id)
+    )
+
+
+def _billed():
+    """
+    cart_id -> date and payment method of its first billing, the key a sale is rolled up under.
+    """
+    return (
+        select(
+            Billing.cart_id,
+            func.min(Billing.date).label("date"),
+            func.min(Billing.payment_method).label("payment_method"),
+        )
+        .where(Billing.cart_id.is_not(None))
+        .group_by(Billing.cart_id)
+    )
+
+
+async def record_sale(db: AsyncSession, cart_id: int, payment_method: Optional[str] = None, day: Optional[date] = None):
+    """
+    Stamp the settled cart's lines with the current prices, then add them to
+    the rollups at those prices; two statements. Runs in the caller's
+    transaction, so the rollups move together with the stock.
+    """
+    await db.execute(
+        update(cart_medicament)
+        .where(cart_medicament.c.cart_id == cart_id, Medicament.id == cart_medicament.c.medicament_id)
+        .values(unit_price=Medicament.price)
+    )
+    rows = _cart_rows(cart_id, day or datetime.utcnow().date(), payment_method or UNKNOWN_METHOD)
+    await db.execute(_upsert(rows))
+
+
+async def reverse_sale(db: AsyncSession, cart_id: int, sold_at: Optional[datetime] = None):
+    """
+    Take a cart back out of the rollups (reset-payment, reconciliation),
+    under the day and payment method it was recorded with: its billing's,
+    else `sold_at` (when it was marked paid). Runs in the caller's transaction.
+    """
+    billed = (await db.execute(_billed().where(Billing.cart_id == cart_id))).first()
+    day = (billed.date if billed else None) or sold_at or datetime.utcnow()
+    payment_method = (billed.payment_method if billed else None) or UNKNOWN_METHOD
+    await db.execute(_upsert(_cart_rows(cart_id, day.date(), payment_method, reverse=True)))
+
+
+async def move_sale(db: AsyncSession, cart_id: int, payment_method: Optional[str], day: date):
+    """
+    Re-file a sold cart under another day or payment method (billing edits),
+    at the prices it was sold at. Call it before the billing changes: the
+    reversal reads the key the sale is filed under from it.
+    """
+    await reverse_sale(db, cart_id)
+    await db.execute(_upsert(_cart_rows(cart_id, day, payment_method or UNKNOWN_METHOD)))
+
+
+async def backfill(db: AsyncSession) -> int:
+    """
+    Rebuild every rollup from paid carts, dated by their billing (or by
+    their last update when they were marked paid without one), at the prices
+    stamped on their lines when they were sold, like checkout records them.
+    One transaction: readers see the old or the new rollups.
+    """
+    billed = _billed().subquery()
+    day = cast(func.coalesce(billed.c.date, Cart.updated_at, func.now()), Date)
+    method = func.coalesce(billed.c.payment_method, UNKNOWN_METHOD)
+    rows = (
+        select(
+            day,
+            cart_medicament.c.medicament_id,
+            method,
+            func.sum(cart_medicament.c.quantity),
+            func.sum(cart_medicament.c.quantity * _sold_price()),
+        )
+        .select_from(Cart)
+        .join(cart_medicament, cart_medicament.c.cart_id == Cart.id)
+        .join(Medicament, Medicament.id == cart_medicament.c.medicament_id)
+        .outerjoin(billed, billed.c.cart_id == Cart.id)
+        .where(Cart.is_paid == True)
+        .group_by(day, cart_medicament.c.medicament_id, method)
+    )
+    await db.execute(delete(SalesRollup))
+    result = await db.execute(_upsert(rows).returning(SalesRollup.day))
+    written = len(result.all())
+    await db.commit()
+    return written
+
+
+async def sales_report(
+    db: AsyncSession,
+    granularity: str = "day",
+    by: str = "total",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> List[dict]:
+    """
+    Units and revenue per period (and per medicament or payment method),
+    read from the rollups only. `date_to` is exclusive.
+    """
+    period = cast(func.date_trunc(granularity, SalesRollup.day), Date).label("period")
+    columns = [period]
+    if by == "medicament":
+        columns.append(SalesRollup.medicament_id)
+    elif by == "payment_method":
+        columns.append(SalesRollup.payment_method)
+    query = select(
+        *columns,
+        func.sum(SalesRollup.units).label("units"),
+        func.round(func.sum(SalesRollup.revenue).cast(Numeric(14, 2)), 2).label("revenue"),
+    )
+    if date_from is not None:
+        query = query.where(SalesRollup.day >= date_from)
+    if date_to is not None:
+        query = query.where(SalesRollup.day < date_to)
+    query = query.group_by(*columns).order_by(*columns)
+    result = await db.execute(query)
+    return [
+        {**row._mapping, "units": int(row.units), "revenue": float(row.revenue)}
+        for row in result
+    ]
+
+
+async def _main(command: str):
+    import main  # noqa: F401  configures every mapper
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        if command == "backfill":
+            print(f"Wrote {await backfill(db)} sales rollups")
+        else:
+            raise SystemExit("usage: python -m services.sales backfill")
+
+
+if __name__ == "__main__":
+    # python -m services.sales backfill
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else ""))
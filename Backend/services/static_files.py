@@ -0,0 +1,248 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import stat
+import sys
+from collections import OrderedDict
+from mimetypes import guess_type
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.datastructures import URL, Headers
+from starlette.responses import FileResponse, PlainTextResponse, RedirectResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from services.image_variants import VARIANT_WIDTHS, is_variant, pick_variant, variant_name
+from services.storage import StorageBackend, get_storage
+
+# Content-addressed (<sha256>) and uuid file names never change content, optionally with a _w<px> variant suffix
+IMMUTABLE_NAME = re.compile(
+    r"^([0-9a-f]{64}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(_w\d+)?\.[a-z]+$"
+)
+# The ETag of these is their whole name: the .webp and .jpg variants of one hash and width differ
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}(_w\d+)?\.[a-z]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, max-age=0, must-revalidate"
+# Used when ?w= fell back to the original because the variant is not generated yet
+SHORT_CACHE = "public, max-age=60"
+
+COMPRESSIBLE_TYPES = {
+    "image/svg+xml", "application/json", "application/javascript", "text/javascript",
+    "text/css", "text/plain", "text/html", "application/xml", "text/xml",
+}
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+ETAG_CACHE_SIZE = 4096
+PRESIGNED_TTL = 3600
+
+
+def _accepted_encodings(scope: Scope) -> set:
+    accepted = set()
+    for part in Headers(scope=scope).get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(token.lower())
+    return accepted
+
+
+def _sha256_file(full_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadStaticFiles(StaticFiles):
+    """
+    StaticFiles tuned for uploaded images.
+
+    - `?w=<pixels>` serves the smallest resized variant at least that wide
+      (WebP when accepted), falling back to the original.
+    - Pre-migration upload paths listed in `aliases` redirect to their blob.
+    - Responses carry a strong, content-derived ETag; content-addressed and
+      uuid names are cached as immutable for a year.
+    - `.br`/`.gz` siblings of compressible files are served when accepted.
+    - With a remote storage backend, uploads redirect to presigned URLs.
+    Range and If-None-Match/If-Range are handled by FileResponse/StaticFiles.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # "uploads/<uuid>.jpg" -> "uploads/<hash>.jpg", filled at startup
+        self.aliases: Dict[str, str] = {}
+        self._etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._remote_keys: "OrderedDict[str, bool]" = OrderedDict()
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        relative = path.replace(os.sep, "/")
+        alias = self.aliases.get(relative)
+        if alias is not None:
+            url = URL(scope=scope)
+            if url.path.endswith(relative):
+                return RedirectResponse(url.replace(path=url.path[: -len(relative)] + alias), status_code=308)
+
+        storage = get_storage()
+        if not storage.is_local and relative.startswith("uploads/"):
+            return await self._remote_response(storage, relative, scope)
+
+        vary = []
+        cache_control = None
+        width = self._requested_width(scope)
+        if width is not None and not is_variant(path):
+            vary.append("Accept")
+            accept_webp = "image/webp" in Headers(scope=scope).get("accept", "")
+            full_path = os.path.join(self.directory, path)
+            variant = await asyncio.to_thread(pick_variant, full_path, width, accept_webp)
+            if variant is not None:
+                path = os.path.relpath(variant, self.directory)
+            else:
+                cache_control = SHORT_CACHE
+
+        if scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        try:
+            full_path, stat_result = await asyncio.to_thread(self.lookup_path, path)
+        except (OSError, ValueError):
+            # Let StaticFiles map the error to the right status code
+            return await super().get_response(path, scope)
+        if not (stat_result and stat.S_ISREG(stat_result.st_mode)):
+            return await super().get_response(path, scope)
+
+        name = os.path.basename(full_path)
+        if cache_control is None:
+            cache_control = IMMUTABLE_CACHE if IMMUTABLE_NAME.match(name) else REVALIDATE_CACHE
+        etag = await self._etag(full_path, stat_result)
+        media_type = guess_type(full_path)[0] or "application/octet-stream"
+
+        headers = {"cache-control": cache_control}
+        serve_path, serve_stat = full_path, stat_result
+        if media_type in COMPRESSIBLE_TYPES:
+            vary.append("Accept-Encoding")
+            accepted = _accepted_encodings(scope)
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding not in accepted:
+                    continue
+                sibling_stat = await asyncio.to_thread(self._stat_or_none, full_path + suffix)
+                if sibling_stat is not None and sibling_stat.st_mtime >= stat_result.st_mtime:
+                    serve_path, serve_stat = full_path + suffix, sibling_stat
+                    headers["content-encoding"] = encoding
+                    etag = f"{etag}-{encoding}"
+                    break
+        headers["etag"] = f'"{etag}"'
+        if vary:
+            headers["vary"] = ", ".join(vary)
+
+        response = FileResponse(serve_path, stat_result=serve_stat, media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def _remote_response(self, storage: StorageBackend, key: str, scope: Scope) -> Response:
+        """
+        Uploads kept in a bucket: redirect to a short-lived presigned URL,
+        picking the variant key the same way as for local files.
+        """
+        headers = {}
+        width = self._requested_width(scope)
+        if width is not None and not is_variant(key):
+            headers["vary"] = "Accept"
+            extension = "webp" if "image/webp" in Headers(scope=scope).get("accept", "") else "jpg"
+            for candidate in VARIANT_WIDTHS:
+                if candidate >= width:
+                    variant = variant_name(key, candidate, extension)
+                    if await self._remote_exists(storage, variant):
+                        key = variant
+                        break
+        if not await self._remote_exists(storage, key):
+            return PlainTextResponse("Not Found", status_code=404)
+        url = await storage.download_url(key, expires_in=PRESIGNED_TTL)
+        # The signature expires, so the redirect itself must not outlive it
+        headers["cache-control"] = f"private, max-age={PRESIGNED_TTL // 2}"
+        return RedirectResponse(url, status_code=307, headers=headers)
+
+    async def _remote_exists(self, storage: StorageBackend, key: str) -> bool:
+        # Keys are content-addressed, so a hit never goes stale; misses are not cached
+        if key in self._remote_keys:
+            self._remote_keys.move_to_end(key)
+            return True
+        if not await storage.exists(key):
+            return False
+        self._remote_keys[key] = True
+        if len(self._remote_keys) > ETAG_CACHE_SIZE:
+            self._remote_keys.popitem(last=False)
+        return True
+
+    async def _etag(self, full_path: str, stat_result: os.stat_result) -> str:
+        name = os.path.basename(full_path)
+        if HASHED_NAME.match(name):
+            return name
+        key = (full_path, stat_result.st_mtime_ns, stat_result.st_size)
+        etag = self._etags.get(key)
+        if etag is None:
+            etag = await asyncio.to_thread(_sha256_file, full_path)
+            self._etags[key] = etag
+            if len(self._etags) > ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+        else:
+            self._etags.move_to_end(key)
+        return etag
+
+    @staticmethod
+    def _stat_or_none(path: str) -> Optional[os.stat_result]:
+        try:
+            result = os.stat(path)
+        except OSError:
+            return None
+        return result if stat.S_ISREG(result.st_mode) else None
+
+    @staticmethod
+    def _requested_width(scope: Scope):
+        values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("w")
+        if not values or not values[0].isdigit():
+            return None
+        return min(int(values[0]), VARIANT_WIDTHS[-1])
+
+
+def precompress(root: str = "static") -> int:
+    """
+    Write .gz (and .br when the brotli package is installed) siblings for
+    compressible static files that don't have an up to date one yet.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    compressors = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    written = 0
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            full_path = os.path.join(directory, filename)
+            if guess_type(full_path)[0] not in COMPRESSIBLE_TYPES:
+                continue
+            with open(full_path, "rb") as f:
+                content = f.read()
+            for suffix, compress in compressors:
+                target = full_path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(full_path):
+                    continue
+                compressed = compress(content)
+                if len(compressed) >= len(content):
+                    continue
+                with open(target + ".part", "wb") as f:
+                    f.write(compressed)
+                os.replace(target + ".part", target)
+                written += 1
+    print(f"Wrote {written} precompressed files")
+    return written
+
+
+if __name__ == "__main__":
+    # python -m services.static_files [static_dir]
+    precompress(*sys.argv[1:2])
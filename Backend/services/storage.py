@@ -0,0 +1,256 @@
+import asyncio
+import os
+import sys
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+class StorageBackend(ABC):
+    """
+    Where uploaded files live. Keys are paths relative to the static
+    directory ("uploads/<hash>.jpg"); the public path stored in the
+    database is always "/static/<key>", whatever the backend.
+    """
+
+    # True when files are reachable on the local disk under `root`
+    is_local = False
+
+    @abstractmethod
+    async def put_file(self, key: str, local_path: str, content_type: str):
+        ...
+
+    @abstractmethod
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str):
+        ...
+
+    @abstractmethod
+    def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        ...
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def download_url(self, key: str, expires_in: int = 3600) -> str:
+        ...
+
+
+class LocalStorage(StorageBackend):
+    is_local = True
+
+    def __init__(self, root: str = "static", temp_dir: Optional[str] = None):
+        self.root = root
+        # Partial files are written outside the served tree, next to it so
+        # that moving a finished file in is a rename
+        self.temp_dir = temp_dir or os.path.join(os.path.dirname(root), ".upload-tmp")
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def put_file(self, key: str, local_path: str, content_type: str):
+        target = self.local_path(key)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(target), exist_ok=True)
+        await asyncio.to_thread(os.replace, local_path, target)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str):
+        target = self.local_path(key)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(target), exist_ok=True)
+        await asyncio.to_thread(os.makedirs, self.temp_dir, exist_ok=True)
+        temp_path = os.path.join(self.temp_dir, f"{uuid4()}.part")
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, temp_path, target)
+
+    async def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self.local_path(key), "rb")
+        try:
+            while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self.local_path(key))
+
+    async def delete(self, key: str):
+        try:
+            await asyncio.to_thread(os.remove, self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    async def download_url(self, key: str, expires_in: int = 3600) -> str:
+        return f"/static/{key}"
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-compatible bucket (AWS S3, MinIO, ...). boto3 is blocking, so every
+    call runs on a bounded thread pool; uploads use boto3's managed
+    multipart transfer straight from the temp file.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None, max_workers: int = 16):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(
+                max_pool_connections=max_workers,
+                connect_timeout=5,
+                read_timeout=30,
+                retries={"max_attempts": 3, "mode": "standard"},
+            ),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3")
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def put_file(self, key: str, local_path: str, content_type: str):
+        await self._run(
+            self.client.upload_file,
+            local_path,
+            self.bucket,
+            key,
+            ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE_CACHE},
+        )
+        await asyncio.to_thread(os.remove, local_path)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes], content_type: str):
+        # Spool to a temp file (memory up to 8 MB, disk beyond) so boto3 can
+        # seek and retry parts, then hand it to the managed transfer
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+            async for chunk in chunks:
+                await asyncio.to_thread(spool.write, chunk)
+            await asyncio.to_thread(spool.seek, 0)
+            await self._run(
+                self.client.upload_fileobj,
+                spool,
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE_CACHE},
+            )
+
+    async def open_stream(self, key: str) -> AsyncIterator[bytes]:
+        response = await self._run(self.client.get_object, Bucket=self.bucket, Key=key)
+        body = response["Body"]
+        try:
+            while chunk := await self._run(body.read, CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await self._run(self.client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def delete(self, key: str):
+        await self._run(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def download_url(self, key: str, expires_in: int = 3600) -> str:
+        return await self._run(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """
+    Backend picked from the environment:
+      STORAGE_BACKEND=local (default) | s3
+      S3_BUCKET, S3_ENDPOINT_URL (e.g. http://localhost:9000 for MinIO), S3_REGION
+    Credentials come from the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY.
+    """
+    global _storage
+    if _storage is None:
+        if os.getenv("STORAGE_BACKEND", "local") == "s3":
+            _storage = S3Storage(
+                bucket=os.environ["S3_BUCKET"],
+                endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+                region=os.getenv("S3_REGION"),
+            )
+        else:
+            _storage = LocalStorage()
+    return _storage
+
+
+def set_storage(storage: StorageBackend):
+    global _storage
+    _storage = storage
+
+
+async def migrate_local_files(source: LocalStorage, target: StorageBackend, prefix: str = "uploads", concurrency: int = 16) -> int:
+    """
+    Copy every file under `prefix` from local disk to `target`, `concurrency`
+    transfers at a time, skipping keys the target already has.
+    """
+    from mimetypes import guess_type
+
+    keys = []
+    for directory, _, filenames in os.walk(source.local_path(prefix)):
+        for filename in filenames:
+            if filename.endswith(".part"):
+                continue
+            relative = os.path.relpath(os.path.join(directory, filename), source.root)
+            keys.append(relative.replace(os.sep, "/"))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    copied = 0
+
+    async def copy(key: str):
+        nonlocal copied
+        async with semaphore:
+            if await target.exists(key):
+                return
+            content_type = guess_type(key)[0] or "application/octet-stream"
+            await target.put_stream(key, source.open_stream(key), content_type)
+            copied += 1
+
+    await asyncio.gather(*(copy(key) for key in keys))
+    print(f"Copied {copied} of {len(keys)} files")
+    return copied
+
+
+if __name__ == "__main__":
+    # python -m services.storage migrate   (reads the S3_* variables)
+    if sys.argv[1:2] != ["migrate"]:
+        raise SystemExit("usage: python -m services.storage migrate")
+    asyncio.run(migrate_local_files(
+        LocalStorage(),
+        S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+        ),
+    ))
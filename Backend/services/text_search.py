@@ -0,0 +1,150 @@
+import base64
+import html
+import re
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Float, Integer, String, and_, bindparam, func, literal, or_, select, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from Dto.prescriptiondto import SearchHit
+from models.appointments import Appointment
+from models.prescription import Prescription
+from models.text_search import SEARCH_CONFIG, search_vector
+
+# The database marks matches with private-use characters; _highlight escapes
+# the text and only then turns them into <b></b>, so notes can't inject markup
+START, STOP = "\ue000", "\ue001"
+HEADLINE_OPTIONS = f"MaxWords=24, MinWords=8, MaxFragments=2, StartSel={START}, StopSel={STOP}"
+SNIPPET_TOKENS = 16
+WORD = re.compile(r"\w+")
+
+_SQLITE_HITS = """
+SELECT a.id AS appointment_id, 'note' AS source, -bm25(appointments_fts) AS rank,
+       snippet(appointments_fts, 0, :start, :stop, '…', :tokens) AS snippet, a.date, a.patient_id
+FROM appointments_fts JOIN appointments a ON a.id = appointments_fts.rowid
+WHERE appointments_fts MATCH :match AND a.medecin_id = :medecin_id
+UNION ALL
+SELECT p.appointment_id, 'prescription', -bm25(prescriptions_fts),
+       snippet(prescriptions_fts, 0, :start, :stop, '…', :tokens), a.date, a.patient_id
+FROM prescriptions_fts JOIN prescriptions p ON p.id = prescriptions_fts.rowid
+JOIN appointments a ON a.id = p.appointment_id
+WHERE prescriptions_fts MATCH :match AND a.medecin_id = :medecin_id
+"""
+
+
+def encode_cursor(rank: float, appointment_id: int, source: str) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}|{appointment_id}|{source}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int, str]:
+    try:
+        rank, appointment_id, source = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(rank), int(appointment_id), source
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(rank, appointment_id, source, cursor: Tuple[float, int, str]):
+    """
+    Rows after `cursor` in (rank desc, appointment_id desc, source) order.
+    """
+    last_rank, last_id, last_source = cursor
+    return or_(
+        rank < last_rank,
+        and_(rank == last_rank, appointment_id < last_id),
+        and_(rank == last_rank, appointment_id == last_id, source > last_source),
+    )
+
+
+def _highlight(snippet: Optional[str]) -> str:
+    return html.escape(snippet or "").replace(START, "<b>").replace(STOP, "</b>")
+
+
+async def _postgres_hits(db: AsyncSession, medecin_id: int, q: str, limit: int, after: Optional[tuple]):
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, bindparam("q", q))
+    notes = (
+        select(
+            Appointment.id.label("appointment_id"),
+            literal("note", String).label("source"),
+            func.ts_rank_cd(search_vector(Appointment.note), query).label("rank"),
+            Appointment.note.label("body"),
+        )
+        .where(Appointment.medecin_id == medecin_id, search_vector(Appointment.note).op("@@")(query))
+    )
+    prescriptions = (
+        select(
+            Prescription.appointment_id,
+            literal("prescription", String),
+            func.ts_rank_cd(search_vector(Prescription.content), query),
+            Prescription.content,
+        )
+        .join(Appointment, Appointment.id == Prescription.appointment_id)
+        .where(Appointment.medecin_id == medecin_id, search_vector(Prescription.content).op("@@")(query))
+    )
+    hits = union_all(notes, prescriptions).subquery()
+    page = select(hits)
+    if after is not None:
+        page = page.where(_after(hits.c.rank, hits.c.appointment_id, hits.c.source, after))
+    page = page.order_by(hits.c.rank.desc(), hits.c.appointment_id.desc(), hits.c.source).limit(limit + 1).subquery()
+    # ts_headline re-parses the text, so it only runs on the page
+    result = await db.execute(
+        select(
+            page.c.appointment_id,
+            page.c.source,
+            page.c.rank,
+            func.ts_headline(SEARCH_CONFIG, page.c.body, query, HEADLINE_OPTIONS).label("snippet"),
+            Appointment.date,
+            Appointment.patient_id,
+        )
+        .join(Appointment, Appointment.id == page.c.appointment_id)
+        .order_by(page.c.rank.desc(), page.c.appointment_id.desc(), page.c.source)
+    )
+    return result.all()
+
+
+async def _sqlite_hits(db: AsyncSession, medecin_id: int, q: str, limit: int, after: Optional[tuple]):
+    # Quoted terms: user input never reaches the FTS5 query syntax
+    match = " ".join(f'"{word}"' for word in WORD.findall(q))
+    hits = text(_SQLITE_HITS).columns(
+        appointment_id=Integer, source=String, rank=Float, snippet=String, date=DateTime, patient_id=Integer
+    ).subquery()
+    page = select(hits)
+    if after is not None:
+        page = page.where(_after(hits.c.rank, hits.c.appointment_id, hits.c.source, after))
+    result = await db.execute(
+        page.order_by(hits.c.rank.desc(), hits.c.appointment_id.desc(), hits.c.source).limit(limit + 1),
+        {"match": match, "medecin_id": medecin_id, "tokens": SNIPPET_TOKENS, "start": START, "stop": STOP},
+    )
+    return result.all()
+
+
+async def search_history(
+    db: AsyncSession, medecin_id: int, q: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[SearchHit], Optional[str]]:
+    """
+    The doctor's appointment notes and prescriptions matching `q`, best
+    first, with an HTML-escaped snippet each (matches in <b></b>), and the
+    cursor of the next page.
+    Postgres answers from the GIN indexes, SQLite from the FTS5 tables.
+    """
+    if not WORD.search(q):
+        return [], None
+    after = decode_cursor(cursor) if cursor is not None else None
+    hits = _sqlite_hits if db.bind.dialect.name == "sqlite" else _postgres_hits
+    rows = await hits(db, medecin_id, q, limit, after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].appointment_id, rows[-1].source)
+    return [
+        SearchHit(
+            appointment_id=row.appointment_id,
+            source=row.source,
+            rank=row.rank,
+            snippet=_highlight(row.snippet),
+            date=row.date,
+            patient_id=row.patient_id,
+        )
+        for row in rows
+    ], next_cursor
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from mimetypes import guess_type
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from services.image_variants import schedule_variants
+from services.storage import StorageBackend, get_storage
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Room for the other multipart fields (nom, prenom, ...) sent next to the file
+FORM_OVERHEAD = 64 * 1024
+
+
+@dataclass(frozen=True)
+class UploadKind:
+    # storage key prefix, files are served from /static/<prefix>/...
+    prefix: str
+    max_bytes: int
+    # content type -> known extensions for it (files are stored with the first one)
+    content_types: Dict[str, tuple] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    path: str
+    content_hash: str
+    size: int
+    content_type: str
+
+
+IMAGE_TYPES = {
+    "image/jpeg": (".jpg", ".jpeg", ".jfif"),
+    "image/png": (".png",),
+    "image/webp": (".webp",),
+}
+
+UPLOAD_KINDS: Dict[str, UploadKind] = {
+    "photo": UploadKind(
+        prefix="uploads",
+        max_bytes=5 * 1024 * 1024,
+        content_types=IMAGE_TYPES,
+    ),
+    # Same directory as photos: blobs are keyed by content only, so the same
+    # bytes uploaded as either kind are one file and one upload_blobs row
+    "medicament": UploadKind(
+        prefix="uploads",
+        max_bytes=2 * 1024 * 1024,
+        content_types=IMAGE_TYPES,
+    ),
+}
+
+# Routes accepting a file, checked by UploadLimitMiddleware before the body is read
+UPLOAD_ROUTES = {
+    "/auth/register/patient": "photo",
+    "/auth/register/doctor": "photo",
+    "/users/updatepatient/": "photo",
+    "/users/updatemedecin/": "photo",
+    "/medicaments/upload-medicament-image": "medicament",
+}
+
+# Leading bytes of each accepted format, used to reject mislabelled files
+MAGIC_NUMBERS = {
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/webp": (b"RIFF",),
+}
+
+# Per-kind counters, exposed through GET /stats/uploads
+upload_metrics: Dict[str, Dict[str, float]] = {
+    kind: {"count": 0, "bytes": 0, "seconds": 0.0, "rejected": 0} for kind in UPLOAD_KINDS
+}
+
+
+def _reject(kind: str, status_code: int, detail: str):
+    upload_metrics[kind]["rejected"] += 1
+    raise HTTPException(status_code=status_code, detail=detail)
+
+
+def _copy_to_temp(source, temp_path: str, max_bytes: int, content_type: str) -> Tuple[int, str]:
+    """
+    Copy `source` into `temp_path` chunk by chunk, hashing as it goes and
+    stopping as soon as the size limit is crossed. Runs in a worker thread.
+    """
+    written = 0
+    digest = hashlib.sha256()
+    with open(temp_path, "wb") as buffer:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if written == 0 and not chunk.startswith(MAGIC_NUMBERS.get(content_type, (b"",))):
+                raise ValueError("content does not match its declared type")
+            written += len(chunk)
+            if written > max_bytes:
+                raise OverflowError
+            digest.update(chunk)
+            buffer.write(chunk)
+        buffer.flush()
+        os.fsync(buffer.fileno())
+    return written, digest.hexdigest()
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _publish_variants(storage: StorageBackend, prefix: str, work_dir: str, created: List[str]):
+    for variant in created:
+        await storage.put_file(f"{prefix}/{os.path.basename(variant)}", variant, guess_type(variant)[0])
+    await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+
+async def save_upload(upload: UploadFile, kind_name: str) -> StoredUpload:
+    """
+    Stream an uploaded file to a temp file off the event loop, then store it
+    under its hash in the configured storage backend.
+
+    The file only reaches its final key once complete, so a failed or rejected
+    upload never leaves a partial file behind. Uploading the same content twice
+    reuses the stored file.
+    """
+    kind = UPLOAD_KINDS[kind_name]
+    content_type = (upload.content_type or "").split(";")[0].strip().lower()
+    if content_type not in kind.content_types:
+        _reject(kind_name, 415, f"Unsupported file type: {content_type or 'unknown'}")
+    if upload.size is not None and upload.size > kind.max_bytes:
+        _reject(kind_name, 413, f"File too large (max {kind.max_bytes // (1024 * 1024)} MB)")
+
+    storage = get_storage()
+    # Not under the served directory: a partial upload is never public
+    temp_dir = storage.temp_dir if storage.is_local else tempfile.gettempdir()
+    await asyncio.to_thread(os.makedirs, temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{uuid4()}.part")
+
+    started = time.perf_counter()
+    try:
+        size, content_hash = await asyncio.to_thread(_copy_to_temp, upload.file, temp_path, kind.max_bytes, content_type)
+        filename = f"{content_hash}{kind.content_types[content_type][0]}"
+        key = f"{kind.prefix}/{filename}"
+        created = not await storage.exists(key)
+        if created:
+            if storage.is_local:
+                await storage.put_file(key, temp_path, content_type)
+                # Resized copies are produced in the background; the original is served until they exist
+                schedule_variants(storage.local_path(key))
+            else:
+                # Variants are rendered from a local copy, then pushed next to the original
+                work_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="variants-")
+                work_path = os.path.join(work_dir, filename)
+                await asyncio.to_thread(shutil.copyfile, temp_path, work_path)
+                await storage.put_file(key, temp_path, content_type)
+                schedule_variants(work_path, publish=partial(_publish_variants, storage, kind.prefix, work_dir))
+    except OverflowError:
+        _reject(kind_name, 413, f"File too large (max {kind.max_bytes // (1024 * 1024)} MB)")
+    except ValueError as e:
+        _reject(kind_name, 415, f"Invalid file: {e}")
+    finally:
+        # Still there when the upload was rejected or its content was already stored
+        await asyncio.to_thread(_discard, temp_path)
+    elapsed = time.perf_counter() - started
+
+    metrics = upload_metrics[kind_name]
+    metrics["count"] += 1
+    metrics["bytes"] += size
+    metrics["seconds"] += elapsed
+    logger.info(f"Stored {kind_name} upload {filename}: {size} bytes at {size / max(elapsed, 1e-6):.0f} B/s")
+
+    return StoredUpload(
+        path=f"/static/{key}",
+        content_hash=content_hash,
+        size=size,
+        content_type=content_type,
+    )
+
+
+def upload_metrics_snapshot() -> Dict[str, Dict[str, float]]:
+    return {
+        kind: {**metrics, "bytes_per_second": metrics["bytes"] / metrics["seconds"] if metrics["seconds"] else 0.0}
+        for kind, metrics in upload_metrics.items()
+    }
+
+
+class UploadLimitMiddleware:
+    """
+    Reject oversized bodies on upload routes before they are parsed.
+
+    Checks Content-Length up front and counts bytes for chunked bodies,
+    so a client cannot make the server spool a huge form to disk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        kind_name = self._kind_for(scope)
+        if kind_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = UPLOAD_KINDS[kind_name].max_bytes + FORM_OVERHEAD
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            upload_metrics[kind_name]["rejected"] += 1
+            await self._send_413(send, limit)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    upload_metrics[kind_name]["rejected"] += 1
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _kind_for(scope: Scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return None
+        path = scope["path"]
+        for prefix, kind_name in UPLOAD_ROUTES.items():
+            if path == prefix or (prefix.endswith("/") and path.startswith(prefix)):
+                return kind_name
+        return None
+
+    @staticmethod
+    async def _send_413(send: Send, limit: int):
+        body = f'{{"detail":"Request body too large (max {limit} bytes)"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
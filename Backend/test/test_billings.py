@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+import os
+import sys
+from datetime import date, datetime
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+import main  # noqa: F401  configures every mapper
+from database import get_db
+from models.billing import Billing
+from models.Carts import Cart
+from models.medicaments import Medicament
+from models.patients import Patient
+from models.sales_rollups import SalesRollup
+from models.stock_reservations import StockReservation
+from models.users import User
+from services import billings, checkout
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync: User.metadata.create_all(
+            sync, tables=[User.__table__, Patient.__table__, Cart.__table__, Billing.__table__]
+        ))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as db:
+        db.add(User(id=1, nom="Ben Ali", prenom="Sami", telephone="1", email="sami@example.com", password="x", role="patient"))
+        db.add(Patient(id=1, user_id=1))
+        db.add(Cart(id=1, patient_id=1, total_price=12.5, is_paid=True))
+        for i in range(1, 6):
+            db.add(Billing(id=i, order_id=f"o{i}", cart_id=1 if i == 1 else None, amount=10.0 * i,
+                           payment_method="card" if i % 2 else "cash", date=datetime(2024, 1, i)))
+        # Same date as billing 5: the id breaks the tie
+        db.add(Billing(id=6, order_id="o6", amount=60.0, payment_method="card", date=datetime(2024, 1, 5)))
+        await db.commit()
+    yield factory
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_pages_walk_every_billing_once_newest_first(session_factory):
+    seen = []
+    cursor = None
+    async with session_factory() as db:
+        while True:
+            page, cursor = await billings.billing_page(db, [], 2, cursor)
+            seen += [b.id for b in page]
+            if cursor is None:
+                break
+    assert seen == [6, 5, 4, 3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_filters_apply_to_pages(session_factory):
+    criteria = billings.billing_filters(datetime(2024, 1, 2), datetime(2024, 1, 5), "card")
+    async with session_factory() as db:
+        page, cursor = await billings.billing_page(db, criteria, 10)
+    assert [b.id for b in page] == [3]
+    assert cursor is None
+
+
+def test_migration_creates_the_keyset_index():
+    # The app doesn't run create_all: production gets the index from the migration
+    (index,) = [i for i in Billing.__table__.indexes if i.name == "ix_billing_date_id"]
+    statement = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations", "010_billing_date_id.sql")) as f:
+        assert statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS") + ";" in f.read()
+
+
+def test_bad_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        billings.decode_cursor("not-a-cursor")
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_export_streams_joined_rows(session_factory):
+    with patch.object(billings, "AsyncSessionLocal", session_factory), patch.object(billings, "EXPORT_BATCH", 2):
+        text = "".join([chunk async for chunk in billings.export_billings([], "csv")])
+        lines = [chunk async for chunk in billings.export_billings(billings.billing_filters(payment_method="cash"), "ndjson")]
+
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [row["id"] for row in rows] == ["6", "5", "4", "3", "2", "1"]
+    assert rows[-1]["patient_email"] == "sami@example.com"
+    assert rows[-1]["cart_total"] == "12.5"
+    assert rows[0]["patient_email"] == ""
+    records = [json.loads(line) for chunk in lines for line in chunk.splitlines()]
+    assert [record["id"] for record in records] == [4, 2]
+    assert records[0]["date"] == "2024-01-04T00:00:00"
+
+
+@pytest_asyncio.fixture
+async def shop(monkeypatch):
+    """
+    Two open carts over SQLite, with the real checkout and sales rollups and
+    an in-memory stock ledger (the real one needs Postgres advisory locks).
+    """
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync: User.metadata.create_all(sync, tables=[
+            Cart.__table__, Billing.__table__, Medicament.__table__, StockReservation.__table__, SalesRollup.__table__,
+        ]))
+        # SQLite can't create the model's composite autoincrement key
+        await conn.execute(text("CREATE TABLE cart_item (cart_id INTEGER, medicament_id INTEGER, quantity INTEGER, unit_price FLOAT)"))
+        await conn.execute(text("INSERT INTO cart_item VALUES (1, 10, 2, NULL), (2, 10, 1, NULL)"))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as db:
+        db.add(Medicament(id=10, name="Spasfon", price=4.5, dosage="1 cp", duration="3 jours", stock=5))
+        db.add_all([Cart(id=1, total_price=9.0, is_paid=False), Cart(id=2, total_price=4.5, is_paid=False)])
+        await db.commit()
+
+    stock = {10: 5}
+
+    async def sell(db, lines, held, reference=None):
+        short = [i for i, quantity in lines.items() if stock[i] - held.get(i, 0) < quantity]
+        if not short:
+            for i, quantity in lines.items():
+                stock[i] -= quantity
+        return short
+
+    async def record_movements(db, kind, quantities, reference=None):
+        assert kind == "return"
+        for i, quantity in quantities.items():
+            stock[i] += quantity
+
+    monkeypatch.setattr(checkout, "sell", sell)
+    monkeypatch.setattr(checkout, "record_movements", record_movements)
+
+    async def session():
+        async with factory() as db:
+            yield db
+
+    main.app.dependency_overrides[get_db] = session
+    yield factory, stock
+    main.app.dependency_overrides.pop(get_db, None)
+    await engine.dispose()
+
+
+async def rollups(factory):
+    async with factory() as db:
+        result = await db.execute(select(SalesRollup.day, SalesRollup.payment_method, SalesRollup.units, SalesRollup.revenue))
+        return {(day, method): (units, revenue) for day, method, units, revenue in result.all() if units}
+
+
+def billing_for(cart_id, day=2, payment_method="card"):
+    return {"order_id": f"o-{cart_id}", "amount": 9.0, "payment_method": payment_method,
+            "date": f"2024-03-0{day}T10:00:00", "cart_id": cart_id}
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_billing_reverses_the_sale_so_paying_again_counts_once(shop):
+    factory, stock = shop
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as ac:
+        first = await ac.post("/billing/add", json=billing_for(1))
+        assert stock == {10: 3}
+        assert (await ac.delete(f"/billing/delete/{first.json()['id']}")).status_code == 204
+        assert stock == {10: 5} and await rollups(factory) == {}
+
+        again = await ac.post("/billing/add", json=billing_for(1, day=3, payment_method="cash"))
+
+    assert again.status_code == 200
+    assert stock == {10: 3}
+    assert await rollups(factory) == {(date(2024, 3, 3), "cash"): (2, 9.0)}
+
+
+@pytest.mark.asyncio
+async def test_moving_a_billing_settles_the_new_cart_and_reverses_the_old(shop):
+    factory, stock = shop
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as ac:
+        created = (await ac.post("/billing/add", json=billing_for(1))).json()
+        moved = await ac.put(f"/billing/update/{created['id']}", json=billing_for(2))
+        assert moved.status_code == 200
+        assert stock == {10: 4}
+        assert await rollups(factory) == {(date(2024, 3, 2), "card"): (1, 4.5)}
+
+        # Same cart, another day and method: the sale is re-filed, stock doesn't move
+        refiled = await ac.put(f"/billing/update/{created['id']}", json=billing_for(2, day=4, payment_method="cash"))
+
+    assert refiled.status_code == 200
+    assert stock == {10: 4}
+    assert await rollups(factory) == {(date(2024, 3, 4), "cash"): (1, 4.5)}
+    async with factory() as db:
+        assert {cart.id: cart.is_paid for cart in (await db.execute(select(Cart))).scalars()} == {1: False, 2: True}
@@ -0,0 +1,124 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+import main  # noqa: F401  configures every mapper
+from services import blob_store
+from services.uploads import StoredUpload
+
+BLOB = "/static/uploads/" + "a" * 64 + ".jpg"
+OTHER = "/static/uploads/" + "b" * 64 + ".png"
+
+
+def sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def rows(*paths):
+    result = MagicMock()
+    result.all.return_value = [SimpleNamespace(hash=path[-68:-4], path=path) for path in paths]
+    return result
+
+
+@pytest.fixture
+def db():
+    session = AsyncMock(spec=AsyncSession)
+    session.calls = []
+    session.execute.side_effect = lambda statement, *args: session.calls.append(sql(statement))
+    session.commit.side_effect = lambda: session.calls.append("COMMIT")
+    return session
+
+
+def registered(path):
+    result = MagicMock()
+    result.scalar_one.return_value = path
+    return result
+
+
+@pytest.fixture
+def stored(db, monkeypatch):
+    stored = StoredUpload(path=BLOB, content_hash="a" * 64, size=10, content_type="image/jpeg")
+    save = AsyncMock(side_effect=lambda *args: db.calls.append("SAVE") or stored)
+    monkeypatch.setattr(blob_store, "save_upload", save)
+    deleted = AsyncMock()
+    monkeypatch.setattr(blob_store, "_delete_blob", deleted)
+    return deleted
+
+
+@pytest.mark.asyncio
+async def test_store_upload_holds_the_blob_lock_and_restarts_the_grace_period(db, stored):
+    db.execute.side_effect = lambda statement, *args: db.calls.append(sql(statement)) or registered(BLOB)
+
+    assert await blob_store.store_upload(db, MagicMock(), "photo") == BLOB
+
+    lock, saved, upsert = db.calls
+    assert lock.startswith("SELECT pg_advisory_xact_lock_shared(")
+    assert db.execute.await_args_list[0].args[1] == {"namespace": 7303, "key": 0}
+    assert saved == "SAVE"
+    assert "ON CONFLICT (hash) DO UPDATE SET released_at = CASE WHEN (upload_blobs.ref_count <= " in upsert
+    assert "THEN excluded.released_at ELSE upload_blobs.released_at END RETURNING upload_blobs.path" in upsert
+    stored.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_store_upload_returns_the_path_the_blob_is_registered_under(db, stored):
+    legacy = "/static/uploads/medicaments/" + "a" * 64 + ".jpg"
+    db.execute.side_effect = lambda statement, *args: registered(legacy)
+
+    assert await blob_store.store_upload(db, MagicMock(), "photo") == legacy
+    # The copy written under the new path is nobody's
+    assert stored.await_args.args[1] == BLOB
+
+
+@pytest.mark.asyncio
+async def test_acquire_and_release_count_references(db):
+    await blob_store.acquire(db, BLOB, count=2)
+    await blob_store.release(db, BLOB)
+    await blob_store.acquire(db, None)
+    await blob_store.release(db, "")
+
+    acquired, released = db.calls
+    assert "SET ref_count=(upload_blobs.ref_count + %(ref_count_1)s::INTEGER), released_at=%(released_at)s" in acquired
+    assert "ref_count=greatest(upload_blobs.ref_count - %(ref_count_1)s::INTEGER" in released
+    assert "released_at=CASE WHEN (upload_blobs.ref_count <= %(ref_count_2)s::INTEGER)" in released
+    assert db.execute.await_args_list[0].args[0].compile().params["ref_count_1"] == 2
+
+
+@pytest.mark.asyncio
+async def test_replace_reference_acquires_before_releasing(db):
+    await blob_store.replace_reference(db, BLOB, BLOB)
+    assert db.calls == []
+
+    await blob_store.replace_reference(db, "/static/uploads/old.jpg", BLOB)
+    acquired, released = (db.execute.await_args_list[i].args[0].compile().params for i in (0, 1))
+    assert acquired["path_1"] == BLOB and released["path_1"] == "/static/uploads/old.jpg"
+
+
+@pytest.mark.asyncio
+async def test_gc_sweep_removes_files_under_the_exclusive_lock(db, monkeypatch):
+    batches = iter([rows(BLOB, OTHER), rows()])
+
+    def execute(statement, *args):
+        db.calls.append(sql(statement))
+        if "FOR UPDATE" in db.calls[-1]:
+            return next(batches)
+
+    db.execute.side_effect = execute
+    monkeypatch.setattr(blob_store, "get_storage", lambda: "storage")
+    monkeypatch.setattr(blob_store, "_delete_blob", AsyncMock(side_effect=lambda storage, path: db.calls.append(path)))
+
+    assert await blob_store.gc_sweep(db) == 2
+
+    lock, select, delete, *files, commit = db.calls[:6]
+    assert lock.startswith("SELECT pg_advisory_xact_lock(")
+    assert "WHERE upload_blobs.ref_count <= %(ref_count_1)s::INTEGER AND upload_blobs.released_at < %(released_at_1)s" in select
+    assert select.endswith("FOR UPDATE SKIP LOCKED")
+    assert delete.startswith("DELETE FROM upload_blobs WHERE upload_blobs.hash IN")
+    assert files == [BLOB, OTHER] and commit == "COMMIT"
+    # The empty batch still ends its transaction, releasing the lock
+    assert db.calls[6:] == [lock, select, "COMMIT"]
@@ -0,0 +1,202 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from datetime import timedelta
+from types import SimpleNamespace
+from fastapi import HTTPException
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+import main  # noqa: F401  configures every mapper
+from models.Carts import Cart
+from services import carts
+from services.carts import cart_view, merge_items, write_lines
+
+
+def result(ids=None, total=0.0):
+    mock = MagicMock()
+    mock.scalars.return_value.all.return_value = ids or []
+    mock.scalar_one.return_value = total
+    return mock
+
+
+def test_merge_items_sums_repeated_ids_and_drops_empty_ones():
+    assert merge_items([(1, 2), (2, 1), (1, 3), (None, 4)]) == {1: 5, 2: 1}
+
+
+@pytest.mark.asyncio
+async def test_thirty_lines_cost_three_statements():
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.side_effect = [result(ids=list(range(1, 31))), result(), result(total=99.5)]
+    cart = Cart(id=7, patient_id=1, total_price=0.0, is_paid=False)
+
+    await write_lines(db, cart, {i: 1 for i in range(1, 31)})
+
+    assert db.execute.await_count == 3
+    upsert = str(db.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (cart_id, medicament_id) DO UPDATE SET quantity = (cart_item.quantity + excluded.quantity)" in upsert
+    assert cart.total_price == 99.5
+
+
+@pytest.mark.asyncio
+async def test_refresh_total_compiles_to_one_update_from_the_cart_lines():
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = result(total=12.6)
+    cart = Cart(id=7, patient_id=1, total_price=0.0, is_paid=False)
+
+    await carts.refresh_total(db, cart)
+
+    statement = str(db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "UPDATE carts SET total_price=(SELECT coalesce(sum(" in statement
+    assert "FROM cart_item JOIN medicaments ON medicaments.id = cart_item.medicament_id" in statement
+    assert "RETURNING carts.total_price" in statement
+    assert cart.total_price == 12.6
+
+
+@pytest.mark.asyncio
+async def test_unknown_medicament_is_404_unless_skipped():
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.side_effect = [result(ids=[1])]
+    with pytest.raises(HTTPException) as error:
+        await write_lines(db, Cart(id=7), {1: 1, 2: 1})
+    assert error.value.detail == "Medicament ID 2 not found"
+
+    db.execute.reset_mock()
+    db.execute.side_effect = [result(ids=[1]), result(), result(total=3.0)]
+    await write_lines(db, Cart(id=7), {1: 1, 2: 1}, skip_missing=True)
+    upsert = db.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect())
+    assert [v for k, v in upsert.params.items() if k.startswith("medicament_id")] == [1]
+
+
+@pytest.mark.asyncio
+async def test_cart_view_builds_lines_and_total_from_one_query():
+    row = lambda medicament_id, name, quantity, price, total: SimpleNamespace(
+        id=7, patient_id=1, is_paid=False, medicament_id=medicament_id, name=name,
+        quantity=quantity, unit_price=price, line_total=round((quantity or 0) * price, 2), total=total,
+    )
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=[row(1, "Doliprane", 3, 2.1, 10.3), row(2, "Spasfon", 1, 4.0, 10.3)]))
+
+    cart = await cart_view(db, Cart.id == 7)
+
+    assert db.execute.await_count == 1
+    assert ") OVER ()" in str(
+        db.execute.await_args.args[0].compile(dialect=postgresql.dialect())
+    )
+    assert cart.total_price == 10.3
+    assert [(i.name, i.quantity, i.line_total) for i in cart.items] == [("Doliprane", 3, 6.3), ("Spasfon", 1, 4.0)]
+    assert cart.medicaments[0].quantity == 3
+
+
+@pytest.mark.asyncio
+async def test_paid_cart_keeps_its_sale_prices_and_charged_total():
+    db = AsyncMock(spec=AsyncSession)
+    paid = SimpleNamespace(
+        id=7, patient_id=1, is_paid=True, medicament_id=1, name="Doliprane",
+        quantity=2, unit_price=2.0, line_total=4.0, total=4.0,
+    )
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=[paid]))
+
+    cart = await cart_view(db, Cart.id == 7)
+
+    sql = str(db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "CASE WHEN (carts.is_paid = true) THEN coalesce(cart_item.unit_price, medicaments.price)" in sql
+    assert "CASE WHEN (carts.is_paid = true) THEN coalesce(carts.total_price," in sql
+    assert cart.total_price == 4.0 and cart.items[0].unit_price == 2.0
+
+
+@pytest.mark.asyncio
+async def test_cart_view_of_empty_cart_has_no_lines():
+    db = AsyncMock(spec=AsyncSession)
+    empty = SimpleNamespace(id=7, patient_id=1, is_paid=False, medicament_id=None, total=0)
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=[empty]))
+
+    cart = await cart_view(db, Cart.id == 7)
+    assert cart.items == [] and cart.total_price == 0
+
+
+def deleted_rows(rowcount):
+    mock = MagicMock()
+    mock.rowcount = rowcount
+    return mock
+
+
+@pytest.mark.asyncio
+async def test_sweeper_deletes_idle_carts_in_batches(monkeypatch):
+    monkeypatch.setattr(carts, "SWEEP_BATCH_SIZE", 2)
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.side_effect = [
+        deleted_rows(1),                                          # stamp carts without updated_at
+        result(ids=[3, 4]), deleted_rows(1), deleted_rows(5), deleted_rows(2),
+        result(ids=[9]), deleted_rows(0), deleted_rows(1), deleted_rows(1),
+    ]
+
+    counts = await carts.expire_abandoned(db, ttl=timedelta(days=7))
+
+    assert counts == {"carts": 3, "lines": 6, "reservations": 1, "stamped": 1}
+    # One commit for the stamping, one per batch
+    assert db.commit.await_count == 3
+    select_idle = str(db.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect()))
+    assert "carts.is_paid = false AND carts.updated_at <" in select_idle
+    assert "NOT (EXISTS (SELECT billing.id \nFROM billing \nWHERE billing.cart_id = carts.id))" in select_idle
+    assert "FOR UPDATE SKIP LOCKED" in select_idle
+
+
+@pytest.mark.asyncio
+async def test_sweeper_reports_nothing_when_no_cart_is_idle():
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.side_effect = [deleted_rows(0), result(ids=[])]
+
+    assert await carts.expire_abandoned(db) == {}
+
+
+def prescribed(medicament_id, name="Amoxicilline", available=5, patient_id=3):
+    return SimpleNamespace(patient_id=patient_id, medicament_id=medicament_id, name=name, available=available)
+
+
+@pytest.mark.asyncio
+async def test_fill_from_prescription_checks_and_writes_in_four_statements():
+    db = AsyncMock(spec=AsyncSession)
+    db.add = MagicMock()
+    open_cart = Cart(id=7, patient_id=3, total_price=0.0, is_paid=False)
+    lines = MagicMock(all=MagicMock(return_value=[prescribed(1), prescribed(2, "Doliprane")]))
+    existing = MagicMock()
+    existing.scalars.return_value.first.return_value = open_cart
+    db.execute.side_effect = [lines, existing, result(), result(total=12.4)]
+
+    cart = await carts.fill_from_prescription(db, 42, patient_id=3)
+
+    assert cart is open_cart and cart.total_price == 12.4
+    assert db.execute.await_count == 4
+    check = str(db.execute.await_args_list[0].args[0].compile(dialect=postgresql.dialect()))
+    assert "stock_movements" in check and "medicaments.legal" not in check
+    # Stock held by other carts counts against what's available, the patient's own open cart doesn't
+    assert "stock_reservations.cart_id NOT IN (SELECT carts.id" in check
+    assert "coalesce(anon_1.stock, %(coalesce_1)s::INTEGER) - coalesce(anon_2.quantity, %(coalesce_2)s::INTEGER) AS available" in check
+    upsert = db.execute.await_args_list[2].args[0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (cart_id, medicament_id) DO NOTHING" in str(upsert)
+    assert [v for k, v in upsert.params.items() if k.startswith("medicament_id")] == [1, 2]
+    total = str(db.execute.await_args_list[3].args[0].compile(dialect=postgresql.dialect()))
+    assert "FROM cart_item JOIN medicaments ON medicaments.id = cart_item.medicament_id" in total
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("rows, patient_id, status", [
+    ([], None, 404),
+    ([prescribed(1)], 4, 403),
+    ([prescribed(None)], None, 400),
+    ([prescribed(1), prescribed(2, "Augmentin", available=0)], None, 409),
+])
+async def test_fill_from_prescription_refuses_before_touching_the_cart(rows, patient_id, status):
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=rows))
+
+    with pytest.raises(HTTPException) as error:
+        await carts.fill_from_prescription(db, 42, patient_id=patient_id)
+
+    assert error.value.status_code == status
+    assert db.execute.await_count == 1
+    if status == 409:
+        assert error.value.detail == "Out of stock: Augmentin"
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+import main  # noqa: F401  configures every mapper
+from routes.medicament_router import cached_catalog_response
+from services.catalog_cache import CatalogCache, catalog_cache, listen_for_changes, stop_listening
+
+
+def make_request(headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/medicaments/", "headers": raw})
+
+
+@pytest.mark.asyncio
+async def test_pages_are_rendered_once_per_version():
+    cache = CatalogCache()
+    render = AsyncMock(return_value=b"[]")
+    first = await cache.page((1, 40), "all", render)
+    again = await cache.page((1, 40), "all", render)
+    sold = await cache.page((1, 41), "all", render)
+    newer = await cache.page((2, 41), "all", render)
+
+    assert first == again
+    assert render.await_count == 3
+    assert len({first[0], sold[0], newer[0]}) == 3
+    assert list(cache._pages) == [((2, 41), "all")]
+
+
+@pytest.mark.asyncio
+async def test_version_read_once_while_listening_and_updated_by_notify():
+    cache = CatalogCache()
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = MagicMock(scalar_one_or_none=MagicMock(return_value=3))
+    cache.listening = True
+
+    assert await cache.current_version(db) == 3
+    assert await cache.current_version(db) == 3
+    cache.on_notify(4)
+    assert await cache.current_version(db) == 4
+    assert db.execute.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_matching_etag_returns_304_without_db(monkeypatch):
+    monkeypatch.setattr(catalog_cache, "version", 7)
+    monkeypatch.setattr(catalog_cache, "listening", True)
+    monkeypatch.setattr(catalog_cache, "stock_mark", 40)
+    monkeypatch.setattr(catalog_cache, "stock_checked_at", time.monotonic())
+    db = AsyncMock(spec=AsyncSession)
+    render = AsyncMock(return_value=b'[{"id": 1}]')
+
+    response = await cached_catalog_response(make_request(), db, "all", render)
+    etag = response.headers["etag"]
+    cached = await cached_catalog_response(make_request({"If-None-Match": etag}), db, "all", render)
+
+    assert response.body == b'[{"id": 1}]'
+    assert cached.status_code == 304
+    assert render.await_count == 1
+    db.execute.assert_not_awaited()
+    db.scalar.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_sales_move_the_stock_mark_but_not_the_version():
+    cache = CatalogCache()
+    cache.listening = True
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = MagicMock(scalar_one_or_none=MagicMock(return_value=3))
+    db.scalar.side_effect = [40, 41]
+
+    assert await cache.current_stamp(db) == (3, 40)
+    assert await cache.current_stamp(db) == (3, 40)
+    cache.forget_stock()
+    assert await cache.current_stamp(db) == (3, 41)
+    assert db.execute.await_count == 1
+    assert "max(stock_movements.id)" in str(db.scalar.await_args.args[0])
+
+
+@pytest.mark.asyncio
+async def test_stopping_the_listener_closes_its_connection():
+    driver = MagicMock(add_listener=AsyncMock(), is_closed=MagicMock(return_value=False))
+    conn = AsyncMock()
+    conn.get_raw_connection.return_value = MagicMock(driver_connection=driver)
+    engine = MagicMock()
+    engine.connect.return_value.__aenter__.return_value = conn
+
+    task = asyncio.create_task(listen_for_changes(engine, retry_delay=0.01))
+    while not catalog_cache.listening:
+        await asyncio.sleep(0.01)
+    await stop_listening(task)
+
+    assert task.cancelled()
+    assert not catalog_cache.listening
+    conn.invalidate.assert_awaited_once()
+    engine.connect.return_value.__aexit__.assert_awaited_once()
@@ -0,0 +1,93 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import HTTPException
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.ext.asyncio import AsyncSession
+import main  # noqa: F401  configures every mapper
+from services import checkout
+
+
+def result(scalar=None, rows=None, scalars=None):
+    mock = MagicMock()
+    mock.scalar_one_or_none.return_value = scalar
+    mock.scalar_one.return_value = scalar
+    mock.all.return_value = rows or []
+    mock.scalars.return_value.all.return_value = scalars or []
+    return mock
+
+
+@pytest.fixture
+def db():
+    session = AsyncMock(spec=AsyncSession)
+    return session
+
+
+@pytest.mark.asyncio
+async def test_settle_cart_is_all_or_nothing(db):
+    db.execute.side_effect = [
+        result(scalar=1),                      # claim the cart
+        result(rows=[(10, 2), (11, 5)]),       # cart lines
+        result(rows=[(11, 1)]),                # held by other carts
+        result(),                              # advisory locks
+        result(rows=[(10, 5), (11, 5)]),       # current stock
+        result(rows=[(11, 5)]),                # current stock of the short line
+        result(rows=[(11, "Spasfon")]),        # its name
+    ]
+    with pytest.raises(HTTPException) as error:
+        await checkout.settle_cart(db, MagicMock(id=1))
+
+    assert error.value.status_code == 409
+    assert error.value.detail == "Insufficient stock for: Spasfon (available 4)"
+    # No sale movement was written
+    assert db.execute.await_count == 7
+    db.rollback.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_settle_cart_refuses_already_paid_cart(db):
+    db.execute.side_effect = [result(scalar=None)]
+    with pytest.raises(HTTPException) as error:
+        await checkout.settle_cart(db, MagicMock(id=1))
+
+    assert error.value.status_code == 400
+    assert db.execute.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_unsettle_cart_returns_stock_and_reverses_the_sale(db, monkeypatch):
+    reverse_sale = AsyncMock()
+    monkeypatch.setattr(checkout, "reverse_sale", reverse_sale)
+    sold_at = datetime(2024, 3, 1)
+    paid = MagicMock()
+    paid.first.return_value = MagicMock(updated_at=sold_at)
+    db.execute.side_effect = [
+        paid,                                  # lock the paid cart
+        result(),                              # mark it unpaid
+        result(rows=[(10, 2), (11, 5)]),       # cart lines
+        result(),                              # ledger lock
+        result(),                              # return movements
+    ]
+
+    await checkout.unsettle_cart(db, MagicMock(id=1))
+
+    returned = db.execute.await_args.args[1]
+    assert sorted((row["medicament_id"], row["quantity"], row["kind"]) for row in returned) == [
+        (10, 2, "return"), (11, 5, "return"),
+    ]
+    reverse_sale.assert_awaited_once_with(db, 1, sold_at)
+
+
+@pytest.mark.asyncio
+async def test_unsettle_cart_refuses_unpaid_cart(db):
+    unpaid = MagicMock()
+    unpaid.first.return_value = None
+    db.execute.side_effect = [unpaid]
+    with pytest.raises(HTTPException) as error:
+        await checkout.unsettle_cart(db, MagicMock(id=1))
+
+    assert error.value.status_code == 400
+    assert db.execute.await_count == 1
@@ -0,0 +1,72 @@
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from main import app
+from services.drug_interactions import InteractionRules, check_interactions, load_rules
+
+DATASET = {
+    "drugs": {"warfarin": ["coumadine"], "ibuprofen": ["advil"], "ketoprofen": ["bi-profenid"], "metronidazole": ["flagyl"],
+              "simvastatin": [], "clarithromycin": ["zeclar"]},
+    "classes": {"vka": ["warfarin"], "nsaid": ["ibuprofen", "ketoprofen"], "statin": ["simvastatin"], "macrolide": ["clarithromycin"]},
+    "rules": [
+        {"between": ["class:vka", "class:nsaid"], "severity": "major", "message": "bleeding"},
+        {"between": ["class:nsaid", "class:nsaid"], "severity": "moderate", "message": "two nsaids"},
+        {"between": ["class:vka", "drug:metronidazole"], "severity": "major", "message": "inr"},
+        {"between": ["class:statin", "class:macrolide"], "severity": "major", "message": "rhabdo"},
+        {"between": ["drug:simvastatin", "drug:clarithromycin"], "severity": "contraindicated", "message": "simva clari"},
+    ],
+}
+
+
+def test_names_resolve_through_aliases_and_multi_word_tokens():
+    rules = InteractionRules.compile(DATASET)
+    assert rules.profile("Coumadine 5 mg").drugs == {"warfarin"}
+    assert rules.profile("Bi-Profénid LP 100").drugs == {"ketoprofen"}
+    assert rules.profile("Chlorhexidine bain de bouche").bits == 0
+
+
+def test_pair_index_and_class_bits_both_apply():
+    rules = InteractionRules.compile(DATASET)
+    simva, clari = rules.profile("Simvastatin 20"), rules.profile("Zeclar 500")
+    assert [r.message for r in rules.between(simva, clari)] == ["simva clari", "rhabdo"]
+    # Same class on both sides, and a drug-specific bit against a class
+    assert [r.message for r in rules.between(rules.profile("Advil"), rules.profile("Bi-Profenid"))] == ["two nsaids"]
+    assert [r.message for r in rules.between(rules.profile("Flagyl"), rules.profile("Coumadine"))] == ["inr"]
+    assert rules.between(rules.profile("Flagyl"), rules.profile("Advil")) == []
+
+
+def test_unknown_references_are_rejected_at_compile_time():
+    broken = {**DATASET, "rules": [{"between": ["class:vka", "drug:aspirin"], "severity": "major", "message": "x"}]}
+    with pytest.raises(ValueError):
+        InteractionRules.compile(broken)
+
+
+def test_shipped_dataset_compiles_and_flags_common_dental_cases():
+    load_rules()
+    found = check_interactions({1: "Previscan 20mg", 2: "Advil 400mg", 3: "Doliprane 1000mg", 4: "Dafalgan codéine"})
+    assert [(f["medicament_ids"], f["severity"]) for f in found] == [([1, 2], "major"), ([3, 4], "major")]
+
+
+@pytest.mark.asyncio
+async def test_check_endpoint_is_not_shadowed_by_appointment_route():
+    db = AsyncMock(spec=AsyncSession)
+    names = MagicMock()
+    names.all.return_value = [(1, "Coumadine 5mg"), (2, "Nurofen 200")]
+    db.execute.return_value = names
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/prescriptions/check", json={"medicament_ids": [1, 2, 2]})
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    (interaction,) = response.json()["interactions"]
+    assert interaction["medicament_ids"] == [1, 2]
+    assert interaction["severity"] == "major"
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from types import SimpleNamespace
+from services import idempotency
+from services.idempotency import REPLAYED_HEADER, idempotent
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """In-memory stand-in for the idempotency_keys table."""
+    rows = {}
+
+    async def claim(scope, key, hashed, claimed_at):
+        if (scope, key) in rows:
+            return rows[(scope, key)]
+        rows[(scope, key)] = SimpleNamespace(request_hash=hashed, status_code=None, response_body=None)
+        return None
+
+    async def finish(scope, key, claimed_at, status_code, body):
+        if status_code is None:
+            rows.pop((scope, key))
+        else:
+            rows[(scope, key)].status_code = status_code
+            rows[(scope, key)].response_body = body
+
+    monkeypatch.setattr(idempotency, "_claim", claim)
+    monkeypatch.setattr(idempotency, "_finish", finish)
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_run_the_handler_once(store):
+    calls = 0
+
+    async def handler():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"id": calls}
+
+    responses = await asyncio.gather(*(idempotent("billing", "k1", {"amount": 10}, handler) for _ in range(5)))
+    later = await idempotent("billing", "k1", {"amount": 10}, handler)
+
+    assert calls == 1
+    assert {json.loads(r.body)["id"] for r in responses} == {1}
+    assert sum(REPLAYED_HEADER.lower() in r.headers for r in responses) == 4
+    assert later.headers[REPLAYED_HEADER.lower()] == "true"
+
+
+@pytest.mark.asyncio
+async def test_reused_key_with_other_payload_is_rejected(store):
+    async def handler():
+        return {"ok": True}
+
+    await idempotent("payment", "k2", {"amount": 10}, handler)
+    with pytest.raises(HTTPException) as error:
+        await idempotent("payment", "k2", {"amount": 99}, handler)
+    assert error.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_stored_and_server_errors_release_the_key(store):
+    async def bad_request():
+        raise HTTPException(status_code=400, detail="Cart is already paid")
+
+    async def crash():
+        raise RuntimeError("database went away")
+
+    first = await idempotent("billing", "k3", {}, bad_request)
+    assert first.status_code == 400 and ("billing", "k3") in store
+
+    with pytest.raises(RuntimeError):
+        await idempotent("billing", "k4", {}, crash)
+    assert ("billing", "k4") not in store
+
+
+def session_with(db):
+    factory = MagicMock()
+    factory.return_value.__aenter__.return_value = db
+    return factory
+
+
+@pytest.mark.asyncio
+async def test_claim_takes_over_expired_and_abandoned_keys(monkeypatch):
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = MagicMock(scalar_one_or_none=MagicMock(return_value="k5"))
+    monkeypatch.setattr(idempotency, "AsyncSessionLocal", session_with(db))
+
+    assert await idempotency._claim("billing", "k5", "hash", datetime(2024, 5, 1, 12)) is None
+    sql = str(db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (scope, key) DO UPDATE SET" in sql
+    assert (
+        "WHERE idempotency_keys.expires_at < %(expires_at_1)s::TIMESTAMP WITHOUT TIME ZONE "
+        "OR idempotency_keys.status_code IS NULL AND idempotency_keys.created_at < %(created_at_1)s::TIMESTAMP WITHOUT TIME ZONE"
+    ) in sql
+
+
+@pytest.mark.asyncio
+async def test_finish_leaves_a_taken_over_claim_alone(monkeypatch):
+    row = SimpleNamespace(created_at=datetime(2024, 5, 1, 12, 5), status_code=None, response_body=None)
+    db = AsyncMock(spec=AsyncSession)
+    db.get.return_value = row
+    monkeypatch.setattr(idempotency, "AsyncSessionLocal", session_with(db))
+
+    await idempotency._finish("billing", "k6", datetime(2024, 5, 1, 12), 200, "{}")
+    await idempotency._finish("billing", "k6", datetime(2024, 5, 1, 12), None, None)
+
+    assert row.status_code is None
+    db.delete.assert_not_awaited()
+    await idempotency._finish("billing", "k6", datetime(2024, 5, 1, 12, 5), 200, "{}")
+    assert row.status_code == 200
@@ -0,0 +1,70 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from PIL import Image
+from services.image_variants import backfill, generate_variants, pick_variant
+from services.static_files import UploadStaticFiles
+
+
+def make_image(path, width=800, height=600):
+    Image.new("RGB", (width, height), color=(20, 120, 200)).save(path, "JPEG")
+    return str(path)
+
+
+def test_generate_variants_skips_upscaling(tmp_path):
+    source = make_image(tmp_path / "photo.jpg")
+    created = generate_variants(source)
+
+    names = sorted(os.path.basename(p) for p in created)
+    assert names == ["photo_w256.jpg", "photo_w256.webp", "photo_w64.jpg", "photo_w64.webp"]
+    with Image.open(tmp_path / "photo_w64.webp") as variant:
+        assert variant.size == (64, 48)
+    assert pick_variant(source, 100, accept_webp=False).endswith("photo_w256.jpg")
+    assert pick_variant(source, 2000, accept_webp=True) is None
+
+
+def test_backfill_ignores_existing_variants(tmp_path):
+    make_image(tmp_path / "a.jpg")
+    make_image(tmp_path / "b.jpg", width=100, height=100)
+    assert backfill(str(tmp_path), workers=2) == 6
+    # A second run regenerates from originals only, never from variants
+    assert backfill(str(tmp_path), workers=2) == 6
+
+
+@pytest.mark.asyncio
+async def test_static_files_serve_requested_width(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    generate_variants(make_image(uploads / "photo.jpg"))
+    app = FastAPI()
+    app.mount("/static", UploadStaticFiles(directory=str(tmp_path)), name="static")
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        webp = await ac.get("/static/uploads/photo.jpg?w=64", headers={"Accept": "image/webp,*/*"})
+        jpeg = await ac.get("/static/uploads/photo.jpg?w=64")
+        original = await ac.get("/static/uploads/photo.jpg")
+
+    assert webp.headers["content-type"] == "image/webp"
+    assert webp.headers["vary"] == "Accept"
+    assert jpeg.headers["content-type"] == "image/jpeg"
+    assert len(jpeg.content) < len(original.content)
+
+
+@pytest.mark.asyncio
+async def test_static_files_redirect_legacy_paths(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    make_image(tmp_path / "uploads" / "abc123.jpg")
+    static = UploadStaticFiles(directory=str(tmp_path))
+    static.aliases = {"uploads/old-uuid.jpg": "uploads/abc123.jpg"}
+    app = FastAPI()
+    app.mount("/static", static, name="static")
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/static/uploads/old-uuid.jpg?w=64")
+
+    assert response.status_code == 308
+    assert response.headers["location"] == "http://test/static/uploads/abc123.jpg?w=64"
@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.ext.asyncio import AsyncSession
+import main  # noqa: F401  configures every mapper
+from services.inventory import LEDGER_LOCK, LowStockTracker, compact, sell
+
+
+def rows(values):
+    result = MagicMock()
+    result.all.return_value = values
+    return result
+
+
+@pytest.mark.asyncio
+async def test_low_stock_tracker_applies_only_new_movements():
+    db = AsyncMock(spec=AsyncSession)
+    db.scalar.return_value = 40
+    db.execute.side_effect = [
+        rows([(1, 12), (2, 3), (3, 50)]),   # full reload
+        rows([(1, -4, 41), (3, -45, 43)]),  # movements after id 40
+    ]
+    tracker = LowStockTracker()
+    await tracker.refresh(db)
+    assert tracker.report(10) == [(2, 3)]
+
+    await tracker.refresh(db)
+    assert tracker.last_movement_id == 43
+    assert tracker.report(10) == [(2, 3), (3, 5), (1, 8)]
+
+
+@pytest.mark.asyncio
+async def test_sell_writes_nothing_when_a_line_is_short():
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.side_effect = [MagicMock(), rows([(1, 10), (2, 3)]), MagicMock()]
+
+    assert await sell(db, {1: 2, 2: 3}, {2: 1}, "cart:9") == [2]
+    assert db.execute.await_count == 2
+
+    db.execute.side_effect = [MagicMock(), rows([(1, 10), (2, 3)]), MagicMock(), MagicMock()]
+    assert await sell(db, {1: 2, 2: 3}, {}, "cart:9") == []
+    assert "pg_advisory_xact_lock_shared" in str(db.execute.await_args_list[-2].args[0])
+    inserted = db.execute.await_args.args[1]
+    assert sorted((row["medicament_id"], row["quantity"], row["kind"]) for row in inserted) == [(1, -2, "sale"), (2, -3, "sale")]
+
+
+@pytest.mark.asyncio
+async def test_compaction_reads_its_watermark_under_the_ledger_lock():
+    db = AsyncMock(spec=AsyncSession)
+    db.scalar.return_value = None
+
+    assert await compact(db) == 0
+    assert "pg_advisory_xact_lock(" in str(db.execute.await_args.args[0])
+    assert db.execute.await_args.args[1] == {"namespace": LEDGER_LOCK[0], "key": LEDGER_LOCK[1]}
+    # Read with no age filter, and the lock is let go before any folding
+    assert "created_at" not in str(db.scalar.await_args.args[0])
+    db.commit.assert_awaited_once()
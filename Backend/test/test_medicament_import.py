@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from services import medicament_import
+from services.medicament_import import import_medicaments
+
+CSV = (
+    "name,description,price,dosage,duration,stock,legal\r\n"
+    'Doliprane,"Antalgique,\r\nantipyrétique",2.5,1g,5 days,40,true\r\n'
+    "Broken,,abc,1g,5 days,10,true\r\n"
+    "Spasfon,,3.1,80mg,3 days,12,\r\n"
+    "Doliprane,,2.8,1g,5 days,50,true\r\n"
+).encode()
+
+
+async def chunked(data, size=7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+@pytest.fixture
+def upserted(monkeypatch):
+    batches = []
+
+    async def fake_upsert(db, rows):
+        batches.append(rows)
+        return len(rows), 0
+
+    monkeypatch.setattr(medicament_import, "_upsert_batch", fake_upsert)
+    return batches
+
+
+@pytest.mark.asyncio
+async def test_csv_rows_are_validated_and_deduplicated(upserted):
+    report = await import_medicaments(None, chunked(CSV), "csv")
+
+    rows = {row["name"]: row for row in upserted[0]}
+    assert sorted(rows) == ["Doliprane", "Spasfon"]
+    # Last occurrence wins, quoted newlines stay inside the field
+    assert rows["Doliprane"]["price"] == 2.8
+    assert rows["Spasfon"]["legal"] is True
+    assert report.inserted == 2
+    assert report.failed == 1
+    assert report.errors[0]["row"] == 4
+    assert report.errors[0]["name"] == "Broken"
+    assert report.errors[0]["errors"][0].startswith("price")
+
+
+@pytest.mark.asyncio
+async def test_ndjson_reports_bad_lines_and_batches(upserted, monkeypatch):
+    monkeypatch.setattr(medicament_import, "BATCH_SIZE", 2)
+    lines = [
+        '{"name": "A", "dosage": "1", "duration": "1", "stock": 1}',
+        "not json",
+        '["list"]',
+        '{"name": "B", "dosage": "1", "duration": "1", "stock": 2}',
+        '{"name": "C", "dosage": "1", "duration": "1"}',
+    ]
+    report = await import_medicaments(None, chunked("\n".join(lines).encode()), "ndjson")
+
+    assert [[row["name"] for row in batch] for batch in upserted] == [["A"], ["B"]]
+    assert [error["row"] for error in report.errors] == [2, 3, 5]
+    assert report.as_dict()["errors_truncated"] is False
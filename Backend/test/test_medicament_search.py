@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.medicament_search import MedicamentIndex
+
+
+def row(item_id, name, description=None, price=5.0, stock=10, legal=True):
+    return {
+        "id": item_id, "name": name, "description": description, "price": price, "image": None,
+        "dosage": "1/day", "duration": "7 days", "stock": stock, "legal": legal,
+    }
+
+
+INDEX = MedicamentIndex.build([
+    row(1, "Paracétamol 500mg", "Antalgique et antipyrétique"),
+    row(2, "Paracetamol Codeine", "Antalgique opioïde", price=12.0, legal=False),
+    row(3, "Ibuprofène 400mg", "Anti-inflammatoire", stock=0),
+    row(4, "Amoxicilline", "Antibiotique, traite la para-typhoïde", price=8.5),
+])
+
+
+def names(items):
+    return [item["name"] for item in items]
+
+
+def test_prefix_matches_rank_name_before_description():
+    total, items = INDEX.search("para")
+    assert total == 3
+    assert names(items)[-1] == "Amoxicilline"
+
+
+def test_typos_still_match():
+    _, items = INDEX.search("ibuprofne")
+    assert names(items) == ["Ibuprofène 400mg"]
+    _, items = INDEX.search("paracetamoll")
+    assert set(names(items)) == {"Paracétamol 500mg", "Paracetamol Codeine"}
+
+
+def test_all_terms_must_match():
+    _, items = INDEX.search("paracetamol codeine")
+    assert names(items) == ["Paracetamol Codeine"]
+
+
+def test_filters_and_pagination():
+    assert INDEX.search("", in_stock=False)[1][0]["id"] == 3
+    assert names(INDEX.search("para", legal=False)[1]) == ["Paracetamol Codeine"]
+    assert INDEX.search("", min_price=6, max_price=10)[0] == 1
+    total, page = INDEX.search("", limit=2, offset=2)
+    assert total == 4 and len(page) == 2
@@ -0,0 +1,140 @@
+import json
+from datetime import date
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from main import app
+from models.billing import Billing
+from services import payment_events
+from services.payment_gateway import FakeGateway, get_gateway, set_gateway
+
+
+def result(scalar=None):
+    mock = MagicMock()
+    mock.scalar_one_or_none.return_value = scalar
+    return mock
+
+
+def succeeded_event(cart_id=7):
+    return {
+        "id": "evt_1",
+        "type": payment_events.SUCCEEDED,
+        "data": {"object": {
+            "id": "pi_1", "amount": 2500, "amount_received": 2500, "created": 1700000000,
+            "payment_method_types": ["card"], "metadata": {"cart_id": str(cart_id)},
+        }},
+    }
+
+
+@pytest.fixture
+def gateway():
+    previous = get_gateway()
+    fake = FakeGateway()
+    set_gateway(fake)
+    yield fake
+    set_gateway(previous)
+
+
+@pytest.fixture
+def db():
+    session = AsyncMock(spec=AsyncSession)
+    app.dependency_overrides[get_db] = lambda: session
+    yield session
+    app.dependency_overrides.pop(get_db, None)
+
+
+@pytest.mark.asyncio
+async def test_webhook_stores_verified_event_once(gateway, db):
+    body = json.dumps(succeeded_event()).encode()
+    db.execute.side_effect = [result(scalar="evt_1"), result(scalar=None)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        first = await ac.post("/payment/webhook", content=body, headers={"Stripe-Signature": gateway.sign(body)})
+        again = await ac.post("/payment/webhook", content=body, headers={"Stripe-Signature": gateway.sign(body)})
+
+    assert first.json() == {"received": True, "duplicate": False}
+    assert again.json() == {"received": True, "duplicate": True}
+    assert "ON CONFLICT" in str(db.execute.await_args_list[0].args[0].compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_bad_signature(gateway, db):
+    body = json.dumps(succeeded_event()).encode()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        forged = await ac.post("/payment/webhook", content=body, headers={"Stripe-Signature": gateway.sign(b"{}")})
+        unsigned = await ac.post("/payment/webhook", content=body)
+
+    assert forged.status_code == 400
+    assert unsigned.status_code == 400
+    db.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_succeeded_payment_settles_cart_and_records_billing():
+    db = AsyncMock(spec=AsyncSession)
+    db.add = MagicMock()
+    cart = SimpleNamespace(id=7, is_paid=False, total_price=25.0)
+    db.get.return_value = cart
+    with patch.object(payment_events, "settle_cart", AsyncMock()) as settle:
+        note = await payment_events._settle_payment(db, succeeded_event()["data"]["object"])
+
+    assert note is None
+    settle.assert_awaited_once_with(db, cart, "card", date(2023, 11, 14))
+    billing = db.add.call_args.args[0]
+    assert isinstance(billing, Billing)
+    assert (billing.order_id, billing.cart_id, billing.amount) == ("pi_1", 7, 25.0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("received, currency", [(1, "usd"), (2499, "usd"), (2500, "eur")])
+async def test_payment_short_of_the_cart_total_is_refused(received, currency):
+    db = AsyncMock(spec=AsyncSession)
+    db.add = MagicMock()
+    db.get.return_value = SimpleNamespace(id=7, is_paid=False, total_price=25.0)
+    intent = dict(succeeded_event()["data"]["object"], amount_received=received, currency=currency)
+    with patch.object(payment_events, "settle_cart", AsyncMock()) as settle:
+        with pytest.raises(HTTPException) as error:
+            await payment_events._settle_payment(db, intent)
+
+    assert error.value.status_code == 402
+    assert error.value.detail == f"Payment of {received} {currency} does not cover cart 7 (2500 usd)"
+    settle.assert_not_awaited()
+    db.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_already_paid_cart_is_left_alone():
+    db = AsyncMock(spec=AsyncSession)
+    db.get.return_value = SimpleNamespace(id=7, is_paid=True)
+    with patch.object(payment_events, "settle_cart", AsyncMock()) as settle:
+        note = await payment_events._settle_payment(db, succeeded_event()["data"]["object"])
+
+    assert note == "cart 7 already paid"
+    settle.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_refused_settlement_is_parked_with_its_reason():
+    row = SimpleNamespace(id="evt_1", type=payment_events.SUCCEEDED, payload=json.dumps(succeeded_event()),
+                          processed_at=None, attempts=0, error=None)
+    db = AsyncMock(spec=AsyncSession)
+    db.execute.return_value = result(scalar=row)
+    db.get.return_value = row
+    session = MagicMock()
+    session.return_value.__aenter__.return_value = db
+    refusal = HTTPException(status_code=409, detail="Insufficient stock for: Spasfon (available 0)")
+    with patch.object(payment_events, "AsyncSessionLocal", session), \
+            patch.dict(payment_events.HANDLERS, {payment_events.SUCCEEDED: AsyncMock(side_effect=refusal)}):
+        assert await payment_events._apply("evt_1")
+
+    db.rollback.assert_awaited_once()
+    assert row.processed_at is not None
+    assert row.error == "409: Insufficient stock for: Spasfon (available 0)"
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import stripe
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+from main import app
+from services.payment_gateway import FakeGateway, PaymentGateway, StripeGateway, get_gateway, set_gateway
+
+NOVEMBER = (datetime(2023, 11, 1), datetime(2023, 12, 1))
+
+
+@pytest.fixture
+def fake_gateway():
+    previous = get_gateway()
+    gateway = FakeGateway()
+    set_gateway(gateway)
+    yield gateway
+    set_gateway(previous)
+
+
+@pytest.mark.asyncio
+async def test_create_payment_through_fake_gateway(fake_gateway):
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post("/payment/createPayment", json={"amount": 2500})
+
+    assert response.status_code == 200
+    (intent,) = fake_gateway.intents.values()
+    assert response.json() == {"clientSecret": intent.client_secret}
+    assert intent.amount == 2500
+
+
+@pytest.mark.asyncio
+async def test_fake_gateway_reuses_intent_for_same_idempotency_key():
+    gateway = FakeGateway()
+    first = await gateway.create_payment_intent(1000, idempotency_key="k1")
+    again = await gateway.create_payment_intent(1000, idempotency_key="k1")
+    other = await gateway.create_payment_intent(1000, idempotency_key="k2")
+
+    assert first is again
+    assert other.id != first.id
+    assert (await gateway.retrieve_payment_intent(first.id)) is first
+
+
+def test_gateways_must_implement_every_call():
+    class Partial(PaymentGateway):
+        async def create_payment_intent(self, amount, currency="usd", idempotency_key=None, metadata=None):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.mark.asyncio
+async def test_fake_gateway_pages_intents_and_rejects_unknown_cursors():
+    gateway = FakeGateway()
+    intents = [await gateway.create_payment_intent(100 * n) for n in range(1, 4)]
+    for created, intent in enumerate(intents):
+        intent.created = 1700000000 + created
+
+    page, more = await gateway.list_payment_intents(*NOVEMBER, limit=2)
+    assert [intent.id for intent in page] == [intents[2].id, intents[1].id] and more
+    page, more = await gateway.list_payment_intents(*NOVEMBER, starting_after=page[-1].id, limit=2)
+    assert [intent.id for intent in page] == [intents[0].id] and not more
+
+    with pytest.raises(HTTPException) as error:
+        await gateway.list_payment_intents(*NOVEMBER, starting_after="pi_gone")
+    assert (error.value.status_code, error.value.detail) == (400, "No such payment_intent: pi_gone")
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_do_not_block_each_other():
+    gateway = FakeGateway(latency=0.1)
+    started = time.perf_counter()
+    await asyncio.gather(*(gateway.create_payment_intent(100) for _ in range(10)))
+    assert time.perf_counter() - started < 0.5
+
+
+@pytest.mark.asyncio
+async def test_stripe_gateway_runs_sdk_off_the_loop_and_maps_errors():
+    gateway = StripeGateway(timeout=0.05)
+    with patch("stripe.PaymentIntent.create") as create:
+        create.return_value = MagicMock(client_secret="pi_1_secret", metadata={})
+        intent = await gateway.create_payment_intent(500, idempotency_key="abc")
+        create.assert_called_once_with(amount=500, currency="usd", payment_method_types=["card"], idempotency_key="abc")
+        assert intent.client_secret == "pi_1_secret"
+
+        create.side_effect = stripe.error.APIConnectionError("down")
+        with pytest.raises(HTTPException) as error:
+            await gateway.create_payment_intent(500)
+        assert error.value.status_code == 502
+
+        create.side_effect = lambda **kwargs: time.sleep(1)
+        with pytest.raises(HTTPException) as error:
+            await gateway.create_payment_intent(500)
+        assert error.value.status_code == 504
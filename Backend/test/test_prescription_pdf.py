@@ -0,0 +1,96 @@
+import asyncio
+import os
+import re
+import sys
+import zlib
+from unittest.mock import AsyncMock, patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from httpx import ASGITransport, AsyncClient
+from main import app
+from services import prescription_pdf
+
+DOCUMENT = {
+    "doctor": {"name": "Amine Dhahbi", "grade": "Dentiste", "adresse": "1 rue (centre)", "ville": "Tunis"},
+    "patient": "Sami Ben Ali",
+    "date": "01/05/2024",
+    "content": "Prendre deux fois par jour après les repas. " * 30,
+    "medications": [{"name": "Doliprane 1000mg", "dosage": "1 cp", "duration": "5 jours"}] * 45,
+}
+
+
+def page_text(pdf: bytes) -> bytes:
+    return b"".join(zlib.decompress(stream) for stream in re.findall(rb">>\nstream\n(.*?)\nendstream", pdf, re.S))
+
+
+def test_render_is_a_deterministic_multi_page_pdf():
+    pdf = prescription_pdf.render_pdf(DOCUMENT)
+
+    assert pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n")
+    assert pdf == prescription_pdf.render_pdf(DOCUMENT)
+    text = page_text(pdf)
+    assert b"(MEDICAL PRESCRIPTION)" in text
+    assert b"(1 rue \\(centre\\))" in text
+    assert "après".encode("cp1252") in text
+    assert b"(Page 2 of 2)" in text
+    # xref offsets point at their objects
+    xref = int(pdf.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+    first = pdf[xref:].split(b"\n")[3]
+    assert pdf[int(first[:10]):].startswith(b"1 0 obj")
+
+
+def test_text_outside_cp1252_prints_as_question_marks():
+    # Documented limitation of the built-in fonts
+    text = page_text(prescription_pdf.render_pdf(dict(DOCUMENT, patient="سامي بن علي")))
+    assert b"(???? ?? ???)" in text
+
+
+def test_shutdown_stops_the_render_pool():
+    pool = prescription_pdf._get_pool()
+    prescription_pdf.shutdown_pool()
+
+    assert prescription_pdf._pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(len, "")
+    prescription_pdf.shutdown_pool()
+
+
+def test_wrap_keeps_lines_within_width():
+    lines = prescription_pdf.wrap("word " * 50 + "x" * 200, 200, 10)
+    assert all(prescription_pdf.text_width(line, 10) <= 200 for line in lines)
+    assert "".join(lines).replace(" ", "") == ("word" * 50) + "x" * 200
+
+
+@pytest.mark.asyncio
+async def test_same_content_renders_once():
+    prescription_pdf._cache.clear()
+    calls = []
+
+    def fake_render(document):
+        calls.append(document)
+        return b"%PDF-fake"
+
+    with patch.object(prescription_pdf, "_get_pool", return_value=None), patch.object(prescription_pdf, "render_pdf", fake_render):
+        results = await asyncio.gather(*(prescription_pdf.prescription_pdf(DOCUMENT) for _ in range(5)))
+        again = await prescription_pdf.prescription_pdf(dict(DOCUMENT))
+
+    assert results == [b"%PDF-fake"] * 5 and again == b"%PDF-fake"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_pdf_endpoint_answers_if_none_match_without_rendering():
+    etag = f'"{prescription_pdf.document_hash(DOCUMENT)}"'
+    with patch("routes.prescription_router.load_pdf_document", AsyncMock(return_value=DOCUMENT)), \
+            patch("routes.prescription_router.prescription_pdf", AsyncMock(return_value=b"%PDF-1.4 test")) as render:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            first = await ac.get("/prescriptions/384/pdf")
+            cached = await ac.get("/prescriptions/384/pdf", headers={"If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/pdf"
+    assert first.headers["etag"] == etag
+    assert first.content == b"%PDF-1.4 test"
+    assert cached.status_code == 304
+    render.assert_awaited_once()
@@ -0,0 +1,123 @@
+import os
+import sys
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+import main  # noqa: F401  configures every mapper
+from models.appointments import Appointment
+from models.medicaments import Medicament
+from models.prescription import Prescription
+from models.prescription_medicament import prescription_medicament
+from services import prescriptions
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync: Prescription.metadata.create_all(sync, tables=[
+            Appointment.__table__, Medicament.__table__, Prescription.__table__, prescription_medicament,
+        ]))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as db:
+        for i in (1, 2, 3):
+            db.add(Medicament(id=i, name=f"Med {i}", price=1.0, dosage="1", duration="1", stock=1))
+        for i in range(1, 6):
+            db.add(Appointment(id=i, patient_id=10 + i % 2, medecin_id=20 + i % 2, date=datetime(2024, 1, i), status="done"))
+            db.add(Prescription(id=i, appointment_id=i, content=f"p{i}"))
+        await db.flush()
+        await db.execute(prescription_medicament.insert(), [
+            {"prescription_id": i, "medicament_id": m} for i in range(1, 6) for m in (1, 2, 3)[: 1 + i % 3]
+        ])
+        await db.commit()
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    yield factory, statements
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_each_page_costs_two_statements(session_factory):
+    factory, statements = session_factory
+    pages = []
+    cursor = None
+    async with factory() as db:
+        while True:
+            statements.clear()
+            page, cursor = await prescriptions.prescription_page(db, [], 2, cursor)
+            assert len(statements) == 2
+            pages.append([(p.id, p.medicament_ids) for p in page])
+            if cursor is None:
+                break
+    assert pages == [
+        [(5, [1, 2, 3]), (4, [1, 2])],
+        [(3, [1]), (2, [1, 2, 3])],
+        [(1, [1, 2])],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_filters_on_doctor_patient_and_date(session_factory):
+    factory, _ = session_factory
+    criteria = prescriptions.prescription_filters(medecin_id=21, date_from=datetime(2024, 1, 2), date_to=datetime(2024, 1, 5))
+    async with factory() as db:
+        page, cursor = await prescriptions.prescription_page(db, criteria, 10)
+        by_patient, _ = await prescriptions.prescription_page(db, prescriptions.prescription_filters(patient_id=10), 10)
+
+    assert [p.id for p in page] == [3]
+    assert cursor is None
+    assert [p.id for p in by_patient] == [4, 2]
+
+
+@pytest.mark.asyncio
+async def test_bad_cursor_is_rejected(session_factory):
+    factory, _ = session_factory
+    async with factory() as db:
+        with pytest.raises(HTTPException) as error:
+            await prescriptions.prescription_page(db, [], 10, "abc")
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_save_validates_every_id_in_one_query():
+    db = AsyncMock(spec=AsyncSession)
+    found = MagicMock()
+    found.all.return_value = [(10, "Doliprane")]
+    db.execute.return_value = found
+
+    with pytest.raises(HTTPException) as error:
+        await prescriptions.save_prescription(db, 1, "x", [10, 999, 1000, 999])
+
+    assert error.value.status_code == 400
+    assert error.value.detail == "Some medicaments not found: 999, 1000"
+    assert db.execute.await_count == 1
+    db.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_save_upserts_and_replaces_lines_in_one_transaction():
+    db = AsyncMock(spec=AsyncSession)
+    found = MagicMock()
+    found.all.return_value = [(11, "Spasfon"), (10, "Doliprane")]
+    upserted = MagicMock()
+    upserted.scalar_one.return_value = 7
+    db.execute.side_effect = [found, upserted, MagicMock(), MagicMock()]
+
+    saved = await prescriptions.save_prescription(db, 384, "Twice daily", [11, 10, 11])
+
+    assert db.execute.await_count == 4
+    upsert = str(db.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (appointment_id) DO UPDATE SET content = excluded.content RETURNING prescriptions.id" in upsert
+    lines = db.execute.await_args_list[3].args[1]
+    assert lines == [{"prescription_id": 7, "medicament_id": 11}, {"prescription_id": 7, "medicament_id": 10}]
+    db.commit.assert_awaited_once()
+    assert saved.id == 7 and saved.medicament_ids == [10, 11]
+    assert [m.name for m in saved.medicaments] == ["Doliprane", "Spasfon"]
@@ -0,0 +1,120 @@
+import calendar
+import os
+import sys
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+import main  # noqa: F401  configures every mapper
+from models.billing import Billing
+from models.Carts import Cart
+from models.stock_reservations import StockReservation
+from services import reconciliation
+from services.payment_gateway import FakeGateway
+
+MAY = (datetime(2024, 5, 1), datetime(2024, 6, 1))
+
+
+def at(day):
+    return calendar.timegm(datetime(2024, 5, day).timetuple())
+
+
+@pytest_asyncio.fixture
+async def setup(monkeypatch):
+    monkeypatch.setattr(reconciliation, "PAGE_SIZE", 2)
+    gateway = FakeGateway()
+    intents = [await gateway.create_payment_intent(amount) for amount in (1000, 2000, 3000, 4000, 5000)]
+    for intent, day in zip(intents, (2, 3, 4, 5, 6)):
+        intent.created = at(day)
+    for intent in intents[:4]:
+        gateway.confirm(intent.id)
+    gateway.confirm(intents[4].id, "canceled")
+    ok, unpaid_cart, wrong_amount, unbilled, canceled = intents
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync: Billing.metadata.create_all(
+            sync, tables=[Cart.__table__, Billing.__table__, StockReservation.__table__]
+        ))
+        # Repairs read the (empty) cart lines; SQLite can't create the model's composite autoincrement key
+        await conn.execute(text("CREATE TABLE cart_item (cart_id INTEGER, medicament_id INTEGER, quantity INTEGER, unit_price FLOAT)"))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as db:
+        for cart_id, paid in ((1, True), (2, False), (3, True), (4, True), (5, True)):
+            db.add(Cart(id=cart_id, total_price=0.0, is_paid=paid))
+        db.add_all([
+            Billing(id=1, order_id=ok.id, cart_id=1, amount=10.0, payment_method="card", date=datetime(2024, 5, 2)),
+            Billing(id=2, order_id=unpaid_cart.id, cart_id=2, amount=20.0, payment_method="card", date=datetime(2024, 5, 3)),
+            Billing(id=3, order_id=wrong_amount.id, cart_id=3, amount=35.0, payment_method="card", date=datetime(2024, 5, 4)),
+            Billing(id=4, order_id=canceled.id, cart_id=4, amount=50.0, payment_method="card", date=datetime(2024, 5, 6)),
+            Billing(id=5, order_id="pi_unknown", cart_id=5, amount=9.0, payment_method="card", date=datetime(2024, 5, 7)),
+            Billing(id=6, order_id=ok.id, cart_id=None, amount=10.0, payment_method="card", date=datetime(2024, 5, 2)),
+            Billing(id=7, order_id="cash-7", cart_id=None, amount=5.0, payment_method="cash", date=datetime(2024, 5, 8)),
+        ])
+        await db.commit()
+    yield gateway, factory, unbilled
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_merge_join_reports_every_kind_of_mismatch(setup):
+    gateway, factory, unbilled = setup
+    async with factory() as db:
+        report = await reconciliation.reconcile(db, *MAY, gateway=gateway)
+
+    assert (report.intents, report.billings, report.matched) == (5, 6, 1)
+    assert report.mismatches == {
+        "cart_not_marked_paid": 1, "amount_mismatch": 1, "unbilled_payment": 1,
+        "billing_without_payment": 1, "unknown_intent": 1, "duplicate_billing": 1,
+    }
+    assert {"kind": "unbilled_payment", "intent_id": unbilled.id, "amount": 40.0} in report.details
+    assert report.repaired == 0
+
+
+@pytest.mark.asyncio
+async def test_repair_fixes_cart_paid_flags(setup):
+    gateway, factory, _ = setup
+    async with factory() as db:
+        report = await reconciliation.reconcile(db, *MAY, repair=True, gateway=gateway)
+    async with factory() as db:
+        carts = {cart.id: cart.is_paid for cart in await db.run_sync(lambda s: s.query(Cart).all())}
+
+    assert report.repaired == 2
+    assert carts == {1: True, 2: True, 3: True, 4: False, 5: True}
+
+
+@pytest.mark.asyncio
+async def test_repairs_go_through_checkout_and_report_refusals(setup, monkeypatch):
+    gateway, factory, _ = setup
+    calls = []
+
+    async def settle(db, cart, payment_method, day):
+        calls.append(("settle", cart.id, payment_method, day))
+        raise HTTPException(status_code=409, detail="Insufficient stock for: Spasfon (available 0)")
+
+    async def unsettle(db, cart):
+        calls.append(("unsettle", cart.id))
+
+    monkeypatch.setattr(reconciliation, "settle_cart", settle)
+    monkeypatch.setattr(reconciliation, "unsettle_cart", unsettle)
+    async with factory() as db:
+        report = await reconciliation.reconcile(db, *MAY, repair=True, gateway=gateway)
+
+    assert report.repaired == 1
+    assert sorted(calls) == [("settle", 2, "card", date(2024, 5, 3)), ("unsettle", 4)]
+    assert report.mismatches["repair_refused"] == 1
+    assert {"kind": "repair_refused", "cart_id": 2, "reason": "409: Insufficient stock for: Spasfon (available 0)"} in report.details
+
+
+def test_postgres_sorts_ids_by_bytes():
+    db = MagicMock()
+    db.bind.dialect.name = "postgresql"
+    query = select(Billing.order_id).order_by(reconciliation._byte_order(db, Billing.order_id))
+    assert 'ORDER BY billing.order_id COLLATE "C"' in str(query.compile(dialect=postgresql.dialect()))
@@ -0,0 +1,87 @@
+import os
+import sys
+from datetime import date, datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from main import app
+from services import sales
+
+
+def compiled(db, call=0):
+    return str(db.execute.await_args_list[call].args[0].compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_record_sale_adds_cart_lines_to_rollups_in_one_statement():
+    db = AsyncMock(spec=AsyncSession)
+    await sales.record_sale(db, 7, "card", date(2024, 3, 1))
+
+    assert db.execute.await_count == 2
+    assert compiled(db, 0).startswith("UPDATE cart_item SET unit_price=medicaments.price FROM medicaments")
+    sql = compiled(db, 1)
+    assert "sum(cart_item.quantity * coalesce(cart_item.unit_price, medicaments.price," in sql
+    assert sql.startswith("INSERT INTO sales_rollups (day, medicament_id, payment_method, units, revenue) SELECT")
+    assert "GROUP BY cart_item.medicament_id" in sql
+    assert "units = (sales_rollups.units + excluded.units)" in sql
+    assert "revenue = (sales_rollups.revenue + excluded.revenue)" in sql
+
+
+@pytest.mark.asyncio
+async def test_reverse_sale_subtracts_under_the_billing_day_and_method():
+    db = AsyncMock(spec=AsyncSession)
+    billed = MagicMock()
+    billed.first.return_value = SimpleNamespace(date=datetime(2024, 3, 1, 15, 30), payment_method="card")
+    db.execute.side_effect = [billed, MagicMock()]
+
+    await sales.reverse_sale(db, 7, sold_at=datetime(2024, 3, 9))
+
+    upsert = db.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect())
+    assert "-sum(cart_item.quantity)" in str(upsert)
+    assert "-sum(cart_item.quantity * coalesce(cart_item.unit_price," in str(upsert)
+    assert date(2024, 3, 1) in upsert.params.values() and "card" in upsert.params.values()
+
+
+@pytest.mark.asyncio
+async def test_backfill_rebuilds_rollups_in_one_transaction():
+    db = AsyncMock(spec=AsyncSession)
+    inserted = MagicMock()
+    inserted.all.return_value = [(date(2024, 3, 1),)] * 3
+    db.execute.side_effect = [MagicMock(), inserted]
+
+    assert await sales.backfill(db) == 3
+    assert compiled(db, 0) == "DELETE FROM sales_rollups"
+    assert "carts.is_paid = true" in compiled(db, 1)
+    # Same prices as checkout recorded, not today's
+    assert "coalesce(cart_item.unit_price, medicaments.price," in compiled(db, 1)
+    db.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_sales_endpoint_reads_rollups_only():
+    db = AsyncMock(spec=AsyncSession)
+    row = SimpleNamespace(
+        _mapping={"period": date(2024, 3, 1), "payment_method": "card", "units": 5, "revenue": 42.5},
+        units=5, revenue=42.5,
+    )
+    db.execute.return_value = [row]
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get("/stats/sales", params={"granularity": "month", "by": "payment_method"})
+            invalid = await ac.get("/stats/sales", params={"granularity": "hour"})
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    assert response.json() == [{"period": "2024-03-01", "payment_method": "card", "units": 5, "revenue": 42.5}]
+    assert invalid.status_code == 422
+    sql = compiled(db)
+    assert "FROM sales_rollups" in sql and "JOIN" not in sql
+    assert "date_trunc(" in sql and "sales_rollups.day)" in sql
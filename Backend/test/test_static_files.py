@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from services.static_files import IMMUTABLE_CACHE, REVALIDATE_CACHE, UploadStaticFiles, precompress
+
+CONTENT = b"\xff\xd8\xff" + bytes(range(256)) * 8
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg">' + b"<rect/>" * 200 + b"</svg>"
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    (uploads / f"{CONTENT_HASH}.jpg").write_bytes(CONTENT)
+    (uploads / "default.jpg").write_bytes(CONTENT)
+    (tmp_path / "logo.svg").write_bytes(SVG)
+    return tmp_path
+
+
+def client_for(directory):
+    app = FastAPI()
+    app.mount("/static", UploadStaticFiles(directory=str(directory)), name="static")
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_hashed_upload_is_immutable_and_revalidates(static_dir):
+    async with client_for(static_dir) as ac:
+        first = await ac.get(f"/static/uploads/{CONTENT_HASH}.jpg")
+        cached = await ac.get(f"/static/uploads/{CONTENT_HASH}.jpg", headers={"If-None-Match": first.headers["etag"]})
+
+    assert first.headers["etag"] == f'"{CONTENT_HASH}.jpg"'
+    assert first.headers["cache-control"] == IMMUTABLE_CACHE
+    assert cached.status_code == 304
+    assert cached.headers["cache-control"] == IMMUTABLE_CACHE
+    assert cached.content == b""
+
+
+@pytest.mark.asyncio
+async def test_variants_of_one_width_in_two_formats_have_different_etags(static_dir):
+    (static_dir / "uploads" / f"{CONTENT_HASH}_w320.jpg").write_bytes(CONTENT)
+    (static_dir / "uploads" / f"{CONTENT_HASH}_w320.webp").write_bytes(CONTENT)
+    async with client_for(static_dir) as ac:
+        jpeg = await ac.get(f"/static/uploads/{CONTENT_HASH}_w320.jpg")
+        webp = await ac.get(f"/static/uploads/{CONTENT_HASH}_w320.webp", headers={"If-None-Match": jpeg.headers["etag"]})
+
+    assert jpeg.headers["etag"] == f'"{CONTENT_HASH}_w320.jpg"'
+    assert webp.status_code == 200
+    assert webp.headers["etag"] == f'"{CONTENT_HASH}_w320.webp"'
+
+
+@pytest.mark.asyncio
+async def test_other_files_get_content_etag_and_must_revalidate(static_dir):
+    async with client_for(static_dir) as ac:
+        response = await ac.get("/static/uploads/default.jpg")
+
+    assert response.headers["etag"] == f'"{CONTENT_HASH}"'
+    assert response.headers["cache-control"] == REVALIDATE_CACHE
+
+
+@pytest.mark.asyncio
+async def test_range_requests_are_honoured(static_dir):
+    async with client_for(static_dir) as ac:
+        response = await ac.get(f"/static/uploads/{CONTENT_HASH}.jpg", headers={"Range": "bytes=0-9"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[:10]
+
+
+@pytest.mark.asyncio
+async def test_precompressed_sibling_served_when_accepted(static_dir):
+    assert precompress(str(static_dir)) == 1
+    async with client_for(static_dir) as ac:
+        compressed = await ac.get("/static/logo.svg", headers={"Accept-Encoding": "gzip"})
+        plain = await ac.get("/static/logo.svg", headers={"Accept-Encoding": "identity"})
+
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["content-type"].startswith("image/svg+xml")
+    assert "Accept-Encoding" in compressed.headers["vary"]
+    assert compressed.content == SVG  # httpx decodes the gzip body
+    assert int(compressed.headers["content-length"]) == len(gzip.compress(SVG, compresslevel=9, mtime=0))
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["etag"] != plain.headers["etag"]
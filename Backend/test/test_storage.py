@@ -0,0 +1,161 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from services.static_files import UploadStaticFiles
+from services.storage import (
+    IMMUTABLE_CACHE, LocalStorage, S3Storage, StorageBackend, get_storage, migrate_local_files, set_storage,
+)
+
+
+class RemoteStorage(LocalStorage):
+    """LocalStorage pretending to be a bucket, to exercise the remote code paths."""
+
+    is_local = False
+
+    async def download_url(self, key, expires_in=3600):
+        return f"https://bucket.example/{key}?expires={expires_in}"
+
+
+@pytest.fixture
+def remote(tmp_path):
+    previous = get_storage()
+    storage = RemoteStorage(str(tmp_path / "bucket"))
+    set_storage(storage)
+    yield storage
+    set_storage(previous)
+
+
+@pytest.mark.asyncio
+async def test_migrate_copies_missing_files_only(tmp_path):
+    source = LocalStorage(str(tmp_path / "static"))
+    target = LocalStorage(str(tmp_path / "bucket"))
+    os.makedirs(source.local_path("uploads/medicaments"))
+    for key in ("uploads/a.jpg", "uploads/medicaments/b.png"):
+        with open(source.local_path(key), "wb") as f:
+            f.write(key.encode() * 1000)
+    with open(source.local_path("uploads/c.jpg.part"), "wb") as f:
+        f.write(b"partial")
+
+    assert await migrate_local_files(source, target, concurrency=2) == 2
+    assert await migrate_local_files(source, target, concurrency=2) == 0
+    with open(target.local_path("uploads/medicaments/b.png"), "rb") as f:
+        assert f.read() == b"uploads/medicaments/b.png" * 1000
+    assert not await target.exists("uploads/c.jpg.part")
+
+
+@pytest.mark.asyncio
+async def test_remote_uploads_redirect_to_presigned_url(tmp_path, remote):
+    await remote.put_stream("uploads/abc.jpg", _chunks(b"original"), "image/jpeg")
+    await remote.put_stream("uploads/abc_w256.webp", _chunks(b"variant"), "image/webp")
+    app = FastAPI()
+    app.mount("/static", UploadStaticFiles(directory=str(tmp_path)), name="static")
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        original = await ac.get("/static/uploads/abc.jpg")
+        variant = await ac.get("/static/uploads/abc.jpg?w=200", headers={"Accept": "image/webp"})
+        missing = await ac.get("/static/uploads/nope.jpg")
+
+    assert original.status_code == 307
+    assert original.headers["location"] == "https://bucket.example/uploads/abc.jpg?expires=3600"
+    assert original.headers["cache-control"].startswith("private")
+    assert variant.headers["location"].startswith("https://bucket.example/uploads/abc_w256.webp")
+    assert variant.headers["vary"] == "Accept"
+    assert missing.status_code == 404
+
+
+async def _chunks(data):
+    yield data
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    pytest.importorskip("boto3")
+    from botocore.stub import Stubber
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    storage = S3Storage("uploads-bucket", endpoint_url="http://minio.local:9000", region="us-east-1", max_workers=2)
+    with Stubber(storage.client) as stubber:
+        yield storage, stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+@pytest.mark.asyncio
+async def test_s3_put_stream_uploads_with_type_and_immutable_cache(s3):
+    from botocore.stub import ANY
+
+    storage, stubber = s3
+    stubber.add_response("put_object", {}, {
+        "Bucket": "uploads-bucket", "Key": "uploads/abc.jpg", "Body": ANY,
+        "ContentType": "image/jpeg", "CacheControl": IMMUTABLE_CACHE, "ChecksumAlgorithm": ANY,
+    })
+    await storage.put_stream("uploads/abc.jpg", _chunks(b"original"), "image/jpeg")
+
+
+@pytest.mark.asyncio
+async def test_s3_put_file_uploads_then_removes_the_temp_file(s3, tmp_path):
+    from botocore.stub import ANY
+
+    storage, stubber = s3
+    temp = tmp_path / "upload.tmp"
+    temp.write_bytes(b"original")
+    stubber.add_response("put_object", {}, {
+        "Bucket": "uploads-bucket", "Key": "uploads/abc.png", "Body": ANY,
+        "ContentType": "image/png", "CacheControl": IMMUTABLE_CACHE, "ChecksumAlgorithm": ANY,
+    })
+    await storage.put_file("uploads/abc.png", str(temp), "image/png")
+
+    assert not temp.exists()
+
+
+@pytest.mark.asyncio
+async def test_s3_open_stream_reads_the_object_in_chunks(s3, monkeypatch):
+    import io
+    from botocore.response import StreamingBody
+    from services import storage as storage_module
+
+    storage, stubber = s3
+    monkeypatch.setattr(storage_module, "CHUNK_SIZE", 4)
+    stubber.add_response(
+        "get_object",
+        {"Body": StreamingBody(io.BytesIO(b"0123456789"), 10)},
+        {"Bucket": "uploads-bucket", "Key": "uploads/abc.jpg"},
+    )
+
+    assert [chunk async for chunk in storage.open_stream("uploads/abc.jpg")] == [b"0123", b"4567", b"89"]
+
+
+@pytest.mark.asyncio
+async def test_s3_exists_maps_404_to_false_and_raises_other_errors(s3):
+    from botocore.exceptions import ClientError
+
+    storage, stubber = s3
+    key = {"Bucket": "uploads-bucket", "Key": "uploads/abc.jpg"}
+    stubber.add_response("head_object", {}, key)
+    stubber.add_client_error("head_object", service_error_code="404", http_status_code=404, expected_params=key)
+    stubber.add_client_error("head_object", service_error_code="403", http_status_code=403, expected_params=key)
+
+    assert await storage.exists("uploads/abc.jpg")
+    assert not await storage.exists("uploads/abc.jpg")
+    with pytest.raises(ClientError):
+        await storage.exists("uploads/abc.jpg")
+
+
+@pytest.mark.asyncio
+async def test_s3_delete_and_presigned_url(s3):
+    storage, stubber = s3
+    stubber.add_response("delete_object", {}, {"Bucket": "uploads-bucket", "Key": "uploads/abc.jpg"})
+    await storage.delete("uploads/abc.jpg")
+
+    url = await storage.download_url("uploads/abc.jpg", expires_in=600)
+    assert url.startswith("http://minio.local:9000/uploads-bucket/uploads/abc.jpg?")
+    assert "Signature=" in url
@@ -0,0 +1,127 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex
+import main  # noqa: F401  configures every mapper
+from models.appointments import Appointment
+from models.prescription import Prescription
+from services.text_search import search_history
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda sync: Appointment.metadata.create_all(
+            sync, tables=[Appointment.__table__, Prescription.__table__]
+        ))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        visit = lambda id, medecin_id, note: Appointment(
+            id=id, patient_id=10 + id, medecin_id=medecin_id, date=datetime(2024, 5, id), status="done", note=note
+        )
+        session.add_all([
+            visit(1, 1, "Pulpite aiguë sur 36, traitement de canal commencé"),
+            visit(2, 1, "Détartrage, contrôle dans six mois"),
+            visit(3, 1, None),
+            visit(4, 2, "Canal de la 46 à reprendre"),
+        ])
+        session.add_all([
+            Prescription(id=1, appointment_id=1, content="Amoxicilline 1g matin et soir pendant 6 jours, Doliprane si douleur"),
+            Prescription(id=2, appointment_id=3, content="Amoxicilline 500mg, bain de bouche"),
+            Prescription(id=3, appointment_id=4, content="Amoxicilline 1g"),
+        ])
+        await session.commit()
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_search_is_scoped_to_the_doctor_and_highlights_matches(db):
+    hits, cursor = await search_history(db, 1, "amoxicilline", limit=10)
+
+    assert cursor is None
+    assert {(hit.appointment_id, hit.source) for hit in hits} == {(1, "prescription"), (3, "prescription")}
+    assert all("<b>Amoxicilline</b>" in hit.snippet for hit in hits)
+    assert hits[0].rank >= hits[1].rank
+
+
+@pytest.mark.asyncio
+async def test_notes_match_without_accents_and_on_every_term(db):
+    hits, _ = await search_history(db, 1, "traitement canal", limit=10)
+    assert [(hit.appointment_id, hit.source, hit.patient_id) for hit in hits] == [(1, "note", 11)]
+
+    hits, _ = await search_history(db, 1, "detartrage", limit=10)
+    assert [hit.appointment_id for hit in hits] == [2]
+
+
+@pytest.mark.asyncio
+async def test_snippets_escape_the_stored_text(db):
+    await db.execute(update(Appointment).where(Appointment.id == 2).values(
+        note='Détartrage <img src=x onerror=alert(1)> & "contrôle"'
+    ))
+    await db.commit()
+
+    (hit,), _ = await search_history(db, 1, "onerror", limit=10)
+    assert "<img" not in hit.snippet
+    assert "&lt;img src=x <b>onerror</b>=alert(1)&gt; &amp; &quot;contrôle&quot;" in hit.snippet
+
+
+@pytest.mark.asyncio
+async def test_keyset_pages_cover_every_hit_once(db):
+    db.add(Prescription(id=4, appointment_id=2, content="Amoxicilline, Doliprane"))
+    await db.commit()
+    seen, cursor = [], None
+    while True:
+        hits, cursor = await search_history(db, 1, "amoxicilline", limit=1, cursor=cursor)
+        seen += [(hit.appointment_id, hit.source) for hit in hits]
+        if cursor is None:
+            break
+
+    assert len(seen) == 3 and len(set(seen)) == 3
+
+
+@pytest.mark.asyncio
+async def test_index_follows_updates_and_deletes(db):
+    await db.execute(update(Appointment).where(Appointment.id == 2).values(note="Extraction de la 18"))
+    await db.execute(delete(Prescription).where(Prescription.id == 2))
+    await db.commit()
+
+    assert (await search_history(db, 1, "detartrage", limit=10))[0] == []
+    assert [hit.appointment_id for hit in (await search_history(db, 1, "extraction", limit=10))[0]] == [2]
+    assert [hit.appointment_id for hit in (await search_history(db, 1, "amoxicilline", limit=10))[0]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_query_syntax_and_bad_cursors_are_rejected_cleanly(db):
+    assert await search_history(db, 1, '"*) OR', limit=10) == ([], None)
+    assert (await search_history(db, 1, 'canal" OR "x', limit=10))[0] == []
+    with pytest.raises(HTTPException) as error:
+        await search_history(db, 1, "canal", limit=10, cursor="nope")
+    assert error.value.status_code == 400
+
+
+def test_postgres_uses_gin_expression_indexes():
+    (index,) = [i for i in Prescription.__table__.indexes if i.name == "ix_prescriptions_content_fts"]
+    assert str(CreateIndex(index).compile(dialect=postgresql.dialect())) == (
+        "CREATE INDEX ix_prescriptions_content_fts ON prescriptions USING gin (to_tsvector('simple', content))"
+    )
+
+
+def test_migration_creates_the_indexes_the_queries_use():
+    # The app doesn't run create_all: production gets the indexes from the migration
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations", "011_full_text_indexes.sql")) as f:
+        migration = f.read()
+    for model in (Appointment, Prescription):
+        (index,) = [i for i in model.__table__.indexes if i.name.endswith("_fts")]
+        statement = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+        assert statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS") + ";" in migration
@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+from starlette.datastructures import Headers, UploadFile
+from main import app
+from services.uploads import UPLOAD_KINDS, save_upload
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 1024
+
+
+def make_upload(content: bytes, filename: str, content_type: str) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(content),
+        filename=filename,
+        headers=Headers({"content-type": content_type}),
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_upload_writes_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stored = await save_upload(make_upload(JPEG_BYTES, "avatar.jfif", "image/jpeg"), "photo")
+
+    assert stored.path == f"/static/uploads/{stored.content_hash}.jpg"
+    assert stored.size == len(JPEG_BYTES)
+    assert (tmp_path / stored.path.lstrip("/")).read_bytes() == JPEG_BYTES
+    assert os.listdir(tmp_path / "static" / "uploads") == [f"{stored.content_hash}.jpg"]
+    # The partial file was written outside the served directory and moved in
+    assert os.listdir(tmp_path / ".upload-tmp") == []
+
+
+@pytest.mark.asyncio
+async def test_save_upload_deduplicates_identical_content(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = await save_upload(make_upload(JPEG_BYTES, "a.jpg", "image/jpeg"), "photo")
+    second = await save_upload(make_upload(JPEG_BYTES, "b.jpeg", "image/jpeg"), "photo")
+
+    assert first.path == second.path
+    assert len(os.listdir(tmp_path / "static" / "uploads")) == 1
+
+
+@pytest.mark.asyncio
+async def test_save_upload_rejects_wrong_type(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(HTTPException) as exc:
+        await save_upload(make_upload(b"%PDF-1.4", "doc.pdf", "application/pdf"), "photo")
+    assert exc.value.status_code == 415
+
+    with pytest.raises(HTTPException) as exc:
+        await save_upload(make_upload(b"not an image", "fake.jpg", "image/jpeg"), "photo")
+    assert exc.value.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_save_upload_rejects_oversized_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    limit = UPLOAD_KINDS["medicament"].max_bytes
+    with pytest.raises(HTTPException) as exc:
+        await save_upload(make_upload(JPEG_BYTES + b"\x00" * limit, "big.jpg", "image/jpeg"), "medicament")
+    assert exc.value.status_code == 413
+    assert not (tmp_path / "static" / "uploads").exists()
+    assert os.listdir(tmp_path / ".upload-tmp") == []
+
+
+@pytest.mark.asyncio
+async def test_upload_route_rejects_large_body_before_parsing():
+    limit = UPLOAD_KINDS["medicament"].max_bytes
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.post(
+            "/medicaments/upload-medicament-image",
+            files={"file": ("big.jpg", JPEG_BYTES + b"\x00" * (limit * 2), "image/jpeg")},
+        )
+    assert response.status_code == 413
@@ -688,7 +688,7 @@ export function DoctorsList() {
                         <div className="h-10 w-10 rounded-full overflow-hidden bg-gray-200">
                           {doc.photo ? (
                             <Image
-                              src={doc.photo.startsWith("http") ? doc.photo : `http://localhost:8000${doc.photo}`}
+                              src={doc.photo.startsWith("http") ? doc.photo : `http://localhost:8000${doc.photo}?w=80`}
                               alt={`${doc.prenom} ${doc.nom}`}
                               width={40}
                               height={40}
@@ -751,7 +751,7 @@ export function DoctorsList() {
                       <div className="h-16 w-16 rounded-full overflow-hidden bg-gray-200">
                         {doc.photo ? (
                           <Image
-                            src={doc.photo.startsWith("http") ? doc.photo : `http://localhost:8000${doc.photo}`}
+                            src={doc.photo.startsWith("http") ? doc.photo : `http://localhost:8000${doc.photo}?w=128`}
                             alt={`${doc.prenom} ${doc.nom}`}
                             width={64}
                             height={64}
@@ -699,7 +699,7 @@ export function PatientsList() {
                               src={
                                 patient.photo.startsWith("http")
                                   ? patient.photo
-                                  : `http://localhost:8000${patient.photo}`
+                                  : `http://localhost:8000${patient.photo}?w=80`
                               }
                               alt={`${patient.prenom} ${patient.nom}`}
                               width={40}
@@ -761,7 +761,7 @@ export function PatientsList() {
                         {patient.photo ? (
                           <Image
                             src={
-                              patient.photo.startsWith("http") ? patient.photo : `http://localhost:8000${patient.photo}`
+                              patient.photo.startsWith("http") ? patient.photo : `http://localhost:8000${patient.photo}?w=128`
                             }
                             alt={`${patient.prenom} ${patient.nom}`}
                             width={64}